@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+Throughput benchmarks for the main WosCalls workflows, run against MockWosServer.
+
+Each workflow is run under several client configurations and reported as
+records per second and API calls per second, e.g.:
+
+    python benchmark.py --records 1000 --latency 0.02
+
+With --memory, the size of a citation sweep's metadata is compared between a
+list of dictionaries and CompactRecords instead:
+
+    python benchmark.py --memory 20000
+
+With --check-backends, the suds and lxml backends are checked to return the
+same replies and metadata instead:
+
+    python benchmark.py --check-backends
+"""
+from mockwos import MockWosServer
+from woscalls import WosCalls
+from wos import Wos
+from metawos import MetaWos, iter_records
+from recordstore import CompactRecords
+from StringIO import StringIO
+import argparse
+import sys
+import time
+import types
+
+CONFIGURATIONS = [
+    ("suds", {}),
+    ("suds keep-alive", {"keep_alive": True}),
+    ("lxml keep-alive", {"backend": "lxml", "keep_alive": True}),
+    ("lxml keep-alive workers=4", {"backend": "lxml", "keep_alive": True, "workers": 4}),
+]
+
+
+class Benchmark():
+    """Time WosCalls workflows against a local mock WOS server."""
+
+    def __init__(self, server, queries=3, sources=10, rows=20):
+        """
+        Establish benchmark sizes.
+
+        Positional arguments:
+        server (MockWosServer) -- running mock server.
+
+        Keyword arguments:
+        queries (int) -- topic queries per search run.
+        sources (int) -- records to fetch citations for in citation runs.
+        rows (int) -- known-item rows in exact match runs.
+        """
+        self.server = server
+        self.queries = ["TS=(perennial NEAR/1 grain{0})".format(i) for i in range(queries)]
+        self.sources = sources
+        self.rows = rows
+        self.results = []
+        self.wosc = None
+
+    def _calls(self, search_client, options, search_queries=None, search_term_sets=None):
+        self.wosc = WosCalls(search_queries=search_queries, search_term_sets=search_term_sets, sleep_time=0,
+                             search_client=search_client, base_url=self.server.base_url, **options)
+        return self.wosc
+
+    def search(self, options):
+        wosc = self._calls("Search", options, search_queries=self.queries)
+        wosc.get_all_search_results()
+        return len(wosc.wos.metadata_collection["search_results"])
+
+    def lite_search(self, options):
+        wosc = self._calls("Lite", options, search_queries=self.queries)
+        wosc.get_all_search_results()
+        return len(wosc.wos.metadata_collection["search_results"])
+
+    def citing_articles(self, options):
+        wosc = self._calls("Search", options, search_queries=self.queries[:1])
+        wosc.wos.metadata_collection["search_results"] = self._sources()
+        wosc.get_citing_articles()
+        return len(wosc.wos.metadata_collection["forward_citations"])
+
+    def cited_references(self, options):
+        wosc = self._calls("Search", options, search_queries=self.queries[:1])
+        wosc.wos.metadata_collection["search_results"] = self._sources()
+        wosc.get_cited_references()
+        collection = wosc.wos.metadata_collection
+        return len(collection["backward_citations"]) + len(collection["hot_records"])
+
+    def exact_match(self, options):
+        wosc = self._calls("Lite", options, search_term_sets=self._rows())
+        wosc.find_exact_match()
+        return sum(len(matches) for matches in wosc.article_data.values())
+
+    def _sources(self):
+        return [{"accession_number": self.server.record_uid("sources", i)} for i in range(self.sources)]
+
+    def _rows(self):
+        """Build known-item rows whose volume and page match one of their query's results."""
+        rows = []
+        for i in range(self.rows):
+            query = "AU=(Author{0}) AND PY=2001 AND SO=(J* Test*)".format(i)
+            fields = self.server.record_fields(self.server.record_uid(query, 1))
+            rows.append({"id": str(i), "query": query, "volume": fields["volume"],
+                         "page": fields["pages"].split("-")[0]})
+        return rows
+
+    def run(self, workflows, configurations=CONFIGURATIONS):
+        """
+        Time each workflow under each configuration.
+
+        returns:
+            (list): dictionaries with workflow, configuration, records, calls,
+                seconds, records_per_second and calls_per_second.
+        """
+        for workflow in workflows:
+            for name, options in configurations:
+                self.server.reset_counts()
+                stdout = sys.stdout
+                sys.stdout = StringIO()
+                try:
+                    start = time.time()
+                    records = getattr(self, workflow)(options)
+                    seconds = time.time() - start
+                finally:
+                    sys.stdout = stdout
+                    if hasattr(self.wosc.wos.transport, "close"):
+                        self.wosc.wos.transport.close()
+                calls = self.server.total_calls
+                self.results.append({"workflow": workflow, "configuration": name, "records": records,
+                                     "calls": calls, "seconds": seconds,
+                                     "records_per_second": records / seconds,
+                                     "calls_per_second": calls / seconds})
+                self.report(self.results[-1])
+        return self.results
+
+    def report(self, result):
+        print "{workflow:<18} {configuration:<28} {records:>7} records {calls:>5} calls {seconds:>8.2f} s " \
+              "{records_per_second:>9.1f} rec/s {calls_per_second:>7.1f} calls/s".format(**result)
+
+
+def deep_size(value, seen=None):
+    """Return bytes used by value and all objects it references, counting shared objects once."""
+    if seen is None:
+        seen = set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set)):
+        size += sum(deep_size(v, seen) for v in value)
+    elif isinstance(value, types.InstanceType):
+        size += deep_size(value.__dict__, seen)
+    return size
+
+
+def memory(server, records, sources=10):
+    """
+    Compare memory used by forward citation metadata in a list and in CompactRecords.
+
+    Positional arguments:
+    server (MockWosServer) -- server generating the records.
+    records (int) -- citing records to compile, spread over sources.
+    """
+    containers = [("list of dicts", []), ("CompactRecords", CompactRecords())]
+    for source in range(sources):
+        source_id = server.record_uid("sources", source)
+        uids = [server.record_uid("cites:" + source_id, i) for i in range(records // sources)]
+        for start in range(0, len(uids), 100):
+            for record in iter_records(server.full_records(uids[start:start + 100])):
+                metadata = MetaWos(record, source_id).compile_metadata()
+                metadata["source_id"] = source_id
+                for name, container in containers:
+                    container.append(dict(metadata))
+    for name, container in containers:
+        size = deep_size(container)
+        print "{0:<18} {1:>7} records {2:>9.1f} MB {3:>7} bytes/record".format(
+            name, len(container), size / 1024.0 ** 2, size // len(container))
+
+
+def plain(value):
+    """Return a suds or SoapObject result as nested dicts and lists, with each value's type name."""
+    if isinstance(value, (list, tuple)):
+        return [plain(item) for item in value]
+    if isinstance(value, dict):
+        return dict((key, plain(item)) for key, item in value.items())
+    if hasattr(value, "__keylist__"):
+        return dict((key, plain(item)) for key, item in value)
+    return type(value).__name__, value
+
+
+def check_backends(server, sources=3):
+    """
+    Check that the lxml backend returns what suds does.
+
+    Raw replies are compared for single and repeated return operations, then
+    the metadata and exact matches compiled by each benchmark workflow.
+
+    Positional arguments:
+    server (MockWosServer) -- running mock server.
+
+    returns:
+        (list): names of the checks that differ.
+    """
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        replies, compiled = _compile_backends(server, sources)
+    finally:
+        sys.stdout = stdout
+    differences = ["{0} reply".format(name) for name in sorted(replies["suds"])
+                   if replies["suds"][name] != replies["lxml"][name]]
+    differences += ["{0} workflow".format(name) for name in WORKFLOWS
+                    if compiled["suds"][name] != compiled["lxml"][name]]
+    for name in ["{0} reply".format(name) for name in sorted(replies["suds"])] + \
+            ["{0} workflow".format(name) for name in WORKFLOWS]:
+        print "{0:<32} {1}".format(name, "differs" if name in differences else "same")
+    return differences
+
+
+def _compile_backends(server, sources):
+    """Return raw replies and compiled workflow data of each backend."""
+    replies = {}
+    for backend in ("suds", "lxml"):
+        wos = Wos(base_url=server.base_url, backend=backend, sleep_time=0)
+        wos.authorize()
+        rp = wos.retrieve_parameters(count=5)
+        wos.cited_references(server.record_uid("sources", 0), rp, get_full_records=False)
+        cited_references = wos.search_results
+        wos.cited_references_retrieve(cited_references.queryId)
+        retrieved = wos.search_results
+        wos.query_parameters("TS=(perennial NEAR/1 grain)")
+        wos.search(wos.qp, rp, get_metadata=False, all_pages=False)
+        replies[backend] = {"search": plain(wos.search_results), "citedReferences": plain(cited_references),
+                            "citedReferencesRetrieve": plain(retrieved)}
+        for reply in replies[backend].values():
+            # Query IDs differ from search to search; only their type is compared.
+            if isinstance(reply, dict) and "queryId" in reply:
+                reply["queryId"] = reply["queryId"][0]
+        if hasattr(wos.transport, "close"):
+            wos.transport.close()
+
+    benchmark = Benchmark(server, queries=1, sources=sources, rows=5)
+    compiled = {"suds": {}, "lxml": {}}
+    for workflow in WORKFLOWS:
+        for backend in compiled:
+            getattr(benchmark, workflow)({"backend": backend})
+            wosc = benchmark.wosc
+            collection = dict((category, list(records)) for category, records
+                              in wosc.wos.metadata_collection.items())
+            compiled[backend][workflow] = plain((collection, getattr(wosc, "article_data", None)))
+            if hasattr(wosc.wos.transport, "close"):
+                wosc.wos.transport.close()
+    return replies, compiled
+
+
+WORKFLOWS = ["search", "lite_search", "citing_articles", "cited_references", "exact_match"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=1000, help="results per topic query")
+    parser.add_argument("--latency", type=float, default=0.01, help="mock server latency per call in seconds")
+    parser.add_argument("--abstract-words", type=int, default=150, help="abstract length, controlling record size")
+    parser.add_argument("--throttle-every", type=int, default=0, help="throttle every nth call")
+    parser.add_argument("--workflows", nargs="+", default=WORKFLOWS, choices=WORKFLOWS)
+    parser.add_argument("--memory", type=int, metavar="RECORDS", help="compare record container sizes instead")
+    parser.add_argument("--check-backends", action="store_true", help="compare suds and lxml results instead")
+    args = parser.parse_args()
+
+    def records_found(query):
+        # Known-item searches find a handful of candidates, topic searches many records.
+        return 3 if query.startswith("AU=") else args.records
+
+    with MockWosServer(records_found=records_found, latency=args.latency, abstract_words=args.abstract_words,
+                       throttle_every=args.throttle_every) as server:
+        if args.memory:
+            memory(server, args.memory)
+        elif args.check_backends:
+            sys.exit(1 if check_backends(server) else 0)
+        else:
+            Benchmark(server).run(args.workflows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+from suds.sudsobject import Object
+import json
+import os
+import threading
+
+
+def to_plain(value):
+    """
+    Convert metadata to JSON-serializable values.
+
+    Lite records contain suds objects, e.g. labelValuesPair; these become
+    dictionaries that can still be read with the same keys.
+
+    Positional arguments:
+    value -- metadata value to convert.
+    """
+    if isinstance(value, Object):
+        return dict((k, to_plain(v)) for k, v in value)
+    if isinstance(value, dict):
+        return dict((k, to_plain(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return [to_plain(v) for v in value]
+    return value
+
+
+class CheckpointJournal():
+    """Durable record of completed work in long batch runs.
+
+    Each completed result page, and each completed query or UID, is appended to
+    a JSON lines file together with the metadata it produced. A restarted run
+    loads the journal, restores finished work from it and continues from the
+    last completed page.
+
+    Entries are identified by a task (e.g. "search_results" or
+    "forward_citations") and a key (the query string or UID).
+    """
+
+    def __init__(self, path):
+        """
+        Load existing journal.
+
+        Positional arguments:
+        path (str) -- journal file; created on first write if missing.
+        """
+        self.path = path
+        self.pages = {}
+        self.completed = {}
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            self._load()
+        self.fh = open(path, "a")
+
+    def _load(self):
+        """Read journal entries, ignoring a final line cut short by a crash."""
+        with open(self.path, "r") as fh:
+            for line in fh:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                task_key = (entry["task"], entry["key"])
+                if "page" in entry:
+                    self.pages.setdefault(task_key, {})[entry["page"]] = entry["metadata"]
+                else:
+                    self.completed[task_key] = entry.get("result")
+
+    def _append(self, entry):
+        with self.lock:
+            self.fh.write(json.dumps(entry) + "\n")
+            self.fh.flush()
+            os.fsync(self.fh.fileno())
+
+    def record_page(self, task, key, page, metadata):
+        """
+        Record a completed result page.
+
+        Positional arguments:
+        task (str) -- kind of work, e.g. "search_results".
+        key (str) -- query string or UID the page belongs to.
+        page (int) -- page number, starting at 1.
+        metadata (dict) -- records produced by the page, by metadata_collection category.
+        """
+        metadata = to_plain(metadata)
+        self.pages.setdefault((task, key), {})[page] = metadata
+        self._append({"task": task, "key": key, "page": page, "metadata": metadata})
+
+    def page(self, task, key, page):
+        """Return metadata recorded for a page, or None if it was not completed."""
+        return self.pages.get((task, key), {}).get(page)
+
+    def complete(self, task, key, result=None):
+        """
+        Record that all work for a query or UID is finished.
+
+        Positional arguments:
+        task (str) -- kind of work, e.g. "search_results".
+        key (str) -- query string or UID.
+
+        Keyword arguments:
+        result -- JSON-serializable summary to restore on restart, e.g. a result count.
+        """
+        result = to_plain(result)
+        self.completed[(task, key)] = result
+        self._append({"task": task, "key": key, "result": result})
+
+    def is_complete(self, task, key):
+        """Check whether all work for a query or UID was finished."""
+        return (task, key) in self.completed
+
+    def result(self, task, key):
+        """Return summary recorded when a query or UID was completed."""
+        return self.completed.get((task, key))
+
+    def replay(self, task, key, store):
+        """
+        Restore metadata of all recorded pages for a query or UID.
+
+        Positional arguments:
+        task (str) -- kind of work, e.g. "search_results".
+        key (str) -- query string or UID.
+        store (callable) -- called with each page's category and records, e.g. Wos.store_records.
+        """
+        pages = self.pages.get((task, key), {})
+        for page in sorted(pages):
+            for category, records in pages[page].items():
+                store(category, records)
+
+    def close(self):
+        """Close journal file."""
+        self.fh.close()
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+from array import array
+from collections import deque
+from itertools import izip
+import re
+
+# Bare WOS accession number, as in the docid of some cited references.
+ACCESSION_NUMBER = re.compile(r"^\d{15}$")
+
+
+def node_key(uid):
+    """
+    Return the node key of a UID or cited reference docid.
+
+    A docid that is a bare accession number gets the WOS: prefix, so a cited
+    reference and the record it points to are one node.
+    """
+    uid = uid.strip()
+    return "WOS:" + uid if ACCESSION_NUMBER.match(uid) else uid
+
+
+def _csr(sources, targets, nodes):
+    """
+    Build compressed sparse row adjacency from parallel edge arrays.
+
+    Each node's neighbours are sorted and duplicate edges dropped.
+
+    returns:
+        (tuple): offsets array of nodes + 1 entries, and neighbours array;
+            the neighbours of node i are neighbours[offsets[i]:offsets[i + 1]].
+    """
+    counts = array("l", [0]) * (nodes + 1)
+    for source in sources:
+        counts[source + 1] += 1
+    for i in xrange(nodes):
+        counts[i + 1] += counts[i]
+
+    unsorted = array("i", [0]) * len(sources)
+    position = array("l", counts)
+    for source, target in izip(sources, targets):
+        unsorted[position[source]] = target
+        position[source] += 1
+
+    offsets = array("l", [0]) * (nodes + 1)
+    neighbours = array("i")
+    for i in xrange(nodes):
+        start, end = counts[i], counts[i + 1]
+        if end - start > 1:
+            neighbours.extend(sorted(set(unsorted[start:end])))
+        else:
+            neighbours.extend(unsorted[start:end])
+        offsets[i + 1] = len(neighbours)
+    return offsets, neighbours
+
+
+class CitationGraph():
+    """Directed citation graph of harvested records, stored as CSR adjacency arrays.
+
+    Nodes are UIDs (or docids of cited references) mapped to consecutive
+    integer IDs, with docids that are bare accession numbers keyed as UIDs;
+    an edge runs from a citing record to the record it cites.
+    Edges are collected with add_edge or from forward_citations and
+    backward_citations records, then compiled by build into offset and
+    neighbour arrays in both directions, using a few bytes per edge so
+    millions of edges fit in memory on one machine.
+
+    Queries rebuild the arrays when edges were added since the last build.
+    """
+
+    def __init__(self):
+        self.uids = []
+        self.ids = {}
+        self.sources = array("i")
+        self.targets = array("i")
+        self.out_offsets = self.out_neighbours = None
+        self.in_offsets = self.in_neighbours = None
+        self._built_edges = None
+
+    def node(self, uid):
+        """Return integer ID of uid, adding it as a node if new."""
+        uid = node_key(uid)
+        node = self.ids.get(uid)
+        if node is None:
+            node = self.ids[uid] = len(self.uids)
+            self.uids.append(uid)
+        return node
+
+    def add_edge(self, citing, cited):
+        """
+        Add a citation.
+
+        Positional arguments:
+        citing (str) -- UID of the citing record.
+        cited (str) -- UID of the cited record.
+        """
+        self.sources.append(self.node(citing))
+        self.targets.append(self.node(cited))
+
+    def add_forward_citations(self, records):
+        """
+        Add edges from forward_citations records, each citing its source_id.
+
+        Positional arguments:
+        records (iterable) -- metadata_collection["forward_citations"] or equivalent dictionaries.
+        """
+        for record in records:
+            self.add_edge(record.get("accession_number") or record.get("uid"), record["source_id"])
+
+    def add_backward_citations(self, records, reference_key="docid"):
+        """
+        Add edges from backward_citations records, each cited by its source_id.
+
+        hot_records can be added too: their UID identifies the cited record.
+
+        Positional arguments:
+        records (iterable) -- metadata_collection["backward_citations"] or ["hot_records"], or equivalent dictionaries.
+
+        Keyword arguments:
+        reference_key (str) -- field identifying a cited reference without a UID.
+        """
+        for record in records:
+            reference = record.get("accession_number") or record.get("uid") or record.get(reference_key)
+            if reference and reference != "NONE":
+                self.add_edge(record["source_id"], reference)
+
+    def build(self):
+        """Compile added edges into CSR adjacency in both directions."""
+        nodes = len(self.uids)
+        self.out_offsets, self.out_neighbours = _csr(self.sources, self.targets, nodes)
+        self.in_offsets, self.in_neighbours = _csr(self.targets, self.sources, nodes)
+        self._built_edges = len(self.sources)
+        return self
+
+    def _built(self):
+        if self._built_edges != len(self.sources):
+            self.build()
+
+    def __len__(self):
+        return len(self.uids)
+
+    def __contains__(self, uid):
+        return node_key(uid) in self.ids
+
+    def edge_count(self):
+        """Return number of distinct edges."""
+        self._built()
+        return len(self.out_neighbours)
+
+    def out_degree(self, uid):
+        """Return number of records uid cites."""
+        self._built()
+        node = self.ids[node_key(uid)]
+        return self.out_offsets[node + 1] - self.out_offsets[node]
+
+    def in_degree(self, uid):
+        """Return number of records citing uid."""
+        self._built()
+        node = self.ids[node_key(uid)]
+        return self.in_offsets[node + 1] - self.in_offsets[node]
+
+    def degrees(self, direction="in"):
+        """
+        Return degree of every node, indexed by integer node ID.
+
+        Keyword arguments:
+        direction (str) -- "in" for times cited within the graph, "out" for references.
+        """
+        self._built()
+        offsets = self.in_offsets if direction == "in" else self.out_offsets
+        return array("l", (offsets[i + 1] - offsets[i] for i in xrange(len(self.uids))))
+
+    def most_cited(self, count=10):
+        """Return (uid, in-degree) pairs of the count most cited nodes."""
+        degrees = self.degrees("in")
+        top = sorted(xrange(len(degrees)), key=degrees.__getitem__, reverse=True)[:count]
+        return [(self.uids[node], degrees[node]) for node in top]
+
+    def _adjacent(self, node, offsets, neighbours):
+        return neighbours[offsets[node]:offsets[node + 1]]
+
+    def references(self, uid):
+        """Return UIDs cited by uid."""
+        self._built()
+        return [self.uids[n] for n in self._adjacent(self.ids[node_key(uid)], self.out_offsets, self.out_neighbours)]
+
+    def cited_by(self, uid):
+        """Return UIDs citing uid."""
+        self._built()
+        return [self.uids[n] for n in self._adjacent(self.ids[node_key(uid)], self.in_offsets, self.in_neighbours)]
+
+    def neighborhood(self, uid, hops=1, direction="both"):
+        """
+        Return nodes within a number of citation hops of uid.
+
+        Positional arguments:
+        uid (str) -- starting node.
+
+        Keyword arguments:
+        hops (int) -- maximum path length.
+        direction (str) -- "out" to follow references, "in" to follow citing records, or "both".
+
+        returns:
+            (dict): hop distance of each reached UID, excluding uid itself.
+        """
+        self._built()
+        adjacency = []
+        if direction in ("out", "both"):
+            adjacency.append((self.out_offsets, self.out_neighbours))
+        if direction in ("in", "both"):
+            adjacency.append((self.in_offsets, self.in_neighbours))
+
+        start = self.ids[node_key(uid)]
+        distance = {start: 0}
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            if distance[node] == hops:
+                continue
+            for offsets, neighbours in adjacency:
+                for neighbour in self._adjacent(node, offsets, neighbours):
+                    if neighbour not in distance:
+                        distance[neighbour] = distance[node] + 1
+                        queue.append(neighbour)
+        del distance[start]
+        return dict((self.uids[node], hops) for node, hops in distance.items())
+
+    def edges(self):
+        """Yield (citing, cited) UID pairs of all distinct edges."""
+        self._built()
+        for node in xrange(len(self.uids)):
+            citing = self.uids[node]
+            for neighbour in self._adjacent(node, self.out_offsets, self.out_neighbours):
+                yield citing, self.uids[neighbour]
+
+    def write_edge_list(self, path, delimiter="\t"):
+        """
+        Write edges as lines of citing and cited UID, e.g. for networkx or Gephi.
+
+        Positional arguments:
+        path (str) -- file to write.
+
+        Keyword arguments:
+        delimiter (str) -- separator between the two UIDs.
+        """
+        with open(path, "w") as fh:
+            for citing, cited in self.edges():
+                fh.write(u"{0}{1}{2}\n".format(citing, delimiter, cited).encode("utf8"))
@@ -1,9 +1,129 @@
+from lxml import etree
+
+FULL_RECORD = "{http://scientific.thomsonreuters.com/schema/wok5.4/public/FullRecord}"
+
+# Location of each metadata element within a REC element.
+XPATHS = {
+    "accession_number": "UID",
+    "authors": "static_data/summary/names/name[@role='author']/full_name",
+    "title": "static_data/summary/titles/title[@type='item']",
+    "publication_name": "static_data/summary/titles/title[@type='source']",
+    "date": "static_data/summary/pub_info",
+    "abstract": "static_data/fullrecord_metadata/abstracts/abstract/abstract_text/p",
+    "doi": "dynamic_data/cluster_related/identifiers/identifier",
+    "author_address": "static_data/fullrecord_metadata/addresses/address_name/address_spec/full_address",
+    "keywords": "static_data/fullrecord_metadata/keywords/keyword",
+    "keywords_plus": "static_data/item/keywords_plus/keyword",
+    "funding_agency": "static_data/fullrecord_metadata/fund_ack/grants/grant/grant_agency",
+    "grant_id": "static_data/fullrecord_metadata/fund_ack/grants/grant/grant_ids/grant_id",
+    "times_cited": "dynamic_data/citation_related/tc_list/silo_tc",
+    "citation_count": "static_data/fullrecord_metadata/refs",
+}
+
+# Record sections (viewField fieldName values) each metadata element is read from.
+# UID and the dynamic_data of times_cited are returned with every record.
+VIEW_FIELDS = {
+    "accession_number": [],
+    "authors": ["names"],
+    "title": ["titles"],
+    "publication_name": ["titles"],
+    "date": ["pub_info"],
+    "abstract": ["abstracts"],
+    "doi": ["identifiers"],
+    "author_address": ["addresses"],
+    "keywords": ["keywords"],
+    "keywords_plus": ["keywords_plus"],
+    "funding_agency": ["fund_ack"],
+    "grant_id": ["fund_ack"],
+    "times_cited": [],
+    "citation_count": ["refs"],
+}
+
+METADATA_ELEMENTS = ["accession_number", "authors", "title", "publication_name", "date", "abstract", "doi",
+                     "author_address", "keywords", "keywords_plus", "funding_agency", "grant_id", "times_cited",
+                     "citation_count"]
+
+
+def view_fields(metadata_elements):
+    """
+    Return the viewField names needed to compile metadata_elements, in a stable order.
+
+    At least one section is always requested, so the viewField is never empty.
+
+    Positional arguments:
+    metadata_elements (list) -- controlled metadata element names, see XPATHS.
+    """
+    fields = sorted(set(field for element in metadata_elements for field in VIEW_FIELDS[element]))
+    return fields or ["pub_info"]
+
+
+# XPath step selecting the value of a matched element; its leading text (.text) if not listed.
+VALUES = {
+    "date": "/@pubyear",
+    "times_cited": "/@local_count",
+    "citation_count": "/@count",
+    "doi": "[@type='doi' or @type='xref_doi']/@value",
+}
+
+# First text node of an element, if it comes before any child.
+TEXT = "/text()[1][not(preceding-sibling::node())]"
+
+
+def compile_extractor(element):
+    """
+    Compile the XPath returning the values of a metadata element within a REC element.
+
+    Values are returned as plain strings, so no element objects are created.
+    An element's value is its text before any child, as with lxml's .text, so
+    mixed content such as <title><i>In vivo</i> study</title> has no value.
+
+    Positional arguments:
+    element (str) -- controlled metadata element name, see XPATHS.
+    """
+    path = "/".join("wok:" + step for step in XPATHS[element].split("/"))
+    return etree.XPath(path + VALUES.get(element, TEXT),
+                       namespaces={"wok": FULL_RECORD[1:-1]}, smart_strings=False)
+
+
+# Extractors are compiled once per process and shared by all records.
+EXTRACTORS = dict((element, compile_extractor(element)) for element in XPATHS)
+
+
+def iter_records(records, chunk_size=65536):
+    """
+    Parse the REC elements of a FullRecord records string one at a time.
+
+    The string is fed to the parser in chunks and each record is yielded once
+    its end tag is parsed. It is cleared, and removed from the partial tree
+    with the records before it, when the next one is requested, so memory use
+    stays flat however many records a page holds.
+
+    Each record element is only valid until the next one is requested: read
+    it, e.g. with MetaWos(record, query).compile_metadata(), before advancing.
+    Collecting the elements, as list(iter_records(records)) does, yields
+    emptied elements; parse with etree.fromstring to keep whole records.
+
+    Positional arguments:
+    records (str) -- records XML as returned by the search and retrieve services.
+
+    Keyword arguments:
+    chunk_size (int) -- characters fed to the parser at a time.
+    """
+    parser = etree.XMLPullParser(events=("end",), tag=FULL_RECORD + "REC")
+    for start in xrange(0, len(records), chunk_size):
+        parser.feed(records[start:start + chunk_size])
+        for event, record in parser.read_events():
+            yield record
+            record.clear()
+            while record.getprevious() is not None:
+                del record.getparent()[0]
+    parser.close()
 
 
 class MetaWos():
     """Process individual records of WOS metadata.
 
-    This class is designed to work with metadata as returned by the 
+    This class is designed to work with metadata as returned by the
     WOS premium API. The lite API operates differently.
     """
 
@@ -11,26 +131,9 @@ class MetaWos():
         """Establish record."""
         self.record = record
         self.query = query
-        self.xpaths = {
-                       "accession_number": "UID",
-                       "authors": "static_data/summary/names/name[@role='author']/full_name",
-                       "title": "static_data/summary/titles/title[@type='item']",
-                       "publication_name": "static_data/summary/titles/title[@type='source']",
-                       "date": "static_data/summary/pub_info",
-                       "abstract": "static_data/fullrecord_metadata/abstracts/abstract/abstract_text/p",
-                       "doi": "dynamic_data/cluster_related/identifiers/identifier",
-                       "author_address": "static_data/fullrecord_metadata/addresses/address_name/address_spec/full_address",
-                       "keywords": "static_data/fullrecord_metadata/keywords/keyword",
-                       "keywords_plus": "static_data/item/keywords_plus/keyword",
-                       "funding_agency": "static_data/fullrecord_metadata/fund_ack/grants/grant/grant_agency",
-                       "grant_id": "static_data/fullrecord_metadata/fund_ack/grants/grant/grant_ids/grant_id",
-                       "times_cited": "dynamic_data/citation_related/tc_list/silo_tc",
-                       "citation_count": "static_data/fullrecord_metadata/refs",
-        }
-
-
-    def compile_metadata(self, include_connected_uid=False, metadata_elements=["accession_number", "authors", "title", "publication_name", "date", "abstract", "doi", "author_address", 
-                                                                               "keywords", "keywords_plus", "funding_agency", "grant_id", "times_cited", "citation_count"]):
+        self.xpaths = XPATHS
+
+    def compile_metadata(self, include_connected_uid=False, metadata_elements=METADATA_ELEMENTS):
         """
         Take list of desired metadata elements and compile into dictionary.
 
@@ -40,58 +143,7 @@ class MetaWos():
         self.metadata = {"query": self.query}
 
         for element in metadata_elements:
-            self.element = element
-            self.get_data(self.xpaths[element])
-            #print self.element, self.data
-            self.metadata[element] = "; ".join(self.data)
+            values = [value.replace("\t", "") for value in EXTRACTORS[element](self.record)]
+            self.metadata[element] = "; ".join(values or ["NONE"])
 
         return self.metadata
-
-    def get_data(self, xpath):
-
-        self.data = []
-        self.data_source = self.record.findall("{http://scientific.thomsonreuters.com/schema/wok5.4/public/FullRecord}"+xpath.replace("/", "/{http://scientific.thomsonreuters.com/schema/wok5.4/public/FullRecord}"))
-        if self.data_source <> [None]:
-            self._parse_result() 
-
-        else:
-            self.data = ["NONE"]
-
-    def _parse_result(self):
-        """Get element value and store."""
-        for d in self.data_source:
-            if self.element == "date":
-                # print d.attrib
-                value = d.get("pubyear")
-            elif self.element == "times_cited":
-                value = d.get("local_count")
-            elif self.element == "citation_count":
-                value = d.get("count")
-            elif self.element == "doi":
-                id_result = self._get_doi(d)
-                if id_result:
-                    value = id_result
-                else:
-                    value = None
-            else:
-                value = d.text
-
-            if value is not None:
-                self.data.append(value.replace("\t", ""))
-
-        if not self.data:
-            self.data.append("NONE")
-
-    def _get_doi(self, element):
-        """
-        Check if ID is DOI and get value if so.
-
-        Positional arguments:
-        element (lxml element) -- ID element to evaluate.
-        """
-        id_type = element.get("type")
-        if id_type == "doi" or id_type == "xref_doi":
-            return element.get("value")
-
-        else:
-            return
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+from suds.plugin import MessagePlugin
+from contextlib import contextmanager
+import json
+import threading
+import time
+
+# Upper bounds, in seconds, of the call latency histogram buckets.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class MessageSizes(MessagePlugin):
+    """suds plugin keeping the request and reply sizes of the last call made by each thread."""
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def reset(self):
+        """Forget this thread's last sizes before a new call."""
+        self.local.sent = 0
+        self.local.received = 0
+
+    def sending(self, context):
+        self.local.sent = len(context.envelope)
+
+    def received(self, context):
+        self.local.received = len(context.reply or "")
+
+    def last(self):
+        """
+        Return sizes of this thread's last call.
+
+        returns:
+            (tuple): request and reply bytes.
+        """
+        return getattr(self.local, "sent", 0), getattr(self.local, "received", 0)
+
+    def __deepcopy__(self, memo={}):
+        # suds deep-copies plugins when cloning a client; keep one plugin.
+        return self
+
+
+class WosMetrics():
+    """Counters and timings describing where a harvest spends its time.
+
+    Per SOAP operation, the number of calls, failed calls, throttle retries and
+    calls answered from the response cache are counted, together with a latency
+    histogram and request and reply bytes. Time spent waiting on the rate
+    limiter and in named processing stages, e.g. "parse" and "compile_metadata",
+    is summed across operations.
+
+    One instance may be shared between threads and Wos instances. Results can
+    be exported with snapshot, to_json or prometheus.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+        Establish empty counters.
+
+        Keyword arguments:
+        buckets (tuple) -- ascending upper bounds, in seconds, of the latency histogram buckets.
+        """
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.operations = {}
+        self.stages = {}
+        self.sleep_seconds = 0.0
+
+    def _operation(self, operation):
+        if operation not in self.operations:
+            self.operations[operation] = {"calls": 0,
+                                          "errors": 0,
+                                          "retries": 0,
+                                          "cached": 0,
+                                          "request_bytes": 0,
+                                          "response_bytes": 0,
+                                          "latency_seconds": 0.0,
+                                          "latency_buckets": [0] * (len(self.buckets) + 1)}
+        return self.operations[operation]
+
+    def call(self, operation, seconds, request_bytes=0, response_bytes=0, error=False):
+        """
+        Record one call sent to the API.
+
+        Positional arguments:
+        operation (str) -- SOAP operation name, e.g. "search".
+        seconds (float) -- time from sending the request to having the parsed result.
+
+        Keyword arguments:
+        request_bytes (int) -- size of the request envelope.
+        response_bytes (int) -- size of the reply.
+        error (bool) -- whether the call raised an error, including throttling.
+        """
+        bucket = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                bucket = i
+                break
+        with self.lock:
+            counts = self._operation(operation)
+            counts["calls"] += 1
+            counts["latency_seconds"] += seconds
+            counts["latency_buckets"][bucket] += 1
+            counts["request_bytes"] += request_bytes
+            counts["response_bytes"] += response_bytes
+            if error:
+                counts["errors"] += 1
+
+    def retry(self, operation):
+        """Record a call repeated after being throttled."""
+        with self.lock:
+            self._operation(operation)["retries"] += 1
+
+    def cached(self, operation):
+        """Record a call answered from the response cache."""
+        with self.lock:
+            self._operation(operation)["cached"] += 1
+
+    def slept(self, seconds):
+        """Record time spent waiting on the rate limiter."""
+        if seconds:
+            with self.lock:
+                self.sleep_seconds += seconds
+
+    def stage(self, name, seconds, count=1):
+        """
+        Record time spent in a processing stage.
+
+        Positional arguments:
+        name (str) -- stage name, e.g. "parse" or "compile_metadata".
+        seconds (float) -- time spent.
+
+        Keyword arguments:
+        count (int) -- items processed, e.g. records compiled.
+        """
+        with self.lock:
+            totals = self.stages.setdefault(name, {"seconds": 0.0, "count": 0})
+            totals["seconds"] += seconds
+            totals["count"] += count
+
+    @contextmanager
+    def timed(self, name, count=1):
+        """Record the time spent in a with block as stage name."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.stage(name, time.time() - start, count)
+
+    def reset(self):
+        """Clear all counters."""
+        with self.lock:
+            self.started = time.time()
+            self.operations = {}
+            self.stages = {}
+            self.sleep_seconds = 0.0
+
+    def snapshot(self):
+        """
+        Report all counters.
+
+        returns:
+            (dict): elapsed seconds, sleep seconds, stage totals, and per-operation
+                counters with latency histogram buckets keyed by upper bound.
+        """
+        with self.lock:
+            operations = {}
+            for operation, counts in self.operations.items():
+                counts = dict(counts)
+                bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+                counts["latency_buckets"] = dict(zip(bounds, counts["latency_buckets"]))
+                counts["mean_latency_seconds"] = counts["latency_seconds"] / counts["calls"] if counts["calls"] else 0.0
+                operations[operation] = counts
+            return {"elapsed_seconds": time.time() - self.started,
+                    "sleep_seconds": self.sleep_seconds,
+                    "stages": dict((name, dict(totals)) for name, totals in self.stages.items()),
+                    "operations": operations}
+
+    def to_json(self, **kwargs):
+        """Return snapshot as a JSON string; kwargs are passed to json.dumps."""
+        return json.dumps(self.snapshot(), sort_keys=True, **kwargs)
+
+    def prometheus(self, prefix="wos"):
+        """
+        Return counters in the Prometheus text exposition format.
+
+        Keyword arguments:
+        prefix (str) -- metric name prefix.
+        """
+        snapshot = self.snapshot()
+        operations = sorted(snapshot["operations"].items())
+        lines = []
+
+        def metric(name, kind, description, samples):
+            lines.append("# HELP {0}_{1} {2}".format(prefix, name, description))
+            lines.append("# TYPE {0}_{1} {2}".format(prefix, name, kind))
+            for suffix, labels, value in samples:
+                label_text = ",".join('{0}="{1}"'.format(k, v) for k, v in labels)
+                lines.append("{0}_{1}{2}{3} {4}".format(prefix, name, suffix,
+                                                        "{" + label_text + "}" if label_text else "", repr(value)))
+
+        for name, key, description in (("calls_total", "calls", "SOAP calls sent to the API."),
+                                       ("errors_total", "errors", "SOAP calls that raised an error."),
+                                       ("retries_total", "retries", "Calls repeated after throttling."),
+                                       ("cached_total", "cached", "Calls answered from the response cache."),
+                                       ("request_bytes_total", "request_bytes", "Bytes of request envelopes sent."),
+                                       ("response_bytes_total", "response_bytes", "Bytes of replies received.")):
+            metric(name, "counter", description,
+                   [("", [("operation", operation)], counts[key]) for operation, counts in operations])
+
+        samples = []
+        for operation, counts in operations:
+            cumulative = 0
+            for bound in [str(bound) for bound in self.buckets] + ["+Inf"]:
+                cumulative += counts["latency_buckets"][bound]
+                samples.append(("_bucket", [("operation", operation), ("le", bound)], cumulative))
+            samples.append(("_sum", [("operation", operation)], counts["latency_seconds"]))
+            samples.append(("_count", [("operation", operation)], counts["calls"]))
+        metric("call_latency_seconds", "histogram", "Time taken by SOAP calls.", samples)
+
+        metric("sleep_seconds_total", "counter", "Time spent waiting on the rate limiter.",
+               [("", [], snapshot["sleep_seconds"])])
+        stages = sorted(snapshot["stages"].items())
+        metric("stage_seconds_total", "counter", "Time spent in processing stages.",
+               [("", [("stage", name)], totals["seconds"]) for name, totals in stages])
+        metric("stage_items_total", "counter", "Items handled by processing stages.",
+               [("", [("stage", name)], totals["count"]) for name, totals in stages])
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,588 @@
+# -*- coding: utf-8 -*-
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from xml.sax.saxutils import escape
+from datetime import date, timedelta
+from lxml import etree
+import Cookie
+import hashlib
+import random
+import threading
+import time
+import uuid
+from sift import query_clauses
+
+SOAP_ENV = "http://schemas.xmlsoap.org/soap/envelope/"
+FULL_RECORD = "http://scientific.thomsonreuters.com/schema/wok5.4/public/FullRecord"
+XSD = "http://www.w3.org/2001/XMLSchema"
+
+# Record sections left out unless requested, when a viewField is given.
+VIEW_FIELDS = ("names", "titles", "pub_info", "refs", "addresses", "abstracts", "keywords", "fund_ack",
+               "keywords_plus", "identifiers")
+
+SERVICES = {
+    "WOKMWSAuthenticate": "http://auth.cxf.wokmws.thomsonreuters.com",
+    "WokSearch": "http://woksearch.v3.wokmws.thomsonreuters.com",
+    "WokSearchLite": "http://woksearchlite.v3.wokmws.thomsonreuters.com",
+}
+
+# Complex types served in the WSDLs: name -> [(element, type, minOccurs, maxOccurs)].
+# Types prefixed "tns:" are defined here, the rest are XML Schema types.
+TYPES = {
+    "queryParameters": [("databaseId", "string", 1, 1), ("userQuery", "string", 1, 1),
+                        ("editions", "tns:editionDesc", 0, "unbounded"), ("symbolicTimeSpan", "string", 0, 1),
+                        ("timeSpan", "tns:timeSpan", 0, 1), ("queryLanguage", "string", 1, 1)],
+    "editionDesc": [("collection", "string", 0, 1), ("edition", "string", 0, 1)],
+    "timeSpan": [("begin", "string", 0, 1), ("end", "string", 0, 1)],
+    "retrieveParameters": [("firstRecord", "int", 1, 1), ("count", "int", 1, 1),
+                           ("sortField", "tns:sortField", 0, "unbounded"),
+                           ("viewField", "tns:viewField", 0, "unbounded"),
+                           ("option", "tns:keyValuePair", 0, "unbounded")],
+    "sortField": [("name", "string", 1, 1), ("sort", "string", 0, 1)],
+    "viewField": [("collectionName", "string", 1, 1), ("fieldName", "string", 0, "unbounded")],
+    "keyValuePair": [("key", "string", 1, 1), ("value", "string", 0, 1)],
+    "fullRecordSearchResults": [("queryId", "string", 0, 1), ("recordsFound", "int", 1, 1),
+                                ("recordsSearched", "long", 1, 1), ("records", "string", 0, 1)],
+    "fullRecordData": [("records", "string", 0, 1)],
+    "citedReferencesSearchResults": [("queryId", "string", 0, 1), ("references", "tns:citedReference", 0, "unbounded"),
+                                     ("recordsFound", "int", 1, 1), ("recordsSearched", "long", 1, 1)],
+    "citedReference": [(name, "string", 0, 1) for name in ("uid", "docid", "articleID", "citedAuthor", "timesCited",
+                                                           "year", "page", "volume", "citedTitle", "citedWork", "hot")],
+    "searchResults": [("queryId", "string", 0, 1), ("recordsFound", "int", 1, 1), ("recordsSearched", "long", 1, 1),
+                      ("records", "tns:liteRecord", 0, "unbounded")],
+    "liteRecord": [("uid", "string", 0, 1), ("title", "tns:labelValuesPair", 0, "unbounded"),
+                   ("source", "tns:labelValuesPair", 0, "unbounded"), ("authors", "tns:labelValuesPair", 0, "unbounded"),
+                   ("keywords", "tns:labelValuesPair", 0, "unbounded"), ("other", "tns:labelValuesPair", 0, "unbounded")],
+    "labelValuesPair": [("label", "string", 0, 1), ("value", "string", 0, "unbounded")],
+}
+
+RETRIEVE_PARAMS = ("retrieveParameters", "tns:retrieveParameters", 1, 1)
+
+# Operations by service: name -> (request elements, return type or None, maxOccurs of return).
+OPERATIONS = {
+    "WOKMWSAuthenticate": {
+        "authenticate": ([], "string", 1),
+        "closeSession": ([], None, 1),
+    },
+    "WokSearch": {
+        "search": ([("queryParameters", "tns:queryParameters", 1, 1), RETRIEVE_PARAMS], "tns:fullRecordSearchResults", 1),
+        "retrieve": ([("queryId", "string", 1, 1), RETRIEVE_PARAMS], "tns:fullRecordData", 1),
+        "retrieveById": ([("databaseId", "string", 1, 1), ("uid", "string", 1, "unbounded"),
+                          ("queryLanguage", "string", 1, 1), RETRIEVE_PARAMS], "tns:fullRecordSearchResults", 1),
+        "citedReferences": ([("databaseId", "string", 1, 1), ("uid", "string", 1, 1), ("queryLanguage", "string", 1, 1),
+                             RETRIEVE_PARAMS], "tns:citedReferencesSearchResults", 1),
+        "citedReferencesRetrieve": ([("queryId", "string", 1, 1), RETRIEVE_PARAMS], "tns:citedReference", "unbounded"),
+        "citingArticles": ([("databaseId", "string", 1, 1), ("uid", "string", 1, 1),
+                            ("editions", "tns:editionDesc", 0, "unbounded"), ("timeSpan", "tns:timeSpan", 0, 1),
+                            ("queryLanguage", "string", 1, 1), RETRIEVE_PARAMS], "tns:fullRecordSearchResults", 1),
+    },
+    "WokSearchLite": {
+        "search": ([("queryParameters", "tns:queryParameters", 1, 1), RETRIEVE_PARAMS], "tns:searchResults", 1),
+        "retrieve": ([("queryId", "string", 1, 1), RETRIEVE_PARAMS], "tns:searchResults", 1),
+        "retrieveById": ([("databaseId", "string", 1, 1), ("uid", "string", 1, "unbounded"),
+                          ("queryLanguage", "string", 1, 1), RETRIEVE_PARAMS], "tns:searchResults", 1),
+    },
+}
+
+
+def _xsd_type(name):
+    return name if name.startswith("tns:") else "xs:" + name
+
+
+def make_wsdl(service, location):
+    """
+    Build a document/literal WSDL describing a mock service.
+
+    Positional arguments:
+    service (str) -- "WOKMWSAuthenticate", "WokSearch" or "WokSearchLite".
+    location (str) -- endpoint URL to advertise.
+    """
+    tns = SERVICES[service]
+    operations = OPERATIONS[service]
+    schema = []
+    used = set()
+    for name, (params, returns, max_returns) in operations.items():
+        for element in params + [("return", returns or "string", 0, max_returns)]:
+            pending = [element[1][4:]] if element[1].startswith("tns:") else []
+            while pending:
+                type_name = pending.pop()
+                if type_name not in used:
+                    used.add(type_name)
+                    pending.extend(t[4:] for n, t, lo, hi in TYPES[type_name] if t.startswith("tns:"))
+    for type_name in sorted(used):
+        fields = "".join('<xs:element name="{0}" type="{1}" minOccurs="{2}" maxOccurs="{3}"/>'.format(
+            n, _xsd_type(t), lo, hi) for n, t, lo, hi in TYPES[type_name])
+        schema.append('<xs:complexType name="{0}"><xs:sequence>{1}</xs:sequence></xs:complexType>'.format(type_name, fields))
+
+    messages, port_ops, binding_ops = [], [], []
+    for name, (params, returns, max_returns) in sorted(operations.items()):
+        fields = "".join('<xs:element name="{0}" type="{1}" minOccurs="{2}" maxOccurs="{3}"/>'.format(
+            n, _xsd_type(t), lo, hi) for n, t, lo, hi in params)
+        schema.append('<xs:element name="{0}" type="tns:{0}"/><xs:complexType name="{0}"><xs:sequence>{1}'
+                      '</xs:sequence></xs:complexType>'.format(name, fields))
+        returned = ""
+        if returns:
+            returned = '<xs:element name="return" type="{0}" minOccurs="0" maxOccurs="{1}"/>'.format(
+                _xsd_type(returns), max_returns)
+        schema.append('<xs:element name="{0}Response" type="tns:{0}Response"/><xs:complexType name="{0}Response">'
+                      '<xs:sequence>{1}</xs:sequence></xs:complexType>'.format(name, returned))
+        messages.append('<wsdl:message name="{0}"><wsdl:part name="parameters" element="tns:{0}"/></wsdl:message>'
+                        '<wsdl:message name="{0}Response"><wsdl:part name="parameters" element="tns:{0}Response"/>'
+                        '</wsdl:message>'.format(name))
+        port_ops.append('<wsdl:operation name="{0}"><wsdl:input message="tns:{0}"/>'
+                        '<wsdl:output message="tns:{0}Response"/></wsdl:operation>'.format(name))
+        binding_ops.append('<wsdl:operation name="{0}"><soap:operation soapAction=""/>'
+                           '<wsdl:input><soap:body use="literal"/></wsdl:input>'
+                           '<wsdl:output><soap:body use="literal"/></wsdl:output></wsdl:operation>'.format(name))
+
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<wsdl:definitions name="{service}" targetNamespace="{tns}" xmlns:tns="{tns}" '
+            'xmlns:wsdl="http://schemas.xmlsoap.org/wsdl/" xmlns:soap="http://schemas.xmlsoap.org/wsdl/soap/" '
+            'xmlns:xs="{xsd}">'
+            '<wsdl:types><xs:schema targetNamespace="{tns}" elementFormDefault="unqualified">{schema}</xs:schema></wsdl:types>'
+            '{messages}<wsdl:portType name="{service}">{port_ops}</wsdl:portType>'
+            '<wsdl:binding name="{service}Binding" type="tns:{service}">'
+            '<soap:binding style="document" transport="http://schemas.xmlsoap.org/soap/http"/>{binding_ops}</wsdl:binding>'
+            '<wsdl:service name="{service}Service"><wsdl:port name="{service}Port" binding="tns:{service}Binding">'
+            '<soap:address location="{location}"/></wsdl:port></wsdl:service></wsdl:definitions>').format(
+                service=service, tns=tns, xsd=XSD, schema="".join(schema), messages="".join(messages),
+                port_ops="".join(port_ops), binding_ops="".join(binding_ops), location=location)
+
+
+class MockWosServer():
+    """Local stand-in for the WOS web services, for tests and benchmarks.
+
+    Serves the authenticate, closeSession, search, retrieve, retrieveById,
+    citedReferences, citedReferencesRetrieve and citingArticles operations,
+    along with WSDLs so that suds clients work against it too. Records are
+    synthetic but deterministic: the same query or UID always returns the same
+    records. Point Wos at it with Wos(base_url=server.base_url).
+    """
+
+    def __init__(self, port=0, records_found=250, latency=0, throttle_every=0, session_limit=0,
+                 abstract_words=150, references_per_record=20, hot_share=0.25, citing_per_record=30,
+                 loaded_per_week=5):
+        """
+        Establish mock service settings.
+
+        Keyword arguments:
+        port (int) -- port to listen on; 0 picks a free port.
+        records_found (int or callable) -- results per search, or a function of the query string.
+            Title (TI=) searches return 1 record, the cited reference with that title if one was served,
+            and UID (UT=) searches one per UID. Queries OR'ing
+            parenthesized queries return the results of each, and the records of AU=, PY= and SO=
+            queries have matching authors, year and source title. A search with a timeSpan narrower
+            than the synthetic load dates (1960 to 2016) returns only the records loaded in it,
+            and one with a symbolicTimeSpan, e.g. "2week", the query's last records as those loaded recently.
+        latency (float) -- seconds to wait before answering each call.
+        throttle_every (int) -- answer every nth call with a throttle fault; 0 never throttles.
+        session_limit (int) -- calls allowed per session before it is rejected; 0 for no limit.
+        abstract_words (int) -- words in each synthetic abstract, controlling FullRecord size.
+        references_per_record (int) -- cited references returned for each UID.
+        hot_share (float) -- share of cited references marked "hot".
+        citing_per_record (int) -- citing articles returned for each UID.
+        loaded_per_week (int) -- records of a query loaded each week, as found with a symbolicTimeSpan.
+        """
+        self.records_found = records_found
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.session_limit = session_limit
+        self.abstract_words = abstract_words
+        self.references_per_record = references_per_record
+        self.hot_share = hot_share
+        self.citing_per_record = citing_per_record
+        self.loaded_per_week = loaded_per_week
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.queries = {}
+        # Field values of records found by AU=, PY= and SO= queries, by UID.
+        self.clauses = {}
+        # UIDs of the cited references served, by lowercase title.
+        self.cited_titles = {}
+        # UIDs found by searches narrowed to a timeSpan, by query and span.
+        self.spans = {}
+        self.dates = {}
+        self.calls = {}
+        self.total_calls = 0
+        self.throttled = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), MockWosHandler)
+        self.server.mock = self
+        self.base_url = "http://127.0.0.1:{0}/esti/wokmws/ws".format(self.server.server_port)
+        self.thread = None
+
+    def start(self):
+        """Serve requests from a background thread."""
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving."""
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset_counts(self):
+        """Clear per-operation call counts."""
+        with self.lock:
+            self.calls = {}
+            self.total_calls = 0
+            self.throttled = 0
+
+    # Request handling
+
+    def handle(self, service, operation, request, sid):
+        """
+        Answer one SOAP call.
+
+        returns:
+            (tuple): HTTP status and reply body.
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.total_calls += 1
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+            if self.throttle_every and self.total_calls % self.throttle_every == 0:
+                self.throttled += 1
+                return 500, fault("Server.IDLimit", "Throttle limit exceeded. Please slow down.")
+            if operation == "authenticate":
+                sid = uuid.uuid4().hex
+                self.sessions[sid] = 0
+                return 200, response(service, operation, "<return>{0}</return>".format(sid))
+            if sid not in self.sessions:
+                return 500, fault("Server.invalidSessionId", "Invalid or expired session ID: {0}".format(sid))
+            self.sessions[sid] += 1
+            if self.session_limit and self.sessions[sid] > self.session_limit:
+                return 500, fault("Server.sessionLimit", "Session call limit reached.")
+            if operation == "closeSession":
+                del self.sessions[sid]
+                return 200, response(service, operation, "")
+
+        handler = getattr(self, "_" + operation, None)
+        if handler is None:
+            return 500, fault("Client", "Unknown operation {0}".format(operation))
+        lite = service == "WokSearchLite"
+        return 200, response(service, operation, handler(request, lite))
+
+    def _register_query(self, key, total):
+        with self.lock:
+            query_id = str(len(self.queries) + 1)
+            self.queries[query_id] = (key, total)
+        return query_id
+
+    def _search(self, request, lite):
+        query = request.findtext("queryParameters/userQuery")
+        total = self.count_for(query)
+        begin = request.findtext("queryParameters/timeSpan/begin")
+        end = request.findtext("queryParameters/timeSpan/end")
+        if begin and end and (begin > "1960-01-01" or end < "2016-12-31"):
+            key = u"{0} [{1} - {2}]".format(query, begin, end)
+            if key not in self.spans:
+                uids = [self.record_uid(query, i) for i in range(total)]
+                self.spans[key] = [uid for uid in uids if begin <= self.load_date(uid) <= end]
+            query, total = key, len(self.spans[key])
+        symbolic = request.findtext("queryParameters/symbolicTimeSpan")
+        if symbolic:
+            key = u"{0} [{1}]".format(query, symbolic)
+            if key not in self.spans:
+                loaded = int(symbolic.rstrip("weks")) * self.loaded_per_week
+                self.spans[key] = [self.record_uid(query, i) for i in range(max(0, total - loaded), total)]
+            query, total = key, len(self.spans[key])
+        query_id = self._register_query(query, total)
+        return self._results(query, total, query_id, request, lite)
+
+    def _retrieve(self, request, lite):
+        query_id = request.findtext("queryId")
+        key, total = self.queries.get(query_id, (query_id, 0))
+        first, count = _paging(request)
+        records = [self.record_uid(key, i) for i in range(first - 1, min(total, first - 1 + count))]
+        if lite:
+            return _lite_results(query_id, total, [self.lite_record(uid) for uid in records])
+        return "<return><records>{0}</records></return>".format(
+            escape(self.full_records(records, _view_fields(request))))
+
+    def _retrieveById(self, request, lite):
+        uids = [e.text for e in request.findall("uid")]
+        if lite:
+            return _lite_results(None, len(uids), [self.lite_record(uid) for uid in uids])
+        return _full_results(None, len(uids), self.full_records(uids, _view_fields(request)))
+
+    def _citingArticles(self, request, lite):
+        key = "citing:" + request.findtext("uid")
+        query_id = self._register_query(key, self.citing_per_record)
+        return self._results(key, self.citing_per_record, query_id, request, lite)
+
+    def _citedReferences(self, request, lite):
+        uid = request.findtext("uid")
+        total = self.references_per_record
+        query_id = self._register_query("refs:" + uid, total)
+        first, count = _paging(request)
+        refs = "".join(self.cited_reference(uid, i) for i in range(first - 1, min(total, first - 1 + count)))
+        return ("<return><queryId>{0}</queryId>{1}<recordsFound>{2}</recordsFound>"
+                "<recordsSearched>{3}</recordsSearched></return>").format(query_id, refs, total, 1000000)
+
+    def _citedReferencesRetrieve(self, request, lite):
+        key, total = self.queries.get(request.findtext("queryId"), ("refs:", 0))
+        first, count = _paging(request)
+        return "".join(self.cited_reference(key[5:], i, tag="return")
+                       for i in range(first - 1, min(total, first - 1 + count)))
+
+    def _results(self, key, total, query_id, request, lite):
+        first, count = _paging(request)
+        uids = [self.record_uid(key, i) for i in range(first - 1, min(total, first - 1 + count))]
+        if lite:
+            return _lite_results(query_id, total, [self.lite_record(uid) for uid in uids])
+        return _full_results(query_id, total, self.full_records(uids, _view_fields(request)))
+
+    # Synthetic data
+
+    def count_for(self, query):
+        """Return the number of results a search for query finds."""
+        if _alternatives(query):
+            return sum(self.count_for(alternative) for alternative in _alternatives(query))
+        if query.startswith("TI="):
+            return 1
+        if query.startswith("UT="):
+            return query.count("WOS:")
+        if callable(self.records_found):
+            return self.records_found(query)
+        return self.records_found
+
+    def record_uid(self, key, index):
+        """Return UID of the index-th result for a query or other key."""
+        if key in self.spans:
+            return self.spans[key][index]
+        if key.startswith("UT="):
+            return key.replace("(", " ").replace(")", " ").split()[1:][index * 2]
+        if key.startswith("TI=(") and key[4:key.find(")")] in self.cited_titles:
+            return self.cited_titles[key[4:key.find(")")]]
+        for alternative in _alternatives(key):
+            if index < self.count_for(alternative):
+                return self.record_uid(alternative, index)
+            index -= self.count_for(alternative)
+        digest = int(hashlib.md5(key.encode("utf8")).hexdigest()[:8], 16)
+        uid = "WOS:{0:09d}{1:06d}".format(digest % 1000000000, index)
+        clauses = query_clauses(key)
+        if clauses:
+            self.clauses[uid] = clauses
+        return uid
+
+    def record_fields(self, uid):
+        """Return the synthetic field values of the record with uid."""
+        rng = random.Random(uid)
+        words = ["grain", "perennial", "wheat", "rice", "yield", "soil", "root", "carbon", "nitrogen", "ratoon",
+                 "sorghum", "breeding", "field", "trial", "climate", "genome", "biomass", "water", "crop", "season"]
+        surnames = ["Smith", "Garcia", "Chen", "Kumar", "Okafor", "Novak", "Silva", "Larsen", "Tanaka", "Dubois"]
+        fields = {
+            "uid": uid,
+            "title": " ".join(rng.choice(words) for i in range(rng.randint(6, 14))).capitalize(),
+            "journal": "JOURNAL OF " + rng.choice(words).upper() + " SCIENCE",
+            "year": str(rng.randint(1960, 2016)),
+            "volume": str(rng.randint(1, 300)),
+            "pages": "{0}-{1}".format(*sorted(rng.sample(range(1, 2000), 2))),
+            "authors": ["{0}, {1}".format(rng.choice(surnames), rng.choice("ABCDEFGH")) for i in range(rng.randint(1, 6))],
+            "keywords": [rng.choice(words) for i in range(rng.randint(2, 6))],
+            "abstract": " ".join(rng.choice(words) for i in range(self.abstract_words)),
+            "doi": "10.{0}/{1}".format(rng.randint(1000, 9999), uid[4:]),
+            "times_cited": str(rng.randint(0, 500)),
+            "refs": str(rng.randint(5, 80)),
+        }
+        clauses = self.clauses.get(uid, {})
+        if "AU" in clauses:
+            names = [name.strip().replace("*", "") for name in clauses["AU"].split(" AND ")]
+            fields["authors"] = ["{0}, {1}".format(name, rng.choice("ABCDEFGH")) for name in names] + fields["authors"]
+        if "PY" in clauses:
+            fields["year"] = clauses["PY"]
+        if "SO" in clauses:
+            fields["journal"] = clauses["SO"].replace("*", "").upper()
+        return fields
+
+    def load_date(self, uid):
+        """Return the synthetic date the record with uid was loaded, in its publication year, in YYYY-MM-DD format."""
+        if uid not in self.dates:
+            year = int(self.record_fields(uid)["year"])
+            self.dates[uid] = (date(year, 1, 1) + timedelta(random.Random(uid + "date").randint(0, 364))).isoformat()
+        return self.dates[uid]
+
+    def full_records(self, uids, view_fields=None):
+        """
+        Return FullRecord XML for uids, as embedded in the records element.
+
+        Keyword arguments:
+        view_fields (list) -- record sections to include, e.g. ["titles", "pub_info"]; all if None.
+        """
+        records = '<records xmlns="{0}">{1}</records>'.format(FULL_RECORD, "".join(self.full_record(u) for u in uids))
+        if view_fields is None:
+            return records
+        tree = etree.fromstring(records)
+        for section in VIEW_FIELDS:
+            if section not in view_fields:
+                for element in list(tree.iter("{%s}%s" % (FULL_RECORD, section))):
+                    element.getparent().remove(element)
+        return etree.tostring(tree)
+
+    def full_record(self, uid):
+        """Return FullRecord XML of one REC element."""
+        f = self.record_fields(uid)
+        names = "".join('<name role="author" seq_no="{0}"><full_name>{1}</full_name></name>'.format(i + 1, escape(a))
+                        for i, a in enumerate(f["authors"]))
+        keywords = "".join("<keyword>{0}</keyword>".format(k) for k in f["keywords"])
+        return ('<REC><UID>{uid}</UID><static_data><summary><pub_info pubyear="{year}" vol="{volume}">'
+                '<page>{pages}</page></pub_info><titles><title type="source">{journal}</title>'
+                '<title type="item">{title}</title></titles><names count="{n}">{names}</names></summary>'
+                '<fullrecord_metadata><refs count="{refs}"/><addresses><address_name><address_spec>'
+                '<full_address>Michigan State Univ, E Lansing, MI 48824 USA</full_address></address_spec>'
+                '</address_name></addresses><abstracts><abstract><abstract_text><p>{abstract}</p></abstract_text>'
+                '</abstract></abstracts><keywords>{keywords}</keywords><fund_ack><grants><grant>'
+                '<grant_agency>National Science Foundation</grant_agency><grant_ids><grant_id>NSF-{year}</grant_id>'
+                '</grant_ids></grant></grants></fund_ack></fullrecord_metadata><item><keywords_plus>{keywords}'
+                '</keywords_plus></item></static_data><dynamic_data><citation_related><tc_list>'
+                '<silo_tc coll_id="WOS" local_count="{times_cited}"/></tc_list></citation_related><cluster_related>'
+                '<identifiers><identifier type="doi" value="{doi}"/></identifiers></cluster_related></dynamic_data>'
+                '</REC>').format(names=names, keywords=keywords, n=len(f["authors"]), **dict(
+                    (k, escape(v)) for k, v in f.items() if isinstance(v, basestring)))
+
+    def lite_record(self, uid):
+        """Return liteRecord XML for uid."""
+        f = self.record_fields(uid)
+
+        def pair(label, values):
+            return "<label>{0}</label>{1}".format(label, "".join("<value>{0}</value>".format(escape(v)) for v in values))
+
+        source = "".join("<source>{0}</source>".format(pair(label, [value])) for label, value in (
+            ("Pages", f["pages"]), ("Published.BiblioYear", f["year"]), ("SourceTitle", f["journal"]),
+            ("Volume", f["volume"])))
+        other = "".join("<other>{0}</other>".format(pair(label, [value])) for label, value in (
+            ("Identifier.Doi", f["doi"]), ("Identifier.Ids", f["uid"][4:9])))
+        return ("<records><uid>{0}</uid><title>{1}</title>{2}<authors>{3}</authors><keywords>{4}</keywords>{5}"
+                "</records>").format(f["uid"], pair("Title", [f["title"]]), source, pair("Authors", f["authors"]),
+                                     pair("Keywords", f["keywords"]), other)
+
+    def cited_reference(self, uid, index, tag="references"):
+        """Return the index-th cited reference of the record with uid, as element tag."""
+        ref_uid = self.record_uid("refs:" + uid, index)
+        f = self.record_fields(ref_uid)
+        hot = random.Random(ref_uid).random() < self.hot_share
+        self.cited_titles[f["title"].lower()] = ref_uid
+        return ("<{tag}><uid>{uid}</uid><docid>{docid}</docid><articleID>{docid}</articleID>"
+                "<citedAuthor>{author}</citedAuthor><timesCited>{times_cited}</timesCited><year>{year}</year>"
+                "<page>{page}</page><volume>{volume}</volume><citedTitle>{title}</citedTitle>"
+                "<citedWork>{journal}</citedWork><hot>{hot}</hot></{tag}>").format(
+                    tag=tag, uid=ref_uid if hot else "", docid=ref_uid[4:], author=escape(f["authors"][0]),
+                    times_cited=f["times_cited"], year=f["year"], page=f["pages"].split("-")[0],
+                    volume=f["volume"], title=escape(f["title"]), journal=escape(f["journal"]),
+                    hot="yes" if hot else "no")
+
+
+def _alternatives(query):
+    """Return the parenthesized queries OR'd in query, or an empty list."""
+    alternatives = []
+    depth = 0
+    start = 0
+    for index, char in enumerate(query):
+        if depth == 0 and index == start:
+            if char != "(":
+                return []
+        depth += {"(": 1, ")": -1}.get(char, 0)
+        if depth == 0 and char == ")":
+            alternatives.append(query[start + 1:index])
+            if query.startswith(" OR (", index + 1):
+                start = index + len(" OR ") + 1
+            elif index + 1 < len(query):
+                return []
+    return alternatives if len(alternatives) > 1 else []
+
+
+def _paging(request):
+    first = int(request.findtext("retrieveParameters/firstRecord") or 1)
+    count = int(request.findtext("retrieveParameters/count") or 100)
+    return first, count
+
+
+def _view_fields(request):
+    fields = [e.text for e in request.findall("retrieveParameters/viewField/fieldName")]
+    return fields or None
+
+
+def _full_results(query_id, total, records):
+    query = "<queryId>{0}</queryId>".format(query_id) if query_id else ""
+    return ("<return>{0}<recordsFound>{1}</recordsFound><recordsSearched>{2}</recordsSearched>"
+            "<records>{3}</records></return>").format(query, total, 1000000, escape(records))
+
+
+def _lite_results(query_id, total, records):
+    query = "<queryId>{0}</queryId>".format(query_id) if query_id else ""
+    return ("<return>{0}<recordsFound>{1}</recordsFound><recordsSearched>{2}</recordsSearched>{3}"
+            "</return>").format(query, total, 1000000, "".join(records))
+
+
+def response(service, operation, content):
+    """Wrap operation result content in a reply envelope."""
+    return ('<soap:Envelope xmlns:soap="{0}"><soap:Body><ns2:{1}Response xmlns:ns2="{2}">{3}</ns2:{1}Response>'
+            '</soap:Body></soap:Envelope>').format(SOAP_ENV, operation, SERVICES[service], content)
+
+
+def fault(code, message):
+    """Build a SOAP fault envelope."""
+    return ('<soap:Envelope xmlns:soap="{0}"><soap:Body><soap:Fault><faultcode>soap:{1}</faultcode>'
+            '<faultstring>{2}</faultstring></soap:Fault></soap:Body></soap:Envelope>').format(
+                SOAP_ENV, code, escape(message))
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MockWosHandler(BaseHTTPRequestHandler):
+    """HTTP handler passing SOAP calls on to the MockWosServer."""
+
+    protocol_version = "HTTP/1.1"
+    # Write each reply in one piece; small unbuffered writes on a persistent
+    # connection would otherwise stall on delayed ACKs.
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def _service(self):
+        name = self.path.split("?")[0].rstrip("/").split("/")[-1]
+        return name if name in SERVICES else None
+
+    def do_GET(self):
+        service = self._service()
+        if service is None or not self.path.endswith("?wsdl"):
+            return self._reply(404, "Not found")
+        location = self.server.mock.base_url + "/" + service
+        self._reply(200, make_wsdl(service, location))
+
+    def do_POST(self):
+        service = self._service()
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if service is None:
+            return self._reply(404, "Not found")
+        try:
+            request = etree.fromstring(body).find("{%s}Body" % SOAP_ENV)[0]
+        except (etree.XMLSyntaxError, TypeError, IndexError):
+            return self._reply(500, fault("Client", "Malformed request"))
+        operation = etree.QName(request).localname
+        cookie = Cookie.SimpleCookie(self.headers.get("Cookie", ""))
+        sid = cookie["SID"].value if "SID" in cookie else None
+        status, content = self.server.mock.handle(service, operation, request, sid)
+        self._reply(status, content)
+
+    def _reply(self, status, content):
+        if isinstance(content, unicode):
+            content = content.encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/xml; charset=utf-8")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+
+def is_throttle_error(error):
+    """
+    Check whether an exception raised by an API call reports throttling.
+
+    Positional arguments:
+    error (Exception) -- exception raised by a SOAP call.
+    """
+    return "throttle" in unicode(error).lower()
+
+
+class RateLimiter():
+    """Token bucket spacing API calls to a calls-per-second budget.
+
+    Tokens accumulate while requests are in flight, so time already spent on a
+    call counts toward the spacing of the next one. A single limiter can be
+    shared by several threads and several Wos instances.
+    """
+
+    def __init__(self, rate=1.0, burst=1, min_rate=0.05, backoff=2.0, recovery=1.1):
+        """
+        Establish call budget.
+
+        Keyword arguments:
+        rate (float) -- calls per second allowed; None or 0 disables limiting.
+        burst (int) -- calls that may be made back to back after an idle period.
+        min_rate (float) -- floor the call rate can be reduced to while throttled.
+        backoff (float) -- factor the call rate is divided by on each throttle error.
+        recovery (float) -- factor the call rate is multiplied by on each success,
+            until it is back to the configured rate.
+        """
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.min_rate = min_rate
+        self.backoff = backoff
+        self.recovery = recovery
+        self.current_rate = rate
+        self.tokens = self.burst
+        self.last_update = time.time()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        """Add tokens for the time elapsed since the last update."""
+        elapsed = max(0, now - self.last_update)
+        self.tokens = min(self.burst, self.tokens + elapsed * self.current_rate)
+        self.last_update = now
+
+    def acquire(self):
+        """
+        Wait until a call may be made and take a token.
+
+        Tokens are reserved under the lock and waited for outside it, so concurrent
+        callers are spaced out rather than woken together.
+
+        returns:
+            (float): seconds spent waiting.
+        """
+        if not self.rate:
+            return 0
+        with self.lock:
+            self._refill(time.time())
+            self.tokens -= 1
+            wait = 0 if self.tokens >= 0 else -self.tokens / self.current_rate
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def throttled(self):
+        """Slow the call rate down after the server reports throttling."""
+        if not self.rate:
+            return
+        with self.lock:
+            self._refill(time.time())
+            self.current_rate = max(self.min_rate, self.current_rate / self.backoff)
+            # Drop any saved-up burst so the next call waits a full interval.
+            self.tokens = min(self.tokens, 0)
+
+    def succeeded(self):
+        """Recover the call rate gradually after a successful call."""
+        if not self.rate or self.current_rate >= self.rate:
+            return
+        with self.lock:
+            self._refill(time.time())
+            self.current_rate = min(self.rate, self.current_rate * self.recovery)
+
+
+class BudgetExhausted(Exception):
+    """Raised instead of making an API call once a CallBudget is used up."""
+    pass
+
+
+class CallBudget():
+    """Hard limit on the number of API calls, shared by several threads and Wos instances.
+
+    Every attempt sent to the API counts, including retries of throttled
+    calls; replies served from a response cache do not.
+    """
+
+    def __init__(self, max_calls):
+        """
+        Establish budget.
+
+        Positional arguments:
+        max_calls (int) -- calls that may be made in total.
+        """
+        self.max_calls = max_calls
+        self.used = 0
+        self.lock = threading.Lock()
+
+    def spend(self):
+        """Take one call from the budget, raising BudgetExhausted if none are left."""
+        with self.lock:
+            if self.used >= self.max_calls:
+                raise BudgetExhausted("API call budget of {0} calls exhausted".format(self.max_calls))
+            self.used += 1
+
+    def remaining(self):
+        """Return number of calls left."""
+        with self.lock:
+            return max(0, self.max_calls - self.used)
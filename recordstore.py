@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+# Marks a field a record does not have.
+MISSING = object()
+
+
+class CompactRecords():
+    """Memory-efficient, list-like container of metadata records.
+
+    Records are stored column by column rather than as one dictionary each,
+    so field names are held once per container instead of once per record.
+    Values repeated across records, e.g. the query, source_id, "NONE" or a
+    journal name, are interned so each distinct value is stored once. Columns
+    whose values turn out to be mostly distinct, such as titles or abstracts,
+    stop being interned.
+
+    Reading a record, by index or by iterating, builds a new dictionary, so
+    changes to it are not stored back; assign the changed record to its
+    index to replace the stored one.
+    """
+
+    def __init__(self, records=None, intern_sample=1000, intern_ratio=0.9):
+        """
+        Establish empty columns.
+
+        Keyword arguments:
+        records (iterable) -- dictionaries to add.
+        intern_sample (int) -- values a column takes before deciding whether interning pays off.
+        intern_ratio (float) -- share of distinct values above which a column stops being interned.
+        """
+        self.fields = []
+        self.columns = []
+        self.positions = {}
+        self.interned = []
+        self.seen = []
+        self.length = 0
+        self.intern_sample = intern_sample
+        self.intern_ratio = intern_ratio
+        if records is not None:
+            self.extend(records)
+
+    def _column(self, field):
+        """Return position of field, adding a column of missing values if it is new."""
+        position = self.positions.get(field)
+        if position is None:
+            position = len(self.fields)
+            self.positions[field] = position
+            self.fields.append(field)
+            self.columns.append([MISSING] * self.length)
+            self.interned.append({})
+            self.seen.append(0)
+        return position
+
+    def _intern(self, position, value):
+        table = self.interned[position]
+        if table is None or not isinstance(value, basestring):
+            return value
+        value = table.setdefault(value, value)
+        self.seen[position] += 1
+        if self.seen[position] == self.intern_sample and len(table) > self.intern_ratio * self.intern_sample:
+            self.interned[position] = None
+        return value
+
+    def append(self, record):
+        """
+        Add a record.
+
+        Positional arguments:
+        record (dict) -- metadata record, e.g. as compiled by MetaWos.
+        """
+        for field, value in record.items():
+            position = self._column(field)
+            self.columns[position].append(self._intern(position, value))
+        self.length += 1
+        for column in self.columns:
+            if len(column) < self.length:
+                column.append(MISSING)
+
+    def extend(self, records):
+        """Add each record in records."""
+        for record in records:
+            self.append(record)
+
+    def _record(self, index):
+        return dict((field, column[index]) for field, column in zip(self.fields, self.columns)
+                    if column[index] is not MISSING)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._record(i) for i in xrange(*index.indices(self.length))]
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("record index out of range")
+        return self._record(index)
+
+    def __setitem__(self, index, record):
+        """Replace the record at index with record."""
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("record assignment index out of range")
+        for position, field in enumerate(self.fields):
+            self.columns[position][index] = MISSING
+        for field, value in record.items():
+            position = self._column(field)
+            self.columns[position][index] = self._intern(position, value)
+
+    def __iter__(self):
+        for index in xrange(self.length):
+            yield self._record(index)
+
+    def __len__(self):
+        return self.length
+
+    def __repr__(self):
+        return "<CompactRecords: {0} records, {1} fields>".format(self.length, len(self.fields))
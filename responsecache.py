@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+from suds.plugin import MessagePlugin
+from suds.sudsobject import Object
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+def normalize(value):
+    """
+    Reduce call arguments to plain, comparable values for use in cache keys.
+
+    suds objects become dictionaries, numbers become strings (the API accepts
+    count=1 and count="1" alike) and whitespace in strings is collapsed.
+
+    Positional arguments:
+    value -- argument passed to a SOAP operation.
+    """
+    if isinstance(value, Object):
+        return dict((k, normalize(v)) for k, v in value if v not in (None, []))
+    if isinstance(value, dict):
+        return dict((k, normalize(v)) for k, v in value.items() if v not in (None, []))
+    if isinstance(value, (list, tuple)):
+        return [normalize(v) for v in value]
+    if isinstance(value, basestring):
+        return u" ".join(value.split())
+    if value is None:
+        return None
+    return unicode(value)
+
+
+class ReplyCapture(MessagePlugin):
+    """suds plugin keeping the raw reply of the last call made by each thread."""
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def received(self, context):
+        self.local.reply = context.reply
+
+    def last_reply(self):
+        """Return raw XML of this thread's last reply."""
+        return getattr(self.local, "reply", None)
+
+    def __deepcopy__(self, memo={}):
+        # suds deep-copies plugins when cloning a client; keep one capture.
+        return self
+
+
+class ResponseCache():
+    """Persistent cache of raw SOAP replies, keyed by operation and parameters.
+
+    Each reply is stored as one file in the cache directory. Entries older than
+    ttl seconds are treated as misses, and the oldest entries are evicted when
+    the cache grows past max_bytes.
+    """
+
+    operations = ("search", "retrieve", "citedReferences", "citingArticles", "retrieveById")
+
+    def __init__(self, location, ttl=None, max_bytes=None):
+        """
+        Establish cache directory.
+
+        Positional arguments:
+        location (str) -- directory to store cached replies in; created if missing.
+
+        Keyword arguments:
+        ttl (int) -- seconds a cached reply remains valid; None keeps replies indefinitely.
+        max_bytes (int) -- total size of cached replies to keep; None for no limit.
+        """
+        self.location = location
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        if not os.path.isdir(location):
+            os.makedirs(location)
+        self.size = sum(os.path.getsize(path) for path in self._entries())
+
+    def key(self, operation, *params):
+        """
+        Build cache key for an operation and its parameters.
+
+        Positional arguments:
+        operation (str) -- SOAP operation name, e.g. "search".
+        params -- operation arguments, e.g. queryParameters and retrieveParameters objects.
+        """
+        normalized = json.dumps([operation] + [normalize(p) for p in params], sort_keys=True)
+        return hashlib.sha1(normalized.encode("utf8")).hexdigest()
+
+    def get(self, key):
+        """
+        Return cached reply for key, or None if absent or expired.
+
+        Positional arguments:
+        key (str) -- cache key from the key method.
+        """
+        path = self._path(key)
+        with self.lock:
+            try:
+                stored = os.path.getmtime(path)
+                if self.ttl is not None and time.time() - stored > self.ttl:
+                    self._remove(path)
+                    self.misses += 1
+                    return None
+                with open(path, "rb") as fh:
+                    reply = fh.read()
+            except (IOError, OSError):
+                self.misses += 1
+                return None
+            self.hits += 1
+            return reply
+
+    def put(self, key, reply):
+        """
+        Store raw reply under key, evicting the oldest entries if over max_bytes.
+
+        Positional arguments:
+        key (str) -- cache key from the key method.
+        reply (str) -- raw SOAP reply.
+        """
+        if reply is None:
+            return
+        path = self._path(key)
+        with self.lock:
+            if os.path.exists(path):
+                self._remove(path)
+            temp_path = "{0}.{1}.tmp".format(path, threading.current_thread().ident)
+            with open(temp_path, "wb") as fh:
+                fh.write(reply)
+            os.rename(temp_path, path)
+            self.size += len(reply)
+            self.stores += 1
+            if self.max_bytes is not None and self.size > self.max_bytes:
+                self._evict()
+
+    def stats(self):
+        """
+        Report cache use.
+
+        returns:
+            (dict): hits, misses, stores, evictions, hit ratio and current size in bytes.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "stores": self.stores,
+                    "evictions": self.evictions,
+                    "hit_ratio": self.hits / float(lookups) if lookups else 0.0,
+                    "bytes": self.size}
+
+    def clear(self):
+        """Remove all cached replies."""
+        with self.lock:
+            for path in self._entries():
+                self._remove(path)
+
+    def _path(self, key):
+        return os.path.join(self.location, key + ".xml")
+
+    def _entries(self):
+        return [os.path.join(self.location, name) for name in os.listdir(self.location) if name.endswith(".xml")]
+
+    def _remove(self, path):
+        try:
+            self.size -= os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _evict(self):
+        """Remove oldest entries until the cache fits within max_bytes."""
+        for path in sorted(self._entries(), key=os.path.getmtime):
+            if self.size <= self.max_bytes:
+                break
+            self._remove(path)
+            self.evictions += 1
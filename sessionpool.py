@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+
+class Session():
+    """One authenticated WOS session and the calls made with it."""
+
+    def __init__(self, sid):
+        """
+        Establish session.
+
+        Positional arguments:
+        sid (str) -- session ID token returned by the authenticate service.
+        """
+        self.sid = sid
+        self.calls = 0
+        self.created = time.time()
+
+
+class SessionPool():
+    """Hold several authenticated sessions and hand out the least-used one per call.
+
+    WOS limits the number of calls per session. Sessions close to that limit are
+    replaced by a background thread, so long harvests do not stop to
+    re-authenticate. Replaced sessions are closed one check interval later,
+    giving calls still in flight on them time to finish.
+    """
+
+    def __init__(self, size=3, call_limit=2000, renew_at=0.9, check_interval=5, authenticate=None, close=None):
+        """
+        Establish pool settings.
+
+        Keyword arguments:
+        size (int) -- number of sessions to hold open.
+        call_limit (int) -- calls allowed per session.
+        renew_at (float) -- share of call_limit after which a session is replaced.
+        check_interval (float) -- seconds between background checks for sessions to replace.
+        authenticate (callable) -- returns a new SID; Wos supplies its own if not given.
+        close (callable) -- called with a SID to close that session; Wos supplies its own if not given.
+        """
+        self.size = size
+        self.call_limit = call_limit
+        self.renew_at = renew_at
+        self.check_interval = check_interval
+        self.authenticate = authenticate
+        self.close = close
+        self.sessions = []
+        self.retired = []
+        self.renewals = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """Authenticate the sessions and start renewing them in the background."""
+        if self.thread is not None:
+            return
+        self.sessions = [Session(self.authenticate()) for i in range(self.size)]
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._renew_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stop background renewal and close all sessions."""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        with self.lock:
+            sessions = self.sessions + self.retired
+            self.sessions = []
+            self.retired = []
+        for session in sessions:
+            self._close(session)
+
+    def acquire(self):
+        """
+        Take the least-used session for one call.
+
+        If every session has reached the call limit, the least-used one is renewed
+        before returning, as the background thread has fallen behind.
+
+        returns:
+            (str): SID to send with the call.
+        """
+        with self.lock:
+            session = min(self.sessions, key=lambda s: s.calls)
+            if session.calls < self.call_limit:
+                session.calls += 1
+                return session.sid
+
+        session = self._renew(session)
+        with self.lock:
+            session.calls += 1
+        return session.sid
+
+    def stats(self):
+        """
+        Report pool usage.
+
+        returns:
+            (dict): calls made on each open session and number of renewals so far.
+        """
+        with self.lock:
+            return {"session_calls": [s.calls for s in self.sessions],
+                    "renewals": self.renewals}
+
+    def _renew(self, session):
+        """Replace session with a newly authenticated one and return the replacement."""
+        replacement = Session(self.authenticate())
+        with self.lock:
+            if session not in self.sessions:
+                # Another thread renewed it first; discard the spare session.
+                self.retired.append(replacement)
+                return min(self.sessions, key=lambda s: s.calls)
+            self.sessions[self.sessions.index(session)] = replacement
+            self.retired.append(session)
+            self.renewals += 1
+        return replacement
+
+    def _renew_loop(self):
+        """Replace sessions nearing the call limit until the pool is stopped."""
+        while not self.stopped.wait(self.check_interval):
+            with self.lock:
+                retired = self.retired
+                self.retired = []
+                due = [s for s in self.sessions if s.calls >= self.call_limit * self.renew_at]
+            for session in retired:
+                self._close(session)
+            for session in due:
+                try:
+                    self._renew(session)
+                except Exception as e:
+                    print "Session renewal failed."
+                    print e
+
+    def _close(self, session):
+        """Close a session, ignoring failures as it is being discarded anyway."""
+        if self.close is None:
+            return
+        try:
+            self.close(session.sid)
+        except Exception as e:
+            print "Closing session failed."
+            print e
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from snowball import record_uid
+from workerpool import WorkerPool
+from datetime import date, datetime, timedelta
+import math
+
+# Records WOS lets one query page through.
+MAX_RETRIEVABLE = 100000
+# Records retrieved per call while paging through a shard.
+PAGE_SIZE = 100
+
+
+def parse_date(text):
+    """Return date of a YYYY-MM-DD string, or today if None."""
+    if text is None:
+        return date.today()
+    return datetime.strptime(text, "%Y-%m-%d").date()
+
+
+def split_span(begin, end):
+    """
+    Split a date range in two, at the start of a year if it covers several years.
+
+    Positional arguments:
+    begin (date) -- first day of the range.
+    end (date) -- last day of the range, after begin.
+
+    returns:
+        (tuple): the two (begin, end) halves.
+    """
+    if begin.year < end.year:
+        cut = date((begin.year + end.year + 1) // 2, 1, 1)
+    else:
+        cut = begin + timedelta((end - begin).days // 2 + 1)
+    return (begin, cut - timedelta(1)), (cut, end)
+
+
+class ShardedSearch():
+    """One broad query harvested as load date ranges searched in parallel.
+
+    A search is paged serially from a single query ID, and WOS returns no
+    more than MAX_RETRIEVABLE records of one query. The query's time span,
+    which WOS applies to the date records were loaded, is therefore split
+    into shards, halving ranges at year boundaries, or by days within a
+    year, until each shard's recordsFound, probed with a one-record search,
+    is at most max_records. Shards are also made small enough to give every
+    worker a share of the records.
+
+    Shards are searched and paged at once by Wos instances spawned from the
+    harvesting one, and their records are merged into its search_results,
+    skipping UIDs already merged. With a checkpoint journal, each harvested
+    shard is recorded as a page of the query, named by its date range, so a
+    restarted harvest only searches the shards still missing.
+    """
+
+    def __init__(self, wos, query, time_begin="1900-01-01", time_end=None, max_records=MAX_RETRIEVABLE, workers=1,
+                 database_id="WOS"):
+        """
+        Establish harvest settings.
+
+        Positional arguments:
+        wos (Wos) -- authorized Wos instance receiving the records.
+        query (str) -- query formatted according to WOS specifications.
+
+        Keyword arguments:
+        time_begin (str) -- first load date to harvest, in YYYY-MM-DD format.
+        time_end (str) -- last load date to harvest, in YYYY-MM-DD format; today if None.
+        max_records (int) -- most records found per shard.
+        workers (int) -- shards probed or harvested at once.
+        database_id (str) -- WOS database abbreviation.
+        """
+        self.wos = wos
+        self.query = query
+        self.begin = parse_date(time_begin)
+        self.end = parse_date(time_end)
+        self.max_records = max_records
+        self.workers = max(1, workers)
+        self.database_id = database_id
+        self.pool = WorkerPool(self.workers)
+        self.shards = []
+        self.records_found = None
+        self.probes = 0
+        self.duplicates = 0
+
+    def plan(self):
+        """
+        Split the time span into shards.
+
+        returns:
+            (list): (begin, end, records found) of each shard holding records, oldest first.
+        """
+        pending = [(self.begin, self.end)]
+        target = self.max_records
+        self.shards = []
+        while pending:
+            found = self.pool.map(self._probe, pending, context=self.wos.spawn)
+            self.probes += len(pending)
+            if self.records_found is None:
+                self.records_found = found[0]
+                # Enough shards for every worker, but none smaller than a result page.
+                share = int(math.ceil(self.records_found / self.workers))
+                target = min(self.max_records, max(share, PAGE_SIZE))
+            split = []
+            for (begin, end), records_found in zip(pending, found):
+                if records_found > target and begin < end:
+                    split.extend(split_span(begin, end))
+                elif records_found:
+                    if records_found > self.max_records:
+                        print "Shard {0} to {1} finds {2} records, only {3} of which can be retrieved.".format(
+                            begin, end, records_found, self.max_records)
+                    self.shards.append((begin, end, records_found))
+            pending = split
+        self.shards.sort()
+        print "Split {0} records into {1} shards.".format(self.records_found, len(self.shards))
+        return self.shards
+
+    def harvest(self):
+        """
+        Search all shards and merge their records into the Wos instance's search_results.
+
+        returns:
+            (int): distinct records stored.
+        """
+        if self.records_found is None:
+            self.plan()
+        pending = [shard for shard in self.shards
+                   if not self.wos._page_checkpointed("search_results", self.query, self._page(shard))]
+        harvested = self.pool.imap(self._harvest_shard, pending, context=self.wos.spawn)
+        seen = set()
+        stored = 0
+        for shard in self.shards:
+            page = self._page(shard)
+            if shard in pending:
+                records = next(harvested)
+            else:
+                records = self.wos.checkpoint.page("search_results", self.query, page).get("search_results", [])
+            new = []
+            for record in records:
+                uid = record_uid(record)
+                if uid in seen:
+                    self.duplicates += 1
+                    continue
+                seen.add(uid)
+                new.append(record)
+            stored += len(new)
+            self.wos._process_page("search_results", self.query, page,
+                                   lambda: self.wos.store_records("search_results", new))
+        print "Stored {0} records from {1} shards.".format(stored, len(self.shards))
+        return stored
+
+    def _page(self, shard):
+        """Checkpoint page of a shard: its date range, e.g. 2001-01-01/2001-12-31."""
+        begin, end = shard[:2]
+        return u"{0}/{1}".format(begin.isoformat(), end.isoformat())
+
+    def _probe(self, wos, span):
+        """Return number of records the query finds in a date range, fetching one record at most."""
+        begin, end = span
+        wos.query_parameters(self.query, time_begin=begin.isoformat(), time_end=end.isoformat(),
+                             database_id=self.database_id)
+        wos.search(wos.qp, wos.retrieve_parameters(count=1), get_metadata=False, all_pages=False)
+        return wos.records_found
+
+    def _harvest_shard(self, wos, shard):
+        """Search one shard with a spawned Wos and return its records."""
+        begin, end = shard[:2]
+        wos.metadata_collection["search_results"] = []
+        wos.query_parameters(self.query, time_begin=begin.isoformat(), time_end=end.isoformat(),
+                             database_id=self.database_id)
+        wos.search(wos.qp, wos.retrieve_parameters())
+        return wos.metadata_collection["search_results"]
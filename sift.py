@@ -1,3 +1,286 @@
+from titleindex import normalize_title, trigrams
+import re
+
+# One field clause of a known-item query, e.g. AU=(Smith AND Jones), PY=2001 or SO=(J* Test*).
+CLAUSE = re.compile(r"^(AU|PY|SO)=(?:\(([^()]*)\)|([^\s()]+))$")
+
+
+def query_clauses(query):
+    """Split a known-item query into its field clauses.
+
+    args:
+        query (str): query such as AU=(Smith AND Jones) AND PY=2001 AND SO=(J* Test*).
+
+    returns:
+        (dict): value of each field, or None if the query uses anything other
+            than AU=, PY= and SO= clauses joined by AND.
+    """
+    parts = []
+    depth = 0
+    start = 0
+    for index, char in enumerate(query):
+        depth += {"(": 1, ")": -1}.get(char, 0)
+        if depth == 0 and query.startswith(" AND ", index):
+            parts.append(query[start:index])
+            start = index + len(" AND ")
+    parts.append(query[start:])
+
+    clauses = {}
+    for part in parts:
+        match = CLAUSE.match(part.strip())
+        if match is None or match.group(1) in clauses:
+            return None
+        clauses[match.group(1)] = match.group(2) if match.group(2) is not None else match.group(3)
+    return clauses
+
+
+def _pattern(term):
+    """Regular expression for a query term, with * as a wildcard."""
+    return r"[\w-]*".join(re.escape(part) for part in term.split("*"))
+
+
+# Weight of each feature in a candidate's match score.
+FEATURE_WEIGHTS = {"volume": 3.0, "page": 3.0, "author": 2.0, "year": 1.0, "title": 1.0}
+# Features whose agreement makes a candidate an exact match (all of them) or a probable match (any).
+MATCH_FEATURES = ("volume", "page")
+
+
+def _first(wos_metadata, field):
+    """First value of a Lite metadata field, or None if missing."""
+    values = wos_metadata.get(field)
+    if isinstance(values, list):
+        return values[0] if values else None
+    return values
+
+
+def _normalize(value):
+    """Lowercase, stripped text of a volume, page or year; None if missing or unknown."""
+    if value is None:
+        return None
+    value = unicode(value).strip().lower()
+    return value if value and value not in ("none", "9999") else None
+
+
+def _page_parts(pages):
+    """Set of the first and last page of a page range such as 293-299."""
+    pages = _normalize(pages)
+    return set(part.strip() for part in pages.split("-")) if pages else None
+
+
+def _page_range(pages):
+    """Numeric (first, last) pages of a page range, or None if not numeric."""
+    parts = [part.strip() for part in (_normalize(pages) or "").split("-")]
+    if not all(part.isdigit() for part in parts):
+        return None
+    return int(parts[0]), int(parts[-1])
+
+
+def _year(year):
+    """Publication year as a number, or None if missing or unknown."""
+    year = _normalize(year)
+    return int(year) if year and year.isdigit() else None
+
+
+def _surnames(authors):
+    """Last names from an author value such as (Smith AND Jones), as used in AU= clauses."""
+    authors = (authors or u"").strip()
+    if authors.startswith("(") and authors.endswith(")"):
+        authors = authors[1:-1]
+    return [name.strip() for name in authors.split(" AND ") if name.strip()]
+
+
+class CandidateFeatures():
+    """Normalized features of WOS Lite records, held column by column.
+
+    Each record's volume, page range, year, author list and title trigrams are
+    extracted once, so many known items can be scored against the same
+    records, e.g. the union of records a batched query found, without parsing
+    them again for every item. A column holds None where a record lacks the field.
+    """
+
+    COLUMNS = ("records", "volumes", "pages", "page_ranges", "years", "authors", "titles")
+
+    def __init__(self, wos_records):
+        """
+        Extract features.
+
+        args:
+            wos_records (list): metadata of records found, as from MetaWosLite.get_metadata.
+        """
+        self.records = list(wos_records)
+        self.volumes = [_normalize(_first(record, "Volume")) for record in self.records]
+        self.pages = [_page_parts(_first(record, "Pages")) for record in self.records]
+        self.page_ranges = [_page_range(_first(record, "Pages")) for record in self.records]
+        self.years = [_year(_first(record, "Published.BiblioYear")) for record in self.records]
+        self.authors = [record.get("wos_authors") or u"" for record in self.records]
+        self.titles = [trigrams(normalize_title(record["wos_title"])) if record.get("wos_title") else None
+                       for record in self.records]
+
+    def subset(self, positions):
+        """
+        Return features of the records at positions only, without extracting them again.
+
+        args:
+            positions (list): indexes into records.
+        """
+        subset = CandidateFeatures([])
+        for column in self.COLUMNS:
+            values = getattr(self, column)
+            setattr(subset, column, [values[position] for position in positions])
+        return subset
+
+    def __len__(self):
+        return len(self.records)
+
+
+def score_candidates(search_data, candidates, weights=FEATURE_WEIGHTS):
+    """Score how well each candidate record matches a known item.
+
+    Features are compared column by column: volume and year agreement, the
+    page range (1 if a page agrees, 0.5 if the item's first page lies within
+    the record's range), the share of the item's author last names among the
+    record's authors, and the trigram similarity of titles. Features the item
+    or a record lacks are left out of its score.
+
+    args:
+        search_data (dict): row the item was searched with, with volume, page and optionally year, author and title.
+        candidates (CandidateFeatures): features of the records found.
+        weights (dict): weight of each feature.
+
+    returns:
+        (list): (score, features) of each candidate in order, where score lies
+            between 0 and 1 and features holds the score of each compared feature.
+    """
+    clauses = query_clauses(search_data.get("query") or u"") or {}
+    size = len(candidates)
+    columns = dict((feature, [None] * size) for feature in weights)
+
+    volume = _normalize(search_data.get("volume"))
+    for i, other in enumerate(candidates.volumes):
+        columns["volume"][i] = float(volume is not None and volume == other)
+
+    pages = _page_parts(search_data.get("page"))
+    page_range = _page_range(search_data.get("page"))
+    for i, (other, other_range) in enumerate(zip(candidates.pages, candidates.page_ranges)):
+        if pages and other and pages & other:
+            columns["page"][i] = 1.0
+        elif page_range and other_range and other_range[0] <= page_range[0] <= other_range[1]:
+            columns["page"][i] = 0.5
+        else:
+            columns["page"][i] = 0.0
+
+    year = _year(search_data.get("year") or clauses.get("PY"))
+    if year is not None:
+        for i, other in enumerate(candidates.years):
+            columns["year"][i] = None if other is None else max(0.0, 1.0 - 0.5 * abs(year - other))
+
+    surnames = _surnames(search_data.get("author") or clauses.get("AU"))
+    if surnames:
+        patterns = [re.compile(r"(?<![\w-]){0}\s*,".format(_pattern(name)), re.IGNORECASE | re.UNICODE)
+                    for name in surnames]
+        for i, authors in enumerate(candidates.authors):
+            columns["author"][i] = sum(1 for pattern in patterns if pattern.search(authors)) / float(len(patterns))
+
+    title = normalize_title(search_data["title"]) if search_data.get("title") else None
+    if title:
+        grams = trigrams(title)
+        for i, other in enumerate(candidates.titles):
+            if other:
+                columns["title"][i] = len(grams & other) / float(len(grams | other))
+
+    scores = []
+    for i in xrange(size):
+        features = dict((feature, column[i]) for feature, column in columns.items() if column[i] is not None)
+        total = sum(weights[feature] for feature in features)
+        score = sum(weights[feature] * value for feature, value in features.items()) / total if total else 0.0
+        scores.append((score, features))
+    return scores
+
+
+def score_rows(rows, candidates, weights=FEATURE_WEIGHTS):
+    """Rank candidate records for many known items at once.
+
+    args:
+        rows (list): rows the items were searched with.
+        candidates (CandidateFeatures or list): records found, e.g. for a batched query.
+        weights (dict): weight of each feature.
+
+    returns:
+        (list): for each row, (score, position) of every candidate, best first.
+    """
+    if not isinstance(candidates, CandidateFeatures):
+        candidates = CandidateFeatures(candidates)
+    ranked = []
+    for row in rows:
+        scores = score_candidates(row, candidates, weights)
+        ranked.append(sorted(((score, i) for i, (score, features) in enumerate(scores)),
+                             key=lambda pair: (-pair[0], pair[1])))
+    return ranked
+
+
+def match_label(features):
+    """
+    Label a scored candidate as the exact/probable matches of earlier versions did.
+
+    args:
+        features (dict): feature scores of a candidate, as from score_candidates.
+
+    returns:
+        (str): "exact_match" if volume and page agree, "probable_match" if either does, else "no verifiable match".
+    """
+    agreeing = [features.get(feature) == 1.0 for feature in MATCH_FEATURES]
+    if all(agreeing):
+        return "exact_match"
+    elif any(agreeing):
+        return "probable_match"
+    return "no verifiable match"
+
+
+def assess_matches(search_data, wos_records, records_found):
+    """Decide which WOS records found for a known item to store as its matches.
+
+    Candidates are scored with score_candidates. A single result is taken as
+    the match. Among several, the best scoring exact match is taken, or else
+    every probable match, best first. Each match carries its score as
+    wos_match_score.
+
+    args:
+        search_data (dict): row the item was searched with.
+        wos_records (list or CandidateFeatures): metadata of the records found, as from MetaWosLite.get_metadata.
+        records_found (int): number of records the item's query found.
+
+    returns:
+        (list): search_data updated with each match's metadata; search_data alone if nothing was found.
+    """
+    if records_found < 1:
+        return [search_data.copy()]
+
+    candidates = wos_records if isinstance(wos_records, CandidateFeatures) else CandidateFeatures(wos_records)
+    scores = score_candidates(search_data, candidates)
+
+    def merged(position):
+        match = search_data.copy()
+        match.update(candidates.records[position])
+        match["wos_match_score"] = round(scores[position][0], 4)
+        return match
+
+    if records_found == 1:
+        match = merged(0)
+        # TODO Fix result count. It always comes out 1.
+        match["wos_result_count"] = 1
+        return [match]
+
+    ranked = sorted(xrange(len(scores)), key=lambda i: -scores[i][0])
+    labels = dict((i, match_label(scores[i][1])) for i in ranked)
+    exact = [i for i in ranked if labels[i] == "exact_match"]
+    if exact:
+        return [merged(exact[0])]
+
+    matches = [merged(i) for i in ranked if labels[i] == "probable_match"]
+    print "----Storing {0} record(s)".format(len(matches))
+    return matches
+
+
 class SiftSearchResults():
     """Sort out exact matches from WOS Lite metadata."""
 
@@ -17,24 +300,37 @@ class SiftSearchResults():
         returns:
             (str): assessment of likelihood two records match.
         """
-        print "----Comparing {0}".format(self.wos_metadata["wos_title"])
-        vol_match = False
-        page_match = False
-        if "Volume" in self.wos_metadata:
-            vol_match = self.check_volume() 
-        #issue_match = self.check_issue()
+        scores = score_candidates(self.original_metadata, CandidateFeatures([self.wos_metadata]))
+        return match_label(scores[0][1])
 
-        if "Pages" in self.wos_metadata:
-            page_match = self.check_page()
+    def matches_query(self, clauses):
+        """Check whether the WOS record satisfies every clause of a known-item query.
 
-        if all([vol_match, page_match]):
-            return "exact_match"
+        args:
+            clauses (dict): field clauses as returned by query_clauses.
 
-        elif vol_match or page_match:
-            return "probable_match"
+        returns:
+            (bool): whether the query would have found the record.
+        """
+        return all([self.check_authors(clauses["AU"]) if "AU" in clauses else True,
+                    self.check_year(clauses["PY"]) if "PY" in clauses else True,
+                    self.check_source(clauses["SO"]) if "SO" in clauses else True])
 
-        else:
-            return "no verifiable match"
+    def check_authors(self, authors):
+        """Check each author last name in an AU= clause is among the record's authors."""
+        return all(re.search(r"(?<![\w-]){0}\s*,".format(_pattern(name.strip())), self.wos_metadata["wos_authors"],
+                             re.IGNORECASE | re.UNICODE)
+                   for name in authors.split(" AND ") if name.strip())
+
+    def check_year(self, year):
+        """Check record was published in the year of a PY= clause."""
+        return year in self.wos_metadata.get("Published.BiblioYear", [])
+
+    def check_source(self, source):
+        """Check each word of an SO= clause, e.g. an abbreviation such as J*, is in the record's source title."""
+        return any(all(re.search(r"(?<![\w-]){0}(?![\w-])".format(_pattern(word)), title, re.IGNORECASE | re.UNICODE)
+                       for word in source.split())
+                   for title in self.wos_metadata.get("SourceTitle", []))
 
     def check_volume(self):
         """Check it issue from data sources match."""
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+from checkpoint import to_plain
+import gzip
+import json
+import threading
+
+
+def open_output(path, compress=None):
+    """
+    Open a file for writing, gzip-compressed if requested.
+
+    Positional arguments:
+    path (str) -- file to write.
+
+    Keyword arguments:
+    compress (bool) -- gzip the output; decided by a ".gz" suffix on path if None.
+    """
+    if compress is None:
+        compress = path.endswith(".gz")
+    if compress:
+        return gzip.open(path, "wb")
+    return open(path, "wb")
+
+
+def tsv_value(value):
+    """Format a metadata value as a single TSV cell."""
+    if value is None:
+        return ""
+    if not isinstance(value, basestring):
+        value = unicode(value)
+    if isinstance(value, unicode):
+        value = value.encode("utf8")
+    return value.replace("\t", " ").replace("\r", " ").replace("\n", " ")
+
+
+class TsvSink():
+    """Writes records as rows of a tab-separated file with a fixed set of columns.
+
+    Each record is written as soon as its page is parsed. Fields missing from
+    a record are left empty and fields not in the schema are dropped, so every
+    row lines up with the header. Tabs and line breaks within values become
+    spaces.
+    """
+
+    def __init__(self, path, fields, compress=None):
+        """
+        Open file and write header row.
+
+        Positional arguments:
+        path (str) -- file to write; gzip-compressed if it ends in ".gz".
+        fields (list) -- column names, in order, e.g. ["query"] + metawos.METADATA_ELEMENTS.
+
+        Keyword arguments:
+        compress (bool) -- override compression chosen by the file suffix.
+        """
+        self.path = path
+        self.fields = list(fields)
+        self.lock = threading.Lock()
+        self.records = 0
+        self.fh = open_output(path, compress)
+        self.fh.write("\t".join(tsv_value(field) for field in self.fields) + "\n")
+
+    def write(self, records):
+        """
+        Append records as rows.
+
+        Positional arguments:
+        records (list) -- metadata dictionaries, e.g. one result page.
+        """
+        rows = ["\t".join(tsv_value(record.get(field)) for field in self.fields) + "\n" for record in records]
+        with self.lock:
+            self.fh.writelines(rows)
+            self.records += len(rows)
+
+    def close(self):
+        """Flush and close the file."""
+        self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class JsonLinesSink():
+    """Writes each record as one JSON object per line.
+
+    suds objects in Lite records are converted to dictionaries, so records of
+    either client can be written.
+    """
+
+    def __init__(self, path, compress=None):
+        """
+        Open file.
+
+        Positional arguments:
+        path (str) -- file to write; gzip-compressed if it ends in ".gz".
+
+        Keyword arguments:
+        compress (bool) -- override compression chosen by the file suffix.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.records = 0
+        self.fh = open_output(path, compress)
+
+    def write(self, records):
+        """
+        Append records as JSON lines.
+
+        Positional arguments:
+        records (list) -- metadata dictionaries, e.g. one result page.
+        """
+        lines = [json.dumps(to_plain(record), sort_keys=True) + "\n" for record in records]
+        with self.lock:
+            self.fh.writelines(lines)
+            self.records += len(lines)
+
+    def close(self):
+        """Flush and close the file."""
+        self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+from ratelimit import BudgetExhausted, CallBudget
+from workerpool import WorkerPool
+import heapq
+
+# Category holding the records an expansion in each direction leads to.
+NEXT_RECORDS = {"forward": "forward_citations", "backward": "hot_records"}
+
+
+def times_cited(record):
+    """Default crawl priority: the record's times cited count, 0 if unknown."""
+    try:
+        return int(record.get("times_cited", 0))
+    except ValueError:
+        return 0
+
+
+def record_uid(record):
+    """Return UID of a Premium ("accession_number") or Lite ("uid") record."""
+    return record.get("accession_number") or record.get("uid")
+
+
+class SnowballCrawler():
+    """Multi-hop citation crawler with a priority frontier and a hard call budget.
+
+    Starting from seed records, citing articles (forward) and/or cited
+    references (backward) are expanded hop by hop up to a given depth. The
+    frontier is a heap ordered by score, times cited by default, so the most
+    cited records are expanded first and a limited budget is spent where it
+    matters most. Each UID is expanded at most once per direction. Forward
+    expansion of records known to have no citations is skipped.
+
+    Backward expansion follows cited references marked "hot", whose full
+    records are found by title search; other references have no UID and end
+    the path.
+
+    The frontier is fetched by several spawned Wos instances at once. Their
+    records are stored through the crawling Wos's store_records, so they end
+    up in its metadata_collection and sinks as with one-hop expansion.
+    """
+
+    def __init__(self, wos, direction="forward", depth=2, max_calls=None, workers=1, score=times_cited):
+        """
+        Establish crawl settings.
+
+        Positional arguments:
+        wos (Wos) -- authorized Wos instance receiving the gathered records.
+
+        Keyword arguments:
+        direction (str) -- "forward" for citing articles, "backward" for cited references, or "both".
+        depth (int) -- citation hops to expand from the seeds.
+        max_calls (int or CallBudget) -- hard limit on API calls for the crawl; unlimited if None.
+        workers (int) -- frontier records expanded at once.
+        score (callable) -- priority of a record, higher first; times cited if not given.
+        """
+        self.wos = wos
+        self.directions = ["forward", "backward"] if direction == "both" else [direction]
+        self.depth = depth
+        if max_calls is not None and not isinstance(max_calls, CallBudget):
+            max_calls = CallBudget(max_calls)
+        self.budget = max_calls
+        self.workers = max(1, workers)
+        self.score = score
+        self.frontier = []
+        self.depths = {}
+        self.expanded = set()
+        self.exhausted = False
+        self._order = 0
+
+    def add_seeds(self, seeds):
+        """
+        Add records to start crawling from.
+
+        Positional arguments:
+        seeds (iterable) -- metadata records, e.g. metadata_collection["search_results"], or UIDs.
+            UIDs given without a record are expanded before any scored record.
+        """
+        for seed in seeds:
+            if isinstance(seed, basestring):
+                self._push(seed, 0, float("inf"), None)
+            else:
+                self._push(record_uid(seed), 0, self.score(seed), seed)
+
+    def _push(self, uid, depth, score, record):
+        """Add uid to the frontier for each direction, unless already seen."""
+        if not uid or uid in self.depths:
+            return
+        self.depths[uid] = depth
+        if depth >= self.depth:
+            return
+        for direction in self.directions:
+            if direction == "forward" and record is not None and record.get("times_cited") == "0":
+                continue
+            self._order += 1
+            heapq.heappush(self.frontier, (-score, self._order, uid, direction))
+
+    def crawl(self):
+        """
+        Expand the frontier until it is empty or the call budget is used up.
+
+        returns:
+            (int): records expanded, counting each direction once.
+        """
+        spawned = [self.wos.spawn(call_budget=self.budget) for i in range(self.workers)]
+        pool = WorkerPool(self.workers)
+        while self.frontier and not self.exhausted:
+            batch = [heapq.heappop(self.frontier) for i in range(min(self.workers, len(self.frontier)))]
+            tasks = [(score, uid, direction) for score, order, uid, direction in batch]
+            for entry, (records, exhausted) in zip(batch, pool.map(self._expand, zip(spawned, tasks))):
+                score, order, uid, direction = entry
+                self.exhausted = self.exhausted or exhausted or \
+                    (self.budget is not None and not self.budget.remaining())
+                for category, page_records in records.items():
+                    self.wos.store_records(category, page_records)
+                if exhausted:
+                    # Cut short by the budget: left on the frontier, and not counted as expanded.
+                    heapq.heappush(self.frontier, entry)
+                    continue
+                self.expanded.add((uid, direction))
+                for record in records.get(NEXT_RECORDS[direction], []):
+                    self._push(record_uid(record), self.depths[uid] + 1, self.score(record), record)
+        if self.exhausted:
+            print "Call budget exhausted with {0} frontier entries left.".format(len(self.frontier))
+        print "Expanded {0} records.".format(len(self.expanded))
+        return len(self.expanded)
+
+    def _expand(self, item):
+        """
+        Fetch one hop from a UID with a spawned Wos.
+
+        returns:
+            (tuple): records gathered by category, and whether the call budget ran out.
+        """
+        wos, (score, uid, direction) = item
+        for category in wos.metadata_collection:
+            wos.metadata_collection[category] = []
+        exhausted = False
+        try:
+            if direction == "forward":
+                wos.citing_articles(uid, wos.retrieve_parameters())
+            else:
+                wos.cited_references(uid, wos.retrieve_parameters(option={"key": "Hot", "value": "On"}),
+                                     get_full_records=True)
+        except BudgetExhausted:
+            exhausted = True
+        except Exception as e:
+            print "Expanding {0} failed: {1}".format(uid, e)
+        return dict(wos.metadata_collection), exhausted
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+from suds.transport import Request, TransportError
+from suds.transport.http import HttpTransport
+from suds.sax.text import Text
+from lxml import etree
+import copy
+
+SOAP_ENV = "http://schemas.xmlsoap.org/soap/envelope/"
+
+# Service namespaces by the last component of the endpoint path.
+SERVICE_NAMESPACES = {
+    "WOKMWSAuthenticate": "http://auth.cxf.wokmws.thomsonreuters.com",
+    "WokSearch": "http://woksearch.v3.wokmws.thomsonreuters.com",
+    "WokSearchLite": "http://woksearchlite.v3.wokmws.thomsonreuters.com",
+}
+
+# Request elements in schema order, by operation.
+OPERATIONS = {
+    "authenticate": (),
+    "closeSession": (),
+    "search": ("queryParameters", "retrieveParameters"),
+    "retrieve": ("queryId", "retrieveParameters"),
+    "retrieveById": ("databaseId", "uid", "queryLanguage", "retrieveParameters"),
+    "citedReferences": ("databaseId", "uid", "queryLanguage", "retrieveParameters"),
+    "citedReferencesRetrieve": ("queryId", "retrieveParameters"),
+    "citingArticles": ("databaseId", "uid", "editions", "timeSpan", "queryLanguage", "retrieveParameters"),
+}
+
+# Child elements in schema order, by complex element name.
+ELEMENTS = {
+    "queryParameters": ("databaseId", "userQuery", "editions", "symbolicTimeSpan", "timeSpan", "queryLanguage"),
+    "retrieveParameters": ("firstRecord", "count", "sortField", "viewField", "option"),
+    "editions": ("collection", "edition"),
+    "timeSpan": ("begin", "end"),
+    "sortField": ("name", "sort"),
+    "viewField": ("collectionName", "fieldName"),
+    "option": ("key", "value"),
+}
+
+# Factory type names as used with suds, mapped to the fields they start out with.
+TYPES = {
+    "queryParameters": {"editions": [], "symbolicTimeSpan": None, "timeSpan": None},
+    "retrieveParameters": {"sortField": [], "viewField": [], "option": []},
+    "editionDesc": {"collection": None, "edition": None},
+    "timeSpan": {"begin": None, "end": None},
+    "sortField": {"name": None, "sort": None},
+    "viewField": {"collectionName": None, "fieldName": []},
+    "keyValuePair": {"key": None, "value": None},
+}
+
+# Response elements that may repeat and are always returned as lists.
+REPEATED = ("records", "references", "title", "source", "authors", "keywords", "other", "value")
+
+# Response elements converted to numbers, typed as suds does from the schema.
+NUMERIC = {"recordsFound": int, "recordsSearched": long}
+
+
+class SoapFault(Exception):
+    """SOAP fault returned by the server, worded like suds' WebFault."""
+
+    def __init__(self, faultstring):
+        Exception.__init__(self, u"Server raised fault: '{0}'".format(faultstring))
+        self.faultstring = faultstring
+
+
+class SoapObject(dict):
+    """Request or response values, readable as attributes like suds objects."""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+
+class Factory():
+    """Stand-in for suds' client.factory, creating parameter objects."""
+
+    def create(self, name):
+        """
+        Return an empty parameter object of the given type.
+
+        Positional arguments:
+        name (str) -- type name, e.g. "queryParameters" or "retrieveParameters".
+        """
+        return SoapObject(copy.deepcopy(TYPES.get(name, {})))
+
+
+class Options():
+    """Client options used by Wos: the transport and message plugins."""
+
+    def __init__(self, transport=None, plugins=None):
+        self.transport = transport
+        self.plugins = plugins or []
+
+
+class MessageContext():
+    """Context passed to plugins' sending and received hooks, as with suds."""
+
+    def __init__(self, envelope=None, reply=None):
+        self.envelope = envelope
+        self.reply = reply
+
+
+class Service():
+    """Exposes each WOS operation as a method, like suds' client.service."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def __getattr__(self, operation):
+        if operation not in OPERATIONS:
+            raise AttributeError(operation)
+        return lambda *args, **kwargs: self.client.invoke(operation, args, kwargs.get("__inject"))
+
+
+class LxmlSoapClient():
+    """Drop-in replacement for the suds clients used by Wos.
+
+    Request envelopes are built from prebuilt lxml templates and replies are
+    parsed straight into SoapObject results, skipping suds' WSDL-driven
+    marshalling and unmarshalling. Records in FullRecord replies stay the raw
+    XML string, and text values are suds Text, as with suds.
+    """
+
+    def __init__(self, url, transport=None):
+        """
+        Establish endpoint.
+
+        Positional arguments:
+        url (str) -- service WSDL or endpoint URL.
+
+        Keyword arguments:
+        transport (suds.transport.Transport) -- transport to send requests through.
+        """
+        self.url = url.split("?")[0]
+        self.namespace = SERVICE_NAMESPACES[self.url.rstrip("/").split("/")[-1]]
+        self.lite = self.namespace == SERVICE_NAMESPACES["WokSearchLite"]
+        self.options = Options(transport=transport or HttpTransport())
+        self.factory = Factory()
+        self.service = Service(self)
+        self.templates = dict((operation, self._template(operation)) for operation in OPERATIONS)
+
+    def _template(self, operation):
+        """Build the empty envelope for an operation."""
+        envelope = etree.Element("{%s}Envelope" % SOAP_ENV, nsmap={"soap": SOAP_ENV, "ns": self.namespace})
+        etree.SubElement(envelope, "{%s}Header" % SOAP_ENV)
+        body = etree.SubElement(envelope, "{%s}Body" % SOAP_ENV)
+        etree.SubElement(body, "{%s}%s" % (self.namespace, operation))
+        return envelope
+
+    def clone(self):
+        """Return a client sharing this one's transport and plugins."""
+        clone = LxmlSoapClient(self.url)
+        clone.options = Options(self.options.transport, list(self.options.plugins))
+        return clone
+
+    def set_options(self, **kwargs):
+        """Set transport and/or plugins."""
+        for key, value in kwargs.items():
+            setattr(self.options, key, value)
+
+    def envelope(self, operation, args):
+        """
+        Build the request envelope for an operation.
+
+        Positional arguments:
+        operation (str) -- operation name, e.g. "search".
+        args (tuple) -- operation arguments in the same order suds expects.
+        """
+        envelope = copy.deepcopy(self.templates[operation])
+        request = envelope[1][0]
+        for name, value in zip(OPERATIONS[operation], args):
+            _marshal(request, name, value)
+        return etree.tostring(envelope, encoding="utf-8", xml_declaration=True)
+
+    def invoke(self, operation, args, inject=None):
+        """
+        Send an operation's request and return its parsed result.
+
+        Keyword arguments:
+        inject (dict) -- {"reply": raw_xml} to process a stored reply instead of sending.
+        """
+        if inject is not None:
+            return self.parse(operation, inject["reply"])
+
+        envelope = self.envelope(operation, args)
+        for plugin in self.options.plugins:
+            plugin.sending(MessageContext(envelope=envelope))
+        request = Request(self.url, envelope)
+        request.headers = {"Content-Type": "text/xml; charset=utf-8", "SOAPAction": '""'}
+        try:
+            reply = self.options.transport.send(request).message
+        except TransportError as e:
+            if e.httpcode == 500 and e.fp is not None:
+                self.parse(operation, e.fp.read())
+            raise
+        for plugin in self.options.plugins:
+            plugin.received(MessageContext(reply=reply))
+        return self.parse(operation, reply)
+
+    def parse(self, operation, reply):
+        """
+        Parse a reply envelope into a result, raising SoapFault for faults.
+
+        A reply with several return elements, e.g. from citedReferencesRetrieve,
+        gives a list of results, as with suds.
+
+        Positional arguments:
+        operation (str) -- operation the reply answers.
+        reply (str) -- raw reply XML.
+        """
+        body = etree.fromstring(reply).find("{%s}Body" % SOAP_ENV)
+        fault = body.find("{%s}Fault" % SOAP_ENV)
+        if fault is not None:
+            raise SoapFault(fault.findtext("faultstring"))
+        response = body[0] if len(body) else None
+        if response is None:
+            return None
+        returned = [_unmarshal(element) if len(element) else Text(element.text)
+                    for element in response.findall("return")]
+        if not returned:
+            return None
+        return returned[0] if len(returned) == 1 else returned
+
+    def __str__(self):
+        return "LxmlSoapClient for {0}".format(self.url)
+
+
+def _marshal(parent, name, value):
+    """Append value to parent as element(s) called name."""
+    if value is None:
+        return
+    if isinstance(value, (list, tuple)):
+        for item in value:
+            _marshal(parent, name, item)
+        return
+    if isinstance(value, dict):
+        if not any(v not in (None, []) for v in value.values()):
+            return
+        element = etree.SubElement(parent, name)
+        for key in ELEMENTS.get(name, sorted(value)):
+            _marshal(element, key, value.get(key))
+        return
+    element = etree.SubElement(parent, name)
+    element.text = value if isinstance(value, basestring) else unicode(value)
+
+
+def _unmarshal(element):
+    """Convert a response element with children into a SoapObject."""
+    result = SoapObject()
+    for child in element:
+        name = etree.QName(child).localname
+        if len(child):
+            value = _unmarshal(child)
+        elif name in NUMERIC:
+            value = NUMERIC[name](child.text)
+        else:
+            value = Text(child.text)
+        if name in REPEATED and (len(child) or name == "value"):
+            result.setdefault(name, []).append(value)
+        else:
+            result[name] = value
+    return result
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+from checkpoint import to_plain
+from metawos import METADATA_ELEMENTS
+import json
+import sqlite3
+import threading
+
+CITED_REFERENCE_FIELDS = ["docid", "citedAuthor", "citedTitle", "citedWork", "hot", "year"]
+
+# Columns and unique key of each table, by metadata_collection category.
+# Fields of a record without a column are kept as JSON in the extra column.
+TABLES = {
+    "search_results": (["query"] + METADATA_ELEMENTS, ["accession_number"]),
+    "forward_citations": (["query", "source_id"] + METADATA_ELEMENTS, ["source_id", "accession_number"]),
+    "backward_citations": (["source_id"] + CITED_REFERENCE_FIELDS, ["source_id", "docid"]),
+    "hot_records": (["query", "source_id"] + METADATA_ELEMENTS, ["source_id", "accession_number"]),
+}
+
+# Indexed columns, besides the unique key.
+INDEXES = ("accession_number", "docid", "source_id", "query")
+
+# Rows fetched at a time while streaming records.
+FETCH_SIZE = 500
+
+
+def db_value(value):
+    """Convert a metadata value for storage: text as unicode, other values as JSON text."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return value.decode("utf8")
+    if isinstance(value, unicode):
+        return value
+    return json.dumps(to_plain(value))
+
+
+class SqliteStore():
+    """SQLite database of harvested records, one table per metadata_collection category.
+
+    Each result page is inserted in a single transaction with executemany.
+    Records are upserted on their accession_number (docid for cited
+    references), together with source_id for citations, so repeated or resumed
+    harvests do not create duplicates. Tables are indexed on UID, source_id
+    and query and can be queried and joined with SQL without loading them
+    into Python.
+
+    Lite client records, whose UID is stored under "uid", are keyed the same
+    way; their structured fields are kept as JSON in the extra column.
+    """
+
+    def __init__(self, path, timeout=30):
+        """
+        Open database, creating tables and indexes if missing.
+
+        Positional arguments:
+        path (str) -- database file, or ":memory:".
+
+        Keyword arguments:
+        timeout (int) -- seconds to wait for another connection's lock.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.statements = {}
+        with self.connection:
+            for category, (columns, key) in TABLES.items():
+                self._create(category, columns, key)
+
+    def _create(self, table, columns, key):
+        definitions = ", ".join('"{0}" TEXT'.format(column) for column in columns)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS {0} ({1}, extra TEXT, UNIQUE ({2}))'.format(
+            table, definitions, ", ".join(key)))
+        for column in INDEXES:
+            # The unique key's own index already serves lookups on its first column.
+            if column in columns and column != key[0]:
+                self.connection.execute('CREATE INDEX IF NOT EXISTS {0}_{1} ON {0} ("{1}")'.format(table, column))
+        placeholders = ", ".join("?" for column in columns)
+        self.statements[table] = 'INSERT OR REPLACE INTO {0} ({1}, extra) VALUES ({2}, ?)'.format(
+            table, ", ".join('"{0}"'.format(column) for column in columns), placeholders)
+
+    def _row(self, category, record):
+        columns = TABLES[category][0]
+        record = dict(record)
+        if "accession_number" in columns and "accession_number" not in record and "uid" in record:
+            record["accession_number"] = record.pop("uid")
+        # Structured values, such as the label/value lists of Lite records, go to extra.
+        extra = dict((field, value) for field, value in record.items()
+                     if field not in columns or not isinstance(value, basestring))
+        return [db_value(record.get(column)) if column not in extra else None for column in columns] + \
+            [db_value(extra) if extra else None]
+
+    def write(self, category, records):
+        """
+        Upsert one page of records.
+
+        Positional arguments:
+        category (str) -- metadata_collection category, e.g. "forward_citations".
+        records (list) -- metadata dictionaries.
+        """
+        rows = [self._row(category, record) for record in records]
+        with self.lock:
+            with self.connection:
+                self.connection.executemany(self.statements[category], rows)
+
+    def sink(self, category):
+        """Return a sink writing records of category to this store, for use in Wos sinks."""
+        return SqliteSink(self, category)
+
+    def sinks(self, categories=None):
+        """
+        Return sinks for Wos or WosCalls, by category.
+
+        Keyword arguments:
+        categories (list) -- categories to store; all if None.
+        """
+        return dict((category, self.sink(category)) for category in categories or TABLES)
+
+    def execute(self, sql, parameters=()):
+        """
+        Run an SQL statement, e.g. a query joining tables.
+
+        All result rows are fetched into memory at once; records streams them instead.
+
+        returns:
+            (list): result rows, readable by column name.
+        """
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def records(self, category, where=None, parameters=()):
+        """
+        Yield stored records of a category as dictionaries, like metadata_collection entries.
+
+        Rows are read through their own cursor, FETCH_SIZE at a time, so the table is never
+        loaded whole.
+
+        Positional arguments:
+        category (str) -- metadata_collection category.
+
+        Keyword arguments:
+        where (str) -- SQL condition, e.g. "source_id = ?".
+        parameters (tuple) -- values for the condition's placeholders.
+        """
+        sql = "SELECT * FROM {0}".format(category)
+        if where:
+            sql += " WHERE " + where
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute(sql, parameters)
+        try:
+            while True:
+                with self.lock:
+                    rows = cursor.fetchmany(FETCH_SIZE)
+                if not rows:
+                    break
+                for row in rows:
+                    record = dict((column, row[column]) for column in TABLES[category][0]
+                                  if row[column] is not None)
+                    if row["extra"]:
+                        record.update(json.loads(row["extra"]))
+                    yield record
+        finally:
+            cursor.close()
+
+    def count(self, category):
+        """Return number of records stored for a category."""
+        return self.execute("SELECT COUNT(*) FROM {0}".format(category))[0][0]
+
+    def close(self):
+        """Close database."""
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class SqliteSink():
+    """Writes one metadata_collection category to a SqliteStore."""
+
+    def __init__(self, store, category):
+        self.store = store
+        self.category = category
+
+    def write(self, records):
+        """Upsert one page of records."""
+        self.store.write(self.category, records)
+
+    def close(self):
+        """Nothing to close; the store is closed on its own."""
+        pass
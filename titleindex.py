@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from array import array
+import math
+import re
+import threading
+import unicodedata
+
+# Categories whose records are added to a Wos instance's title index as they are stored.
+INDEXED_CATEGORIES = ("search_results", "forward_citations", "hot_records")
+
+# Fewest words a title needs to identify a reference on its own.
+MIN_TITLE_WORDS = 3
+
+# Titles shared by many unrelated items, as normalized.
+GENERIC_TITLES = frozenset(["introduction", "editorial", "preface", "foreword", "abstract", "abstracts", "reply",
+                            "discussion", "conclusion", "conclusions", "erratum", "errata", "correction",
+                            "corrigendum", "letter", "letter to the editor", "book review", "book reviews",
+                            "review", "reviews", "commentary", "comment", "news", "untitled", "in this issue",
+                            "index", "author index", "subject index", "contents", "table of contents",
+                            "announcement", "announcements", "obituary", "retraction", "retraction notice",
+                            "notes", "meeting abstracts", "general discussion", "concluding remarks"])
+
+# Words left out when comparing a cited work with a source title.
+SOURCE_STOPWORDS = frozenset(["of", "the", "and", "in", "for", "on", "a", "an", "de", "la", "le", "und", "der"])
+
+
+def normalize_title(title):
+    """
+    Reduce a title to lowercase ASCII words, so variants in case, accents and punctuation compare equal.
+
+    Positional arguments:
+    title (str) -- article title, e.g. a cited reference's citedTitle.
+    """
+    if isinstance(title, str):
+        title = title.decode("utf8", "ignore")
+    title = unicodedata.normalize("NFKD", title).encode("ascii", "ignore").lower()
+    return " ".join(re.split(r"[^a-z0-9]+", title)).strip()
+
+
+def trigrams(normalized):
+    """Return the set of character trigrams of a normalized title, with word boundaries marked."""
+    padded = " {0} ".format(normalized)
+    return set(padded[i:i + 3] for i in xrange(len(padded) - 2))
+
+
+def distinctive(normalized):
+    """Check a normalized title is long and specific enough to identify a reference by itself."""
+    return len(normalized.split()) >= MIN_TITLE_WORDS and normalized not in GENERIC_TITLES
+
+
+def _abbreviates(short, word):
+    """Check short is word or an abbreviation of it, e.g. exp of experimental or natl of national."""
+    if not short or short[0] != word[0]:
+        return False
+    letters = iter(word)
+    return all(letter in letters for letter in short)
+
+
+def source_agrees(cited_work, source):
+    """
+    Check a cited work, often abbreviated, could be a record's source title.
+
+    Each word of the cited work must abbreviate a later word of the source title,
+    so J EXP BOT agrees with JOURNAL OF EXPERIMENTAL BOTANY.
+
+    Positional arguments:
+    cited_work (str) -- citedWork of a cited reference.
+    source (str) -- source title of a record, e.g. its publication_name.
+    """
+    cited = [word for word in normalize_title(cited_work).split() if word not in SOURCE_STOPWORDS]
+    words = iter([word for word in normalize_title(source).split() if word not in SOURCE_STOPWORDS])
+    return all(any(_abbreviates(short, word) for word in words) for short in cited)
+
+
+def _known(value):
+    return isinstance(value, basestring) and value.strip() not in ("", "NONE")
+
+
+class TitleIndex():
+    """Index of harvested records by normalized title, for resolving cited references locally.
+
+    Titles are normalized and split into character trigrams. A title is
+    matched by its trigram Jaccard similarity to indexed titles, so small
+    differences such as truncation or a changed word still match. Candidates
+    are drawn from the posting lists of the query's rarest trigrams only, as
+    any title similar enough must share at least one of them.
+
+    A Wos instance given a TitleIndex adds the search_results,
+    forward_citations and hot_records it stores, and get_full_record consults
+    it before searching the API for a hot cited reference. As with the API's
+    title search, a match must agree with the reference's year and cited
+    work where both are known, and titles too short or generic to identify
+    a reference are left to the API. Records from earlier harvests can be
+    added with add_records.
+    """
+
+    def __init__(self, threshold=0.9):
+        """
+        Establish empty index.
+
+        Keyword arguments:
+        threshold (float) -- trigram Jaccard similarity at or above which two titles match.
+        """
+        self.threshold = threshold
+        self.records = []
+        self.titles = []
+        self.sizes = array("i")
+        self.uids = {}
+        self.exact = {}
+        self.postings = {}
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.lock = threading.Lock()
+
+    def add(self, record):
+        """
+        Index one metadata record by its title.
+
+        Records without a text title, or whose UID is already indexed, are skipped.
+
+        Positional arguments:
+        record (dict) -- metadata record with "title", e.g. as compiled by MetaWos.
+        """
+        title = record.get("title")
+        if not isinstance(title, basestring) or title == "NONE":
+            return
+        normalized = normalize_title(title)
+        if not normalized:
+            return
+        uid = record.get("accession_number") or record.get("uid")
+        with self.lock:
+            if uid in self.uids:
+                return
+            position = len(self.records)
+            if uid:
+                self.uids[uid] = position
+            self.records.append(record)
+            self.titles.append(normalized)
+            self.exact.setdefault(normalized, []).append(position)
+            grams = trigrams(normalized)
+            self.sizes.append(len(grams))
+            for trigram in grams:
+                self.postings.setdefault(trigram, array("i")).append(position)
+
+    def add_records(self, records):
+        """Index each record in records."""
+        for record in records:
+            self.add(record)
+
+    def candidates(self, title):
+        """
+        Return positions of indexed records whose title matches title.
+
+        Positional arguments:
+        title (str) -- title to look up.
+        """
+        normalized = normalize_title(title)
+        if not normalized:
+            return []
+        with self.lock:
+            if normalized in self.exact:
+                return list(self.exact[normalized])
+            query = trigrams(normalized)
+            # A title sharing none of the len(query) - needed + 1 rarest trigrams
+            # has fewer than needed in common and cannot reach the threshold.
+            needed = int(math.ceil(self.threshold * len(query)))
+            rarest = sorted(query, key=lambda trigram: len(self.postings.get(trigram, ())))
+            found = set()
+            for trigram in rarest[:len(query) - needed + 1]:
+                found.update(self.postings.get(trigram, ()))
+            # Titles with far fewer or more trigrams cannot reach the threshold either.
+            smallest, largest = self.threshold * len(query), len(query) / self.threshold
+            matches = []
+            for position in found:
+                if not smallest <= self.sizes[position] <= largest:
+                    continue
+                other = trigrams(self.titles[position])
+                shared = len(query & other)
+                if shared / (len(query) + len(other) - shared) >= self.threshold:
+                    matches.append(position)
+            return matches
+
+    def match(self, title, year=None, source=None):
+        """
+        Find the one indexed record for a cited title.
+
+        Titles that are short or generic, such as "Introduction", are not looked up.
+        Records whose year or source title disagree with the reference's, where
+        both are known, are not matches.
+
+        Positional arguments:
+        title (str) -- cited title.
+
+        Keyword arguments:
+        year (str) -- publication year of the reference.
+        source (str) -- cited work of the reference, e.g. J EXP BOT.
+
+        returns:
+            (dict): the matching record, or None if no record, or more than one, matches.
+        """
+        if not distinctive(normalize_title(title)):
+            with self.lock:
+                self.skipped += 1
+            return None
+        records = [self.records[position] for position in self.candidates(title)]
+        if _known(year):
+            records = [record for record in records
+                       if not _known(record.get("date")) or record["date"].strip() == year.strip()]
+        if _known(source):
+            records = [record for record in records if not _known(record.get("publication_name"))
+                       or source_agrees(source, record["publication_name"])]
+        with self.lock:
+            if len(records) == 1:
+                self.hits += 1
+                return records[0]
+            self.misses += 1
+            return None
+
+    def __len__(self):
+        return len(self.records)
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+from suds.transport import Reply, TransportError
+from suds.transport.http import HttpTransport
+from suds.properties import Unskin
+from StringIO import StringIO
+import httplib
+import socket
+import threading
+import urlparse
+
+
+class ConnectionPool():
+    """Idle HTTP connections by host, with the session cookie and usage counts.
+
+    Shared by a PooledHttpTransport and the copies suds makes of it when a
+    client is cloned.
+    """
+
+    def __init__(self, sid=None, max_idle=4):
+        """
+        Establish empty pool.
+
+        Keyword arguments:
+        sid (str) -- session ID token sent with every request.
+        max_idle (int) -- idle connections to keep open per host.
+        """
+        self.sid = sid
+        self.local = threading.local()
+        self.max_idle = max_idle
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.requests = 0
+        self.connections_opened = 0
+        self.connections_reused = 0
+
+    def checkout(self, key, timeout, fresh=False):
+        """
+        Take an idle connection for key, or open a new one.
+
+        returns:
+            (tuple): connection and whether it has served a request before.
+        """
+        with self.lock:
+            if not fresh and self.idle.get(key):
+                return self.idle[key].pop(), True
+            self.connections_opened += 1
+
+        scheme, host, port = key
+        if scheme == "https":
+            connection = httplib.HTTPSConnection(host, port, timeout=timeout)
+        else:
+            connection = httplib.HTTPConnection(host, port, timeout=timeout)
+        return connection, False
+
+    def checkin(self, key, connection):
+        """Return connection to the pool, closing it if the pool is full."""
+        with self.lock:
+            connections = self.idle.setdefault(key, [])
+            if len(connections) < self.max_idle:
+                connections.append(connection)
+                return
+        connection.close()
+
+    def sent(self, reused):
+        """Count a completed request."""
+        with self.lock:
+            self.requests += 1
+            if reused:
+                self.connections_reused += 1
+
+    def close(self):
+        """Close all idle connections."""
+        with self.lock:
+            idle = self.idle
+            self.idle = {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+class PooledHttpTransport(HttpTransport):
+    """suds transport sending requests over persistent, pooled HTTP connections.
+
+    Every request carries the WOS session cookie, which a thread can override
+    for its own calls with use_sid, e.g. when drawing sessions from a
+    SessionPool. Idle connections are kept per host and reused by later
+    requests, so thousands of small calls do not each pay for a new TCP
+    handshake. The transport is safe to share between threads, and copies
+    made when a suds client is cloned share its connection pool.
+    """
+
+    def __init__(self, sid=None, max_idle=4, pool=None, **kwargs):
+        """
+        Establish connection pool.
+
+        Keyword arguments:
+        sid (str) -- session ID token returned by the authenticate service.
+        max_idle (int) -- idle connections to keep open per host.
+        pool (ConnectionPool) -- existing pool to share; sid and max_idle are ignored if given.
+        kwargs -- suds transport options, e.g. timeout.
+        """
+        HttpTransport.__init__(self, **kwargs)
+        self.pool = pool if pool is not None else ConnectionPool(sid=sid, max_idle=max_idle)
+
+    def open(self, request):
+        """Fetch a document, e.g. a WSDL or schema, and return it as a file-like object."""
+        status, headers, body = self._request("GET", request.url, None, {})
+        if status != 200:
+            raise TransportError("HTTP {0} for {1}".format(status, request.url), status, StringIO(body))
+        return StringIO(body)
+
+    def send(self, request):
+        """Send a SOAP envelope and return the server's reply."""
+        status, headers, body = self._request("POST", request.url, request.message, dict(request.headers))
+        if status in (202, 204):
+            return None
+        if status != 200:
+            raise TransportError("HTTP {0} for {1}".format(status, request.url), status, StringIO(body))
+        return Reply(200, headers, body)
+
+    def set_sid(self, sid):
+        """
+        Send all threads' requests with sid, e.g. after the session was renewed.
+
+        Positional arguments:
+        sid (str) -- session ID token.
+        """
+        self.pool.sid = sid
+
+    def use_sid(self, sid):
+        """
+        Send this thread's following requests with sid instead of the pool's sid.
+
+        Positional arguments:
+        sid (str) -- session ID token, or None to go back to the pool's sid.
+        """
+        self.pool.local.sid = sid
+
+    def shares_pool(self, other):
+        """Check whether other is a PooledHttpTransport using the same connection pool."""
+        return isinstance(other, PooledHttpTransport) and other.pool is self.pool
+
+    def stats(self):
+        """
+        Report how connections have been used.
+
+        returns:
+            (dict): requests sent, connections opened, requests sent over an
+                already-open connection, and the share of requests that reused one.
+        """
+        pool = self.pool
+        with pool.lock:
+            return {"requests": pool.requests,
+                    "connections_opened": pool.connections_opened,
+                    "connections_reused": pool.connections_reused,
+                    "reuse_ratio": pool.connections_reused / float(pool.requests) if pool.requests else 0.0}
+
+    def close(self):
+        """Close all idle connections."""
+        self.pool.close()
+
+    def _request(self, method, url, body, headers):
+        """
+        Send one HTTP request over a pooled connection.
+
+        A reused connection may have been closed by the server while idle; in that
+        case the request is repeated once on a fresh connection.
+        """
+        parts = urlparse.urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        sid = getattr(self.pool.local, "sid", None) or self.pool.sid
+        if sid:
+            headers["Cookie"] = 'SID="{0}"'.format(sid)
+
+        connection, reused = self.pool.checkout(key, self.options.timeout)
+        try:
+            response = self._exchange(connection, method, path, body, headers)
+        except (httplib.HTTPException, socket.error):
+            connection.close()
+            if not reused:
+                raise
+            connection, reused = self.pool.checkout(key, self.options.timeout, fresh=True)
+            try:
+                response = self._exchange(connection, method, path, body, headers)
+            except (httplib.HTTPException, socket.error):
+                connection.close()
+                raise
+
+        self.pool.sent(reused)
+        status, response_headers, response_body, will_close = response
+        if will_close:
+            connection.close()
+        else:
+            self.pool.checkin(key, connection)
+        return status, response_headers, response_body
+
+    def _exchange(self, connection, method, path, body, headers):
+        """Write request and read the complete response from connection."""
+        connection.request(method, path, body, headers)
+        response = connection.getresponse()
+        response_body = response.read()
+        return response.status, dict(response.getheaders()), response_body, response.will_close
+
+    def __deepcopy__(self, memo={}):
+        # suds deep-copies client options when cloning and links each transport
+        # to a single client's options, so hand out a copy sharing the pool.
+        clone = PooledHttpTransport(pool=self.pool)
+        Unskin(clone.options).update(Unskin(self.options))
+        return clone
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import threading
+import Queue
+
+
+class WorkerPool():
+    """Run a function over a sequence of items with a bounded number of threads.
+
+    Results are handed back in the order the items were supplied, regardless
+    of the order in which the worker threads finish them.
+    """
+
+    def __init__(self, workers=4):
+        """
+        Establish pool size.
+
+        Keyword arguments:
+        workers (int) -- maximum number of items being processed at once.
+        """
+        self.workers = max(1, int(workers))
+
+    def imap(self, func, items, context=None):
+        """
+        Yield func(item) for each item, in item order, as soon as it is ready.
+
+        Positional arguments:
+        func (callable) -- called as func(item), or func(state, item) if context is given.
+        items (iterable) -- items to process.
+
+        Keyword arguments:
+        context (callable) -- called once in each worker thread; its return value
+            is passed as the first argument to func, e.g. a per-thread client.
+        """
+        items = list(items)
+        if not items:
+            return
+
+        tasks = Queue.Queue()
+        for index, item in enumerate(items):
+            tasks.put((index, item))
+
+        done = Queue.Queue()
+        stop = threading.Event()
+
+        def work():
+            try:
+                state = context() if context is not None else None
+            except Exception as e:
+                # Fail the next item instead of leaving imap waiting for results.
+                try:
+                    index, item = tasks.get_nowait()
+                except Queue.Empty:
+                    return
+                done.put((index, None, e))
+                return
+            while not stop.is_set():
+                try:
+                    index, item = tasks.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    if context is not None:
+                        result = func(state, item)
+                    else:
+                        result = func(item)
+                    done.put((index, result, None))
+                except Exception as e:
+                    done.put((index, None, e))
+
+        threads = [threading.Thread(target=work) for i in range(min(self.workers, len(items)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        finished = {}
+        next_index = 0
+        try:
+            while next_index < len(items):
+                while next_index not in finished:
+                    index, result, error = done.get()
+                    finished[index] = (result, error)
+                result, error = finished.pop(next_index)
+                if error is not None:
+                    raise error
+                yield result
+                next_index += 1
+        finally:
+            # Let idle workers exit without picking up further items.
+            stop.set()
+
+    def map(self, func, items, context=None):
+        """Return list of func(item) results in item order. See imap."""
+        return list(self.imap(func, items, context=context))
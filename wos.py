@@ -2,79 +2,471 @@
 
 from __future__ import division
 from suds.client import Client
+from suds.cache import ObjectCache
 from suds.transport.http import HttpTransport
-from metawos import MetaWos
+from suds.bindings.multiref import MultiRef
+from metawos import MetaWos, iter_records, view_fields, METADATA_ELEMENTS
+from workerpool import WorkerPool
+from ratelimit import RateLimiter, BudgetExhausted, is_throttle_error
+from transport import PooledHttpTransport
+from responsecache import ReplyCapture
+from soapfast import LxmlSoapClient
+from metrics import WosMetrics, MessageSizes
+from recordstore import CompactRecords
+from titleindex import INDEXED_CATEGORIES
 from datetime import date
-from lxml import etree, objectify
+from lxml import etree
 import urllib2
+import copy
+import math
+import threading
 import time
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logging.getLogger('suds.client').setLevel(logging.ERROR)
 
+# Most records a single call may return.
+MAX_RECORDS_PER_CALL = 100
+
+# Longest UT= query retrieve_by_ids sends when fetching UIDs by search.
+MAX_QUERY_LENGTH = 4000
+
+# Operations managing sessions, which are not counted as calls made with one.
+SESSION_OPERATIONS = ("authenticate", "closeSession")
+
+# Parsed WSDL clients shared by every Wos instance in the process, keyed by URL.
+_wsdl_clients = {}
+_wsdl_lock = threading.Lock()
+
+
+class LockedMultiRef(MultiRef):
+    """suds reply preprocessor that can be shared by clients in several threads.
+
+    suds keeps one binding per parsed WSDL, shared by all clones of a client,
+    and its MultiRef keeps the reply being processed on the instance, so
+    concurrent replies could be swapped between threads.
+    """
+
+    def __init__(self):
+        MultiRef.__init__(self)
+        self.lock = threading.Lock()
+
+    def process(self, body):
+        with self.lock:
+            return MultiRef.process(self, body)
+
+
+def _lock_bindings(client):
+    """Make the reply processing of client's shared bindings thread-safe."""
+    for service in client.wsdl.services:
+        for port in service.ports:
+            for method in port.methods.values():
+                for binding in (method.binding.input, method.binding.output):
+                    if not isinstance(binding.multiref, LockedMultiRef):
+                        binding.multiref = LockedMultiRef()
+
+
+def wsdl_client(url, transport=None, cache_dir=None, cache_days=7):
+    """
+    Return a suds client for url, parsing its WSDL at most once per process.
+
+    The WSDL and schema documents are also cached on disk by suds, so new processes
+    skip the download as well. Each caller gets its own clone sharing the parsed WSDL.
+
+    Positional arguments:
+    url (str) -- WSDL location.
+
+    Keyword arguments:
+    transport (suds.transport.Transport) -- transport for the returned client's calls.
+    cache_dir (str) -- directory for the on-disk WSDL cache; suds' temp directory if None.
+    cache_days (int) -- days before cached WSDL documents are downloaded again.
+    """
+    with _wsdl_lock:
+        if url not in _wsdl_clients:
+            _wsdl_clients[url] = Client(url, cache=ObjectCache(location=cache_dir, days=cache_days))
+            _lock_bindings(_wsdl_clients[url])
+        client = _wsdl_clients[url].clone()
+    if transport is not None:
+        client.set_options(transport=transport)
+    return client
+
+
+def _ut_query(uids):
+    """Return a search query matching each of uids."""
+    return u"UT=({0})".format(" OR ".join(uids))
+
+
 class Wos():
     """Handle requests to the Web of Knowledge API"""
 
-    def __init__(self, client="Search", sleep_time=1):
+    def __init__(self, client="Search", sleep_time=1, workers=1, rate_limiter=None, max_retries=3, keep_alive=False,
+                 wsdl_cache_dir=None, wsdl_cache_days=7, session_pool=None,
+                 response_cache=None, checkpoint=None, backend="suds",
+                 base_url="http://search.webofknowledge.com/esti/wokmws/ws", metrics=None,
+                 compact_records=False, metadata_elements=None, sinks=None, keep_records=True, call_budget=None,
+                 title_index=None, speculative_cascade=False, max_session_calls=None):
         """
         Establish URLs for authentication, search, and search lite methods.
 
         Keyword arguments:
         client (str) -- search client to initialize: choose "Lite" or "Search"
+        sleep_time (int) -- minimum seconds between API calls, used when no rate_limiter is given.
+        workers (int) -- result pages to request at once when paging through a search.
+        rate_limiter (RateLimiter) -- limiter spacing API calls; may be shared between Wos instances.
+        max_retries (int) -- times to repeat a call the server rejected as throttled.
+        keep_alive (bool) -- send search calls over pooled persistent connections.
+        wsdl_cache_dir (str) -- directory for cached WSDL documents; suds' temp directory if None.
+        wsdl_cache_days (int) -- days before cached WSDL documents are downloaded again.
+        session_pool (SessionPool) -- spread calls over several sessions renewed in the background.
+        response_cache (ResponseCache) -- serve repeated calls from stored replies instead of the API.
+        checkpoint (CheckpointJournal) -- journal of completed result pages to resume from.
+        backend (str) -- "suds" for WSDL-driven clients, or "lxml" to build and parse SOAP messages directly.
+        base_url (str) -- location of the web services, e.g. a MockWosServer's base_url for testing.
+        metrics (WosMetrics) -- collects per-operation call counts, latencies, bytes and stage timings;
+            may be shared between Wos instances.
+        compact_records (bool) -- keep metadata_collection in CompactRecords containers instead of
+            lists of dictionaries, for long harvests that would otherwise run out of memory.
+        metadata_elements (list) -- metadata elements to compile from full records, see metawos.XPATHS;
+            all if None. A subset also limits the record sections requested from the server.
+        sinks (dict) -- sinks (see sinks.py) by metadata_collection category, written to as each page is parsed.
+        keep_records (bool) -- also keep records in metadata_collection; turn off to only stream them to sinks.
+        call_budget (CallBudget) -- hard limit on API calls; calls beyond it raise BudgetExhausted.
+            May be shared between Wos instances.
+        title_index (TitleIndex) -- index of stored records by title, consulted before searching
+            the API for hot cited references; may be shared between Wos instances.
+        speculative_cascade (bool) -- send get_full_record's three title searches at once rather than
+            one after another, trading extra calls for lower latency per hot reference.
+        max_session_calls (int) -- calls after which the session is closed and a new one opened, counting
+            those of spawned instances; None to leave renewal to the caller. Not used with a session pool.
         """
         self.citing_metadata = False
+        # Calls made with the current session, by this instance and those spawned from it.
         self.total_calls = 0
+        self.max_session_calls = max_session_calls
         self.sleep_time = sleep_time
+        self.workers = workers
+        if rate_limiter is None:
+            rate_limiter = RateLimiter(rate=1.0 / sleep_time if sleep_time else None)
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.call_budget = call_budget
+        self._calls_lock = threading.Condition()
+        self._calls_in_flight = 0
+        # Instance owning the session; spawned instances count their calls against it.
+        self._root = self
+        self.keep_alive = keep_alive
+        self.transport = None
+        self.wsdl_cache_dir = wsdl_cache_dir
+        self.wsdl_cache_days = wsdl_cache_days
+        self.session_pool = session_pool
+        self.response_cache = response_cache
+        self.reply_capture = ReplyCapture()
+        self.metrics = metrics if metrics is not None else WosMetrics()
+        self.message_sizes = MessageSizes()
+        # Origin of each query ID seen, so retrieve calls can be cached by the
+        # query that produced them rather than the session-specific ID.
+        self._query_origins = {}
+        self.checkpoint = checkpoint
+        self.backend = backend
+        self.metadata_elements = list(metadata_elements) if metadata_elements else METADATA_ELEMENTS
         self.client = client
-        self.auth_url = "http://search.webofknowledge.com/esti/wokmws/ws/WOKMWSAuthenticate?wsdl"
-        self.search_lite_url = "http://search.webofknowledge.com/esti/wokmws/ws/WokSearchLite?wsdl"
-        self.search_url = "http://search.webofknowledge.com/esti/wokmws/ws/WokSearch?wsdl"
+        self.base_url = base_url
+        self.auth_url = base_url + "/WOKMWSAuthenticate?wsdl"
+        self.search_lite_url = base_url + "/WokSearchLite?wsdl"
+        self.search_url = base_url + "/WokSearch?wsdl"
         self.auth_client = None
         self.search_client = None
-        self.metadata_collection = {"search_results": [],
-                                    "forward_citations": [],
-                                    "backward_citations": [],
-                                    "hot_records": [], }
+        self.sinks = sinks or {}
+        self.keep_records = keep_records
+        self.title_index = title_index
+        self.speculative_cascade = speculative_cascade
+        self._cascade_clients = None
+        # Resolved record, or None, of each hot reference looked up, by title, year and journal.
+        self._full_record_outcomes = {}
+        # Records stored while the current page is processed, by category, for the checkpoint journal.
+        self._page_records = None
+        records = CompactRecords if compact_records else list
+        self.metadata_collection = {"search_results": records(),
+                                    "forward_citations": records(),
+                                    "backward_citations": records(),
+                                    "hot_records": records(), }
         self.qp = None
         self.rp = None
         self.uids = []
 
+    def spawn(self, call_budget=None):
+        """
+        Return a new Wos instance using this one's session, for making calls from another thread.
+
+        The new instance shares the session token, connection pool or cookie opener,
+        rate limiter, session pool, response cache, metrics, title index and resolved
+        hot references, so its calls count against the same limits. Its calls are
+        counted in this instance's total_calls, and renew the shared session once
+        max_session_calls is reached. It has its own
+        search client and metadata_collection, and no sinks or checkpoint journal.
+        Call after authorize.
+
+        Keyword arguments:
+        call_budget (CallBudget) -- budget for the new instance's calls; this instance's if None.
+        """
+        wos = Wos(client=self.client, sleep_time=self.sleep_time, workers=self.workers, rate_limiter=self.rate_limiter,
+                  max_retries=self.max_retries, keep_alive=self.keep_alive, wsdl_cache_dir=self.wsdl_cache_dir,
+                  wsdl_cache_days=self.wsdl_cache_days, session_pool=self.session_pool,
+                  response_cache=self.response_cache, backend=self.backend, base_url=self.base_url,
+                  metrics=self.metrics, metadata_elements=self.metadata_elements,
+                  call_budget=call_budget if call_budget is not None else self.call_budget,
+                  title_index=self.title_index, speculative_cascade=self.speculative_cascade)
+        wos._root = self._root
+        wos.auth_client = self.auth_client
+        wos._full_record_outcomes = self._full_record_outcomes
+        wos.sid_token = self.sid_token
+        if isinstance(self.transport, PooledHttpTransport):
+            # A copy sharing the connection pool, as suds links a transport to one client.
+            http = copy.deepcopy(self.transport)
+        else:
+            http = HttpTransport()
+            http.urlopener = self.transport.urlopener
+        wos.transport = http
+        wos._establish_search_client(http)
+        wos.retrieve_parameters()
+        return wos
+
     def authorize(self):
         """Run authenticate service to retrieve token."""
-        self.auth_client = Client(self.auth_url)
+        if self.auth_client is None:
+            self.auth_client = self._make_client(self.auth_url)
         try:
-            self.sid_token = self.auth_client.service.authenticate()
+            if self.session_pool is not None:
+                self._start_session_pool()
+                self.sid_token = self.session_pool.acquire()
+            else:
+                self.sid_token = self._call("authenticate", client=self.auth_client)
             self._add_sid()
             print "Search client authorized."
-            self.total_calls += 1
-            
+
         except Exception as e:
             print "Authentication failed."
             print e
 
+    def _start_session_pool(self):
+        """Authenticate the pool's sessions through this instance's auth client."""
+        if self.session_pool.authenticate is None:
+            self.session_pool.authenticate = lambda: self._call("authenticate", client=self.auth_client)
+        if self.session_pool.close is None:
+            self.session_pool.close = self._close_sid
+        self.session_pool.start()
+
+    def _close_sid(self, sid):
+        """
+        Close the session identified by sid.
+
+        Positional arguments:
+        sid (str) -- session ID token to close.
+        """
+        client = self._make_client(self.auth_url, transport=PooledHttpTransport(sid=sid))
+        self._call("closeSession", client=client)
+
     def close_session(self):
-        """Close session."""
-        self.auth_client.service.closeSession()
+        """Close session. Sessions drawn from a session pool are renewed by the pool instead."""
+        if self.session_pool is not None:
+            return
+        if self._root is not self:
+            self._root.close_session()
+            return
+        self._close_sid(self.sid_token)
         self.total_calls = 0
         self.authorize()
 
     def _add_sid(self):
-        """Create URL opener with authentication token as header."""
-        opener = urllib2.build_opener()
-        opener.addheaders = [('Cookie', 'SID="'+self.sid_token+'"')]
-        http = HttpTransport()
-        http.urlopener = opener
+        """
+        Create URL opener with authentication token as header.
+
+        If a search client already exists, as when a session is renewed, only its
+        session cookie is replaced.
+        """
+        if self.search_client is not None and self.transport is not None:
+            self._set_sid_cookie(self.transport)
+            return
+
+        if self.keep_alive or self.session_pool is not None:
+            http = PooledHttpTransport(sid=self.sid_token, max_idle=max(1, self.workers))
+        else:
+            opener = urllib2.build_opener()
+            opener.addheaders = [('Cookie', 'SID="'+self.sid_token+'"')]
+            http = HttpTransport()
+            http.urlopener = opener
+        self.transport = http
         self._establish_search_client(http)
 
+    def _set_sid_cookie(self, http):
+        """Point an existing transport at the current session token."""
+        if isinstance(http, PooledHttpTransport):
+            http.set_sid(self.sid_token)
+        else:
+            http.urlopener.addheaders = [('Cookie', 'SID="'+self.sid_token+'"')]
+
+    def _make_client(self, url, transport=None):
+        """
+        Create a client for a service URL using the configured backend.
+
+        Positional arguments:
+        url (str) -- service WSDL URL.
+
+        Keyword arguments:
+        transport (suds.transport.Transport) -- transport for the client's calls.
+        """
+        if self.backend == "lxml":
+            client = LxmlSoapClient(url, transport=transport)
+        else:
+            client = wsdl_client(url, transport=transport, cache_dir=self.wsdl_cache_dir, cache_days=self.wsdl_cache_days)
+        plugins = [self.message_sizes]
+        if self.response_cache is not None:
+            plugins.append(self.reply_capture)
+        client.set_options(plugins=plugins)
+        return client
+
     def _establish_search_client(self, http):
         """Establish search client for "Search" or "SearchLite" client."""
         if self.client == "Search":
-            self.search_client = Client(self.search_url, transport=http)
+            self.search_client = self._make_client(self.search_url, transport=http)
         elif self.client == "Lite": 
-            self.search_client = Client(self.search_lite_url, transport=http)
+            self.search_client = self._make_client(self.search_lite_url, transport=http)
         else:
             print "Invalid search client"
+            return
+
+    def _call(self, operation, *args, **kwargs):
+        """
+        Invoke a SOAP operation, spaced out by the rate limiter.
+
+        With a response cache, replies to search, retrieve, citedReferences,
+        citingArticles and retrieveById are stored and repeated calls are answered
+        from the cache without contacting the API.
+
+        Positional arguments:
+        operation (str) -- name of the service method, e.g. "search" or "retrieve".
+        args -- arguments passed on to the service method.
+
+        Keyword arguments:
+        client (suds.client.Client) -- client to call through; defaults to the search client.
+        """
+        client = kwargs.get("client") or self.search_client
+        cache_key = None
+        if self.response_cache is not None and operation in self.response_cache.operations:
+            cache_key = self._cache_key(operation, args)
+
+        if cache_key is not None:
+            reply = self.response_cache.get(cache_key)
+            if reply is not None:
+                self.metrics.cached(operation)
+                results = getattr(client.service, operation)(*args, __inject={"reply": reply})
+                self._remember_query(results, operation, args, cache_key, cached=True)
+                return results
+
+            if operation == "retrieve":
+                args = (self._live_query_id(args[0], client),) + tuple(args[1:])
+
+        results = self._invoke(client, operation, args)
+        if cache_key is not None:
+            self.response_cache.put(cache_key, self.reply_capture.last_reply())
+            self._remember_query(results, operation, args, cache_key, cached=False)
+        return results
+
+    def _cache_key(self, operation, args):
+        """
+        Build response cache key for a call, or None if it should not be cached.
+
+        Query IDs are only meaningful within a session, so retrieve calls are keyed
+        by the call that produced the query ID; retrieves of unknown IDs are not cached.
+        """
+        if operation == "retrieve":
+            origin = self._query_origins.get(args[0])
+            if origin is None:
+                return None
+            return self.response_cache.key(operation, origin["key"], *args[1:])
+        return self.response_cache.key(operation, *args)
+
+    def _remember_query(self, results, operation, args, cache_key, cached):
+        """Record which call produced the query ID in results."""
+        query_id = getattr(results, "queryId", None)
+        if query_id and operation != "retrieve":
+            self._query_origins[query_id] = {"operation": operation, "args": args, "key": cache_key,
+                                             "cached": cached, "live_id": None if cached else query_id}
+
+    def _live_query_id(self, query_id, client):
+        """
+        Return a query ID valid in the current session for query_id.
+
+        A query ID taken from a cached reply may belong to an earlier session; the
+        originating call is repeated once to obtain a live one.
+        """
+        origin = self._query_origins[query_id]
+        if origin["live_id"] is None:
+            origin["live_id"] = self._invoke(client, origin["operation"], origin["args"]).queryId
+        return origin["live_id"]
+
+    def _invoke(self, client, operation, args):
+        """
+        Send a call to the API, spaced out by the rate limiter.
+
+        Calls rejected by the server as throttled slow the rate limiter down and
+        are retried up to self.max_retries times. Each attempt is recorded in
+        self.metrics and, with a call budget, taken from it.
+        """
+        attempt = 0
+        while True:
+            if self.session_pool is not None and self.transport is not None \
+                    and self.transport.shares_pool(client.options.transport):
+                self.transport.use_sid(self.session_pool.acquire())
+            if self.call_budget is not None:
+                self.call_budget.spend()
+            self.metrics.slept(self.rate_limiter.acquire())
+            self.message_sizes.reset()
+            counted = operation not in SESSION_OPERATIONS
+            if counted:
+                self._root._start_call()
+            start = time.time()
+            try:
+                results = getattr(client.service, operation)(*args)
+            except Exception as e:
+                if counted:
+                    self._root._finish_call()
+                self.metrics.call(operation, time.time() - start, *self.message_sizes.last(), error=True)
+                if not is_throttle_error(e) or attempt >= self.max_retries:
+                    raise
+                self.rate_limiter.throttled()
+                self.metrics.retry(operation)
+                attempt += 1
+                print "Throttled on {0}, retrying ({1}/{2})".format(operation, attempt, self.max_retries)
+                continue
+
+            if counted:
+                self._root._finish_call()
+            self.metrics.call(operation, time.time() - start, *self.message_sizes.last())
+            self.rate_limiter.succeeded()
+            return results
+
+    def _start_call(self):
+        """
+        Count a call about to be made with the session, renewing the session first if it is used up.
+
+        Renewal waits for the calls in flight, which still use the old session, to finish.
+        """
+        with self._calls_lock:
+            if self.session_pool is None and self.max_session_calls:
+                while self.total_calls >= self.max_session_calls and self._calls_in_flight:
+                    self._calls_lock.wait()
+                if self.total_calls >= self.max_session_calls:
+                    self.close_session()
+            self.total_calls += 1
+            self._calls_in_flight += 1
+
+    def _finish_call(self):
+        """Count a call made with the session as answered."""
+        with self._calls_lock:
+            self._calls_in_flight -= 1
+            self._calls_lock.notify_all()
 
     def print_wsdl(self):
         """Print WSDL information, including methods and types."""
@@ -83,17 +475,20 @@ class Wos():
         else:
             print "Search client not established"
 
-    def search(self, qp, rp, get_metadata=True):
+    def search(self, qp, rp, get_metadata=True, all_pages=True):
         """
         Send search query to WOS and return results object.
 
         Arguments:
         qp (obj) -- QueryParameters object created via query_parameters method.
         rp (obj) -- RetrieveParameters object created via retrieve_parameters method.
+        get_metadata (bool) -- compile and store the records found.
+        all_pages (bool) -- page through all records found; only the first page if False.
         """
         self.qp = qp
         self.rp = rp
         self.get_metadata = get_metadata
+        self.all_pages = all_pages
         if self.client == "Lite":
             self._run_search()
             """
@@ -164,14 +559,11 @@ class Wos():
         return timespan
 
     def _view_fields(self):
-        """Add view fields to retrieve parameters object."""
-        
-
-        #TODO: Complete this method.
-        view_fields = self.search_client.factory.create("viewField")
-        for field in self.view_field:
-            view_fields.fieldName = self.view_fields
-            
+        """Limit the record sections returned to those in self.view_field."""
+        view_field = self.search_client.factory.create("viewField")
+        view_field.collectionName = "WOS"
+        view_field.fieldName = list(self.view_field)
+        self.rp.viewField = [view_field]
 
     def retrieve_parameters(self, first_record=1, count=100, sort_field=None, view_field=None, option=None):
         """
@@ -181,12 +573,15 @@ class Wos():
         first_record (int) -- The number of the first record to return in the search.
         count (int) -- Number of records to return (maximum 100).
         sort_field (list) -- TODO Field to sort by (should be WOS field abbreviation).
-        view_field (list) -- TODO Fields to return in matched records.
+        view_field (list) -- record sections to return, e.g. ["titles", "pub_info"]. Derived from
+            self.metadata_elements if None and only some elements are compiled.
         option (dict) -- TODO Requests for additional metadata.        
         """
         self.first_record = first_record
         self.count = count
         self.sort_field = sort_field
+        if view_field is None and self.metadata_elements != METADATA_ELEMENTS:
+            view_field = view_fields(self.metadata_elements)
         self.view_field = view_field
 
 
@@ -228,24 +623,24 @@ class Wos():
         self.query_language = query_language
         self.query = self.uid
 
-        self.search_results = self.search_client.service.citedReferences(database_id, uid, query_language, rp)
-        self.total_calls += 1
-        time.sleep(self.sleep_time)
+        self.search_results = self._call("citedReferences", database_id, uid, query_language, rp)
 
         self._process_results()
         if self.records_found <> 0:
-            self._get_metadata_citation(self.uid, "backward_citations")
+            self._process_page("backward_citations", uid, 1,
+                               lambda: self._get_metadata_citation(self.uid, "backward_citations"))
 
         if self.records_found > self.count:
-            self._iterations = int(self.records_found / self.rp.count) + 1
+            self._iterations = int(math.ceil(self.records_found / self.rp.count))
             for i in range(1, self._iterations, 1):
+                if self._resume_page("backward_citations", uid, i+1):
+                    continue
                 print "Getting result page {0}".format(i+1)
                 self.rp = self.retrieve_parameters(first_record=1+(i)*self.count, count=self.count, 
                                                   sort_field=self.sort_field, view_field=self.view_field, option=self.option)
-                self.search_client.service.citedReferences(database_id, uid, query_language, self.rp)
-                self.total_calls += 1
-                time.sleep(self.sleep_time)
-                self._get_metadata_citation(self.uid, "backward_citations")
+                self.search_results = self._call("citedReferences", database_id, uid, query_language, self.rp)
+                self._process_page("backward_citations", uid, i+1,
+                                   lambda: self._get_metadata_citation(self.uid, "backward_citations"))
 
 
     def citing_articles(self, uid, rp, database_id="WOS", query_language="en", time_begin="1900-01-01", time_end=None, symbolic_timespan=None):
@@ -278,22 +673,21 @@ class Wos():
         else:
             self.time_span = self.symbolic_timespan
 
-        self.search_results = self.search_client.service.citingArticles(database_id, uid, self.edition_desc, self.time_span, query_language, rp)
-        time.sleep(self.sleep_time)
-        self.total_calls += 1
+        self.search_results = self._call("citingArticles", database_id, uid, self.edition_desc, self.time_span, query_language, rp)
 
         self._process_results()
         if self.records_found <> 0:
-            self._get_metadata(self.uid, "forward_citations")
+            self._process_page("forward_citations", uid, 1, lambda: self._get_metadata(self.uid, "forward_citations"))
 
         if self.records_found > self.count:
-            self._iterations = int(self.records_found / self.rp.count) + 1
+            self._iterations = int(math.ceil(self.records_found / self.rp.count))
             for i in range(1, self._iterations, 1):
+                if self._resume_page("forward_citations", uid, i+1):
+                    continue
                 self.rp = self.retrieve_parameters(first_record=1+(i)*self.count, count=self.count, 
                                                   sort_field=self.sort_field, view_field=self.view_field, option=self.option)
                 self.retrieve(self.query_id, self.rp)
-                time.sleep(self.sleep_time)
-                self._get_metadata(self.uid, "forward_citations")
+                self._process_page("forward_citations", uid, i+1, lambda: self._get_metadata(self.uid, "forward_citations"))
 
 
     def retrieve_by_id(self, uid, rp, query_language="en", database_id="WOS"):
@@ -308,11 +702,89 @@ class Wos():
         query_language (str) -- "en" the only currently allowed value.
         database_id (str) -- from the WOS set of database abbreviations. "WOS" correpsonds to the WOS core collection.
         """
-        self.item = self.search_client.service.retrieveById(database_id, uid, query_language, rp)
-        self.total_calls += 1
+        self.item = self._call("retrieveById", database_id, uid, query_language, rp)
         return self.item
 
 
+    def retrieve_by_ids(self, uids, chunk_size=MAX_RECORDS_PER_CALL, method="retrieveById", category=None,
+                        database_id="WOS", query_language="en", max_query_length=MAX_QUERY_LENGTH):
+        """
+        Fetch the records of many UIDs, packing up to chunk_size UIDs into each call.
+
+        Chunks are requested up to self.workers at a time and the returned records
+        are matched back to the UIDs they belong to.
+
+        Positional arguments:
+        uids (iterable) -- unique IDs of WOS documents; repeated UIDs are fetched once.
+
+        Keyword arguments:
+        chunk_size (int) -- UIDs per call, at most the 100 records a call may return.
+        method (str) -- "retrieveById" to send the UIDs as a list, or "search" to send
+            UT=(uid OR uid ...) queries, which are also kept under max_query_length characters.
+        category (str) -- metadata_collection category to also store the records in, e.g. "search_results".
+        database_id (str) -- from the WOS set of database abbreviations.
+        query_language (str) -- "en" the only currently allowed value.
+        max_query_length (int) -- longest UT= query sent with the "search" method.
+
+        returns:
+            (dict): metadata record of each UID, or None for UIDs that were not found.
+        """
+        seen = set()
+        uids = [uid for uid in uids if not (uid in seen or seen.add(uid))]
+        chunk_size = max(1, min(int(chunk_size), MAX_RECORDS_PER_CALL))
+        chunks = []
+        for uid in uids:
+            if chunks and len(chunks[-1]) < chunk_size and (method != "search" or
+                                                            len(_ut_query(chunks[-1] + [uid])) <= max_query_length):
+                chunks[-1].append(uid)
+            else:
+                chunks.append([uid])
+
+        calls = []
+        for chunk in chunks:
+            rp = self.retrieve_parameters(count=len(chunk))
+            if method == "search":
+                calls.append(("search", (self.query_parameters(_ut_query(chunk), database_id=database_id), rp)))
+            else:
+                calls.append(("retrieveById", (database_id, chunk, query_language, rp)))
+
+        def fetch_chunk(client, call):
+            operation, args = call
+            return self._call(operation, *args, client=client)
+
+        found = dict((uid, None) for uid in uids)
+        pool = WorkerPool(self.workers)
+        for results in pool.imap(fetch_chunk, calls, context=self._worker_client):
+            records = self._compile_records(results)
+            for record in records:
+                uid = record.get("accession_number") or record.get("uid")
+                if uid in found:
+                    found[uid] = record
+            if category is not None:
+                self.store_records(category, records)
+        return found
+
+    def _compile_records(self, results):
+        """
+        Compile the metadata of each record in a retrieveById or search reply.
+
+        Premium records always include accession_number and are labelled with it
+        as their query; Lite records keep their uid field.
+        """
+        if self.client == "Lite":
+            return [dict(record) for record in getattr(results, "records", None) or []]
+        elements = self.metadata_elements
+        if "accession_number" not in elements:
+            elements = ["accession_number"] + elements
+        records = []
+        if getattr(results, "records", None):
+            for record in iter_records(results.records):
+                with self.metrics.timed("compile_metadata"):
+                    metadata = MetaWos(record, None).compile_metadata(metadata_elements=elements)
+                metadata["query"] = metadata["accession_number"]
+                records.append(metadata)
+        return records
+
     def retrieve(self, query_id, rp):
         """
         Retrieve results based on ID from previously run search.
@@ -321,9 +793,7 @@ class Wos():
         query_id (str) -- ID from previously run search.
         rp (obj) -- RetrieveParameters object created via retrieve_parameters method.
         """
-        self.search_results = self.search_client.service.retrieve(query_id, rp)
-        self.total_calls += 1
-        time.sleep(self.sleep_time)
+        self.search_results = self._call("retrieve", query_id, rp)
 
 
     def cited_references_retrieve(self, query_id):
@@ -333,9 +803,7 @@ class Wos():
         Positional arguments:
         query_id (str) -- ID from previously run search.
         """
-        self.search_results = self.search_client.service.citedReferencesRetrieve(query_id)
-        self.total_calls += 1
-        time.sleep(self.sleep_time)
+        self.search_results = self._call("citedReferencesRetrieve", query_id)
 
 
     def _get_uids(self):
@@ -359,16 +827,22 @@ class Wos():
         # It seems results are returned in a totally different format depending on search client used.
         # The 'premium' client ("Search") returns XML of matching records.
         self.crossref = crossref
+        page_records = []
         if self.client == "Search":
-            self.tree = etree.fromstring(self.search_results.records)
-            objectify.deannotate(self.tree, cleanup_namespaces=True)
-            for record in self.tree:
+            # Records are parsed one at a time and freed once compiled.
+            records = iter_records(self.search_results.records)
+            while True:
+                with self.metrics.timed("parse"):
+                    record = next(records, None)
+                if record is None:
+                    break
                 self.meta_record = MetaWos(record, query)
-                article_metadata = self.meta_record.compile_metadata()
+                with self.metrics.timed("compile_metadata"):
+                    article_metadata = self.meta_record.compile_metadata(metadata_elements=self.metadata_elements)
                 if self.citing_metadata:
                     article_metadata["source_id"] = self.uid
 
-                self.metadata_collection[category].append(article_metadata)
+                page_records.append(article_metadata)
 
         # The 'lite' client returns a list of dictionary-like objects
         elif self.client == "Lite":
@@ -376,11 +850,13 @@ class Wos():
                 article_metadata = dict(record)
                 if self.crossref:
                     abstract = CrossRef.get_abstract(article_metadata)
-                self.metadata_collection[category].append(article_metadata)
+                page_records.append(article_metadata)
 
         else:
             print "Inappropriate method for metadata retrieval: {0}".format(self.client)
 
+        self.store_records(category, page_records)
+
     def _get_metadata_citation(self, query, category):
         """
         Special metadata processing for meager results from citedReferences search.
@@ -388,6 +864,7 @@ class Wos():
         query (str) -- key search term that produced the results.
         category (str) -- the container in which to store the gathered metadata. See self.metadata_collection template in __init__.
         """
+        page_records = []
         for item in self.search_results.references:
             meta_record = {"docid":"",
                            "citedAuthor":"",
@@ -408,7 +885,29 @@ class Wos():
                     meta_record[key] = "NONE"
                     
             meta_record["source_id"] = self.uid
-            self.metadata_collection[category].append(meta_record)
+            page_records.append(meta_record)
+
+        self.store_records(category, page_records)
+
+    def store_records(self, category, records):
+        """
+        Store one page's records: write them to the category's sink, if any, and keep
+        them in metadata_collection unless keep_records is off.
+
+        Positional arguments:
+        category (str) -- metadata_collection category, e.g. "search_results".
+        records (list) -- metadata dictionaries.
+        """
+        if not records:
+            return
+        if self._page_records is not None:
+            self._page_records.setdefault(category, []).extend(records)
+        if category in self.sinks:
+            self.sinks[category].write(records)
+        if self.keep_records:
+            self.metadata_collection[category].extend(records)
+        if self.title_index is not None and category in INDEXED_CATEGORIES:
+            self.title_index.add_records(records)
 
 
     def get_full_record(self):
@@ -419,6 +918,14 @@ class Wos():
         Search 1: journal_title AND pub_year AND title
         Search 2: journal_title AND title
         Search 3: title
+
+        With speculative_cascade on, the three searches are sent at once and the
+        replies of searches that turn out not to be needed are discarded.
+
+        With a title index, a reference matching one harvested record in title, year
+        and journal is resolved from it without searching. The outcome for each
+        reference is remembered, so a reference cited again in the same run is not
+        searched again.
         """
         booleans = ["and", "near", "or", "not"]
 
@@ -434,10 +941,28 @@ class Wos():
         else:
             pub_year = "NONE"
 
+        reference = (record_title, pub_year, journal_title)
+        if reference in self._full_record_outcomes:
+            self._store_full_record(self._full_record_outcomes[reference])
+            return
+
+        if self.title_index is not None:
+            match = self.title_index.match(self.hot_item["citedTitle"], year=pub_year, source=journal_title)
+            if match is not None:
+                metadata = dict(match)
+                metadata["query"] = record_title
+                self._full_record_outcomes[reference] = metadata
+                self._store_full_record(metadata)
+                return
+
         self.rp_title_search = self.retrieve_parameters(count="1")
         try:
+            # Searches 1 to 3 at once
+            if self.speculative_cascade:
+                self._run_full_record_cascade(record_title, pub_year, journal_title)
+
             # Search 1
-            if self._run_full_record_search(record_title, pub_year=pub_year, journal_title=journal_title) >= 1:
+            elif self._run_full_record_search(record_title, pub_year=pub_year, journal_title=journal_title) >= 1:
                 self.tree = etree.fromstring(self.title_search_results.records)
 
             # Search 2
@@ -448,15 +973,18 @@ class Wos():
             else:
                 self._run_full_record_search(record_title)
 
-            self.tree = etree.fromstring(self.title_search_results.records)
-
+            outcome = None
             if self.search_count == 1:
+                self.tree = etree.fromstring(self.title_search_results.records)
                 for record in self.tree:
                     
                     self.title_meta_record = MetaWos(record, record_title)
-                    self.title_metadata = self.title_meta_record.compile_metadata()
-                    self.title_metadata["source_id"] = self.uid
-                    self.metadata_collection["hot_records"].append(self.title_metadata)
+                    outcome = self.title_meta_record.compile_metadata(metadata_elements=self.metadata_elements)
+            self._full_record_outcomes[reference] = outcome
+            self._store_full_record(outcome)
+
+        except BudgetExhausted:
+            raise
 
         except Exception as e:
             print "*******************ERROR*************************"
@@ -464,6 +992,14 @@ class Wos():
             print e
             print "*************************************************"
 
+    def _store_full_record(self, metadata):
+        """Store a copy of a hot reference's resolved record, if any, as cited by self.uid."""
+        if metadata is None:
+            return
+        self.title_metadata = dict(metadata)
+        self.title_metadata["source_id"] = self.uid
+        self.store_records("hot_records", [self.title_metadata])
+
     def advanced_search(self, data, fields=["author"]):
         """
         Run search based on supplied data (containing search fields and values) and a list of terms (drawn from the data) to search on.
@@ -483,6 +1019,42 @@ class Wos():
         return " AND ".join(["{0}={1}".format(field_abbrevs[field], data[field]) for field in fields])
 
 
+    def _run_full_record_cascade(self, record_title, pub_year, journal_title):
+        """
+        Run searches 1 to 3 concurrently and keep the first one finding any records.
+
+        The outcome is the same as running them one after another, but a reference
+        falling through to search 3 waits for one round trip instead of three. Each
+        search is still spaced out by the rate limiter and counted as a call.
+
+        Positional arguments:
+        record_title (str) -- cleaned cited title.
+        pub_year (str) -- cited publication year.
+        journal_title (str) -- cited source title.
+        """
+        queries = [u"TI=({0}) AND PY=({1}) AND SO=({2})".format(record_title, pub_year, journal_title),
+                   u"TI=({0}) AND SO=({1})".format(record_title, journal_title),
+                   u"TI=({0})".format(record_title)]
+        calls = [self.query_parameters(query, database_id="WOK") for query in queries]
+        if self._cascade_clients is None:
+            self._cascade_clients = [self._worker_client() for query in queries]
+
+        def fetch_tier(item):
+            client, qp = item
+            try:
+                return self._call("search", qp, self.rp_title_search, client=client)
+            except Exception as e:
+                # Only raised if this search's reply is needed.
+                return e
+
+        for results in WorkerPool(len(calls)).map(fetch_tier, zip(self._cascade_clients, calls)):
+            if isinstance(results, Exception):
+                raise results
+            if results.recordsFound >= 1:
+                break
+        self.title_search_results = results
+        self.search_count = results.recordsFound
+
     def _run_full_record_search(self, record_title, pub_year=None, journal_title=None):
         """
         Run any of 3 searches, more or less stringent, depending on parameters passed in.
@@ -497,22 +1069,16 @@ class Wos():
         if pub_year:
             self.qp_title_search = self.query_parameters(u"TI=({0}) AND PY=({1}) AND SO=({2})".format(record_title, pub_year, journal_title), database_id="WOK")
             self.title_search_results = self.search(self.qp_title_search, self.rp_title_search, get_metadata=False)
-            time.sleep(self.sleep_time)
-            self.total_calls += 1
             search_count = self.search_results.recordsFound
 
         elif journal_title:
             self.qp_title_search = self.query_parameters(u"TI=({0}) AND SO=({1})".format(record_title, journal_title), database_id="WOK")
             self.title_search_results = self.search(self.qp_title_search, self.rp_title_search, get_metadata=False)
-            time.sleep(self.sleep_time)
-            self.total_calls += 1
             search_count = self.search_results.recordsFound
 
         else:
             self.qp_title_search = self.query_parameters(u"TI=({0})".format(record_title), database_id="WOK")
             self.title_search_results = self.search(self.qp_title_search, self.rp_title_search, get_metadata=False)
-            time.sleep(self.sleep_time)
-            self.total_calls += 1
             search_count = self.search_results.recordsFound
 
         self.search_count = search_count
@@ -520,24 +1086,118 @@ class Wos():
 
     def _run_search(self):
         """Run search page by page until all results are retrieved."""
-        self.search_results = self.search_client.service.search(self.qp, self.rp)
+        self.search_results = self._call("search", self.qp, self.rp)
         if self.get_metadata and hasattr(self.search_results, "records"):
-            self._get_metadata(self.query, "search_results")
-        self.total_calls += 1
-        time.sleep(self.sleep_time)
+            self._process_page("search_results", self.query, 1, lambda: self._get_metadata(self.query, "search_results"))
 
         self._process_results()
 
-        if self.records_found > self.count:
-            self._iterations = int(self.records_found / self.rp.count) + 1
+        if not self.all_pages:
+            return
+
+        elif self.records_found > self.count and self.workers > 1:
+            self._run_search_concurrently()
+
+        elif self.records_found > self.count:
+            self._iterations = int(math.ceil(self.records_found / self.rp.count))
             for i in range(1, self._iterations, 1):
+                if self.get_metadata and self._resume_page("search_results", self.query, i+1):
+                    continue
                 print "Getting result page {0}".format(i+1)
 
                 self.rp = self.retrieve_parameters(first_record=1+(i)*self.count, count=self.count, 
                                                   sort_field=self.sort_field, view_field=self.view_field, option=self.option)
                 self.retrieve(self.query_id, self.rp)
                 if self.get_metadata:
-                    self._get_metadata(self.query, "search_results")
+                    self._process_page("search_results", self.query, i+1,
+                                       lambda: self._get_metadata(self.query, "search_results"))
+
+    def _run_search_concurrently(self):
+        """
+        Retrieve remaining result pages through a pool of worker threads.
+
+        Pages are requested up to self.workers at a time, each worker using its own
+        clone of the search client, and are processed in page order as they arrive.
+        Pages already in the checkpoint journal are restored instead of requested.
+        """
+        query_id = self.query_id
+        count = int(self.count)
+        pages = []
+        for page, first_record in enumerate(range(1 + count, self.records_found + 1, count), 2):
+            if self.get_metadata and self._page_checkpointed("search_results", self.query, page):
+                pages.append((page, None))
+            else:
+                pages.append((page, self.retrieve_parameters(first_record=first_record, count=count, sort_field=self.sort_field,
+                                                             view_field=self.view_field, option=self.option)))
+
+        def fetch_page(client, item):
+            page, rp = item
+            if rp is None:
+                return None
+            return self._call("retrieve", query_id, rp, client=client)
+
+        pool = WorkerPool(self.workers)
+        for (page, rp), results in zip(pages, pool.imap(fetch_page, pages, context=self._worker_client)):
+            if rp is None:
+                self._resume_page("search_results", self.query, page)
+                continue
+            print "Getting result page {0}".format(page)
+            self.search_results = results
+            if self.get_metadata:
+                self._process_page("search_results", self.query, page,
+                                   lambda: self._get_metadata(self.query, "search_results"))
+
+    def _worker_client(self):
+        """Return a clone of the search client for a worker thread, sending the session cookie."""
+        client = self.search_client.clone()
+        if self.backend == "suds" and not isinstance(self.transport, PooledHttpTransport):
+            # suds gives clones a bare transport; use the opener holding the SID cookie.
+            http = HttpTransport()
+            http.urlopener = self.transport.urlopener
+            client.set_options(transport=http)
+        return client
+
+    def _page_checkpointed(self, task, key, page):
+        """Check whether a result page is recorded in the checkpoint journal."""
+        return self.checkpoint is not None and self.checkpoint.page(task, key, page) is not None
+
+    def _resume_page(self, task, key, page):
+        """
+        Restore a result page's metadata from the checkpoint journal.
+
+        returns:
+            (bool): whether the page was found in the journal.
+        """
+        if not self._page_checkpointed(task, key, page):
+            return False
+        for category, records in self.checkpoint.page(task, key, page).items():
+            self.store_records(category, records)
+        return True
+
+    def _process_page(self, task, key, page, process):
+        """
+        Store a result page's metadata and record it in the checkpoint journal.
+
+        If the page is already in the journal its metadata is restored from there instead.
+
+        Positional arguments:
+        task (str) -- kind of work, e.g. "search_results".
+        key (str) -- query string or UID the page belongs to.
+        page (int) -- page number, starting at 1.
+        process (callable) -- stores the current page's metadata through store_records.
+        """
+        if self._resume_page(task, key, page):
+            return
+        if self.checkpoint is None:
+            process()
+            return
+        self._page_records = {}
+        try:
+            process()
+            metadata = self._page_records
+        finally:
+            self._page_records = None
+        self.checkpoint.record_page(task, key, page, metadata)
 
     def _process_results(self):
 
@@ -1,22 +1,62 @@
-from wos import Wos
+from wos import Wos, MAX_QUERY_LENGTH
+from checkpoint import CheckpointJournal
+from sinks import TsvSink
+from snowball import SnowballCrawler, record_uid, times_cited
+from sharding import ShardedSearch, MAX_RETRIEVABLE
 import os
-from datetime import datetime
+from datetime import date, datetime
 import json
 from metawoslite import MetaWosLite
-from sift import SiftSearchResults
+from sift import CandidateFeatures, SiftSearchResults, assess_matches, match_label, query_clauses, score_candidates
 import time
 
+# Symbolic time spans of records loaded recently, by the number of days they cover.
+SYMBOLIC_TIMESPANS = ((7, "1week"), (14, "2week"), (28, "4week"))
+
+
+def symbolic_timespan(days):
+    """Return the shortest symbolic time span covering the given number of days, or None if none does."""
+    for limit, timespan in SYMBOLIC_TIMESPANS:
+        if days < limit:
+            return timespan
+    return None
+
 
 class WosCalls():
     """Run searches against the WOS API using the Wos class."""
 
-    def __init__(self, search_queries=None, search_term_sets=None, sleep_time=1, database_id="WOS", search_client="Lite"):
+    def __init__(self, search_queries=None, search_term_sets=None, sleep_time=1, database_id="WOS", search_client="Lite",
+                 workers=1, rate_limiter=None, keep_alive=False, session_pool=None, response_cache=None,
+                 checkpoint_file=None, backend="suds", base_url="http://search.webofknowledge.com/esti/wokmws/ws",
+                 metrics=None, compact_records=False, metadata_elements=None, sinks=None, keep_records=True,
+                 call_budget=None, title_index=None, speculative_cascade=False, max_session_calls=2000):
         """
         Initialize search queries.
 
         Keyword arguments:
         search_queries (list) -- Provide fully created queries in a list.
         search_terms (list) -- Provide series of searches as key-value pairs in a list.
+        workers (int) -- result pages to request at once for large searches.
+        rate_limiter (RateLimiter) -- shared limiter spacing API calls; built from sleep_time if omitted.
+        keep_alive (bool) -- reuse persistent HTTP connections for API calls.
+        session_pool (SessionPool) -- spread calls over several sessions renewed in the background.
+        response_cache (ResponseCache) -- answer repeated API calls from stored replies.
+        checkpoint_file (str) -- journal of completed work; a restarted run skips what it records.
+        backend (str) -- "suds", or "lxml" to build and parse SOAP messages without suds.
+        base_url (str) -- location of the web services, e.g. a MockWosServer's base_url for testing.
+        metrics (WosMetrics) -- collects call counts, latencies, bytes and timings; see self.wos.metrics.
+        compact_records (bool) -- store gathered metadata column-wise to reduce memory use.
+        metadata_elements (list) -- metadata elements to gather, e.g. ["accession_number", "times_cited"];
+            only the record sections they need are downloaded.
+        sinks (dict) -- TsvSink or JsonLinesSink objects by category, e.g. {"search_results": sink},
+            written to as each result page is parsed.
+        keep_records (bool) -- keep records in memory as well as writing them to sinks.
+        call_budget (CallBudget) -- hard limit on API calls made through self.wos.
+        title_index (TitleIndex) -- resolve hot cited references from harvested records by title
+            before searching the API for them.
+        speculative_cascade (bool) -- send the title searches for a hot cited reference at once.
+        max_session_calls (int) -- calls after which the session is renewed, including calls made by
+            parallel workers; WOS limits the calls per session. None never renews it.
         """
         self.search_queries = search_queries
         self.search_term_sets = search_term_sets
@@ -24,7 +64,15 @@ class WosCalls():
             print "No searches provided. Include either 'search_queries' or 'search_terms' in argument."
         self.search_client = search_client
         self.database_id = database_id
-        self.wos = Wos(sleep_time=sleep_time, client=self.search_client)
+        self.checkpoint = CheckpointJournal(checkpoint_file) if checkpoint_file else None
+        self.wos = Wos(sleep_time=sleep_time, client=self.search_client, workers=workers,
+                       rate_limiter=rate_limiter, keep_alive=keep_alive, session_pool=session_pool,
+                       response_cache=response_cache, checkpoint=self.checkpoint,
+                       backend=backend, base_url=base_url, metrics=metrics,
+                       compact_records=compact_records, metadata_elements=metadata_elements,
+                       sinks=sinks, keep_records=keep_records, call_budget=call_budget,
+                       title_index=title_index, speculative_cascade=speculative_cascade,
+                       max_session_calls=max_session_calls)
         self.wos.authorize()
         self.wos.retrieve_parameters()
 
@@ -35,10 +83,127 @@ class WosCalls():
         self.total_results = 0
 
         for search_query in self.search_queries:
+            if self._finished("search_results", search_query):
+                self.total_results += self.checkpoint.result("search_results", search_query)["records_found"]
+                continue
             self.__run_search(search_query)
+            self._finish("search_results", search_query, {"records_found": self.wos.records_found})
+
+        print "Process complete."
+        print "Returned {0} records".format(self.total_results)
+
+    def get_sharded_search_results(self, max_records=MAX_RETRIEVABLE, workers=1, time_begin="1900-01-01",
+                                   time_end=None):
+        """
+        Return all results from queries defined in __init__, splitting each into load date ranges searched at once.
+
+        Keyword arguments:
+        max_records (int) -- most records found per date range; WOS retrieves no more than 100,000 per query.
+        workers (int) -- date ranges searched at once.
+        time_begin (str) -- first load date to harvest, in YYYY-MM-DD format.
+        time_end (str) -- last load date to harvest, in YYYY-MM-DD format; today if None.
+
+        returns:
+            (list): ShardedSearch of each query, e.g. to inspect its shards.
+        """
+        self.total_results = 0
+        searches = []
+        for search_query in self.search_queries:
+            if self._finished("search_results", search_query):
+                self.total_results += self.checkpoint.result("search_results", search_query)["records_found"]
+                continue
+            search = ShardedSearch(self.wos, search_query, time_begin=time_begin, time_end=time_end,
+                                   max_records=max_records, workers=workers, database_id=self.database_id)
+            stored = search.harvest()
+            self.total_results += stored
+            searches.append(search)
+            self._finish("search_results", search_query, {"records_found": stored})
 
         print "Process complete."
         print "Returned {0} records".format(self.total_results)
+        return searches
+
+    def get_incremental_search_results(self, state_file, time_begin="1900-01-01"):
+        """
+        Fetch only the records of queries defined in __init__ that are new since their last run.
+
+        The date each query was last harvested is kept in state_file. A query
+        not found there is harvested in full from time_begin. Otherwise the
+        records loaded within the shortest symbolic time span ("1week", "2week"
+        or "4week") covering the days since are fetched, or, after more than
+        four weeks, those with a load date (the date timeSpan filters on) from
+        the last run on. A query's date only moves on once its search has
+        completed.
+
+        Records already in search_results are updated in place, e.g. with a
+        new times_cited, rather than added again, also in CompactRecords. Sinks
+        receive every record fetched, so a SqliteStore upserts them. Fetched
+        pages are not recorded in the checkpoint journal, whose pages of an
+        earlier run would otherwise be replayed.
+
+        Positional arguments:
+        state_file (str) -- JSON file of each query's last run; created if missing.
+
+        Keyword arguments:
+        time_begin (str) -- first load date for queries not run before, in YYYY-MM-DD format.
+
+        returns:
+            (dict): records found, added and updated by each query.
+        """
+        state = json.load(open(state_file, "r")) if os.path.exists(state_file) else {}
+        collection = self.wos.metadata_collection["search_results"]
+        known = dict((record_uid(record), index) for index, record in enumerate(collection))
+        checkpoint = self.wos.checkpoint
+        self.total_results = 0
+        summary = {}
+        for search_query in self.search_queries:
+            started = date.today()
+            timespan = None
+            begin = time_begin
+            last_run = state.get(search_query, {}).get("last_run")
+            if last_run is not None:
+                begin = last_run
+                timespan = symbolic_timespan((started - datetime.strptime(last_run, "%Y-%m-%d").date()).days)
+
+            fetched = self.wos.metadata_collection["search_results"] = []
+            self.wos.checkpoint = None
+            try:
+                self.wos.query_parameters(search_query, time_begin=begin, database_id=self.database_id,
+                                          symbolic_timespan=timespan)
+                self.wos.search(self.wos.qp, self.wos.retrieve_parameters())
+            finally:
+                self.wos.metadata_collection["search_results"] = collection
+                self.wos.checkpoint = checkpoint
+            self.total_results += self.wos.records_found
+
+            added = updated = 0
+            for record in fetched:
+                uid = record_uid(record)
+                if uid not in known:
+                    known[uid] = len(collection)
+                    collection.append(record)
+                    added += 1
+                    continue
+                # Assigned back for CompactRecords, whose records are copies.
+                stored = collection[known[uid]]
+                if stored.get("times_cited") != record.get("times_cited"):
+                    updated += 1
+                stored.update(record)
+                collection[known[uid]] = stored
+
+            summary[search_query] = {"records_found": self.wos.records_found, "added": added, "updated": updated}
+            state[search_query] = dict(summary[search_query], last_run=started.isoformat(),
+                                       time_span=timespan or begin)
+            # Replace the state file in one step, so an interrupted write leaves the previous one.
+            with open(state_file + ".tmp", "w") as fh:
+                json.dump(state, fh, indent=2, sort_keys=True)
+            os.rename(state_file + ".tmp", state_file)
+            print "{0}: {1} new, {2} updated since {3}".format(search_query.encode("ascii", "ignore"), added,
+                                                                updated, timespan or begin)
+
+        print "Process complete."
+        print "Returned {0} records".format(self.total_results)
+        return summary
 
     def __run_search(self, query):
         """
@@ -50,77 +215,123 @@ class WosCalls():
         self.wos.query_parameters(query, database_id=self.database_id)
         self.wos.search(self.wos.qp, self.wos.retrieve_parameters())
         self.total_results += self.wos.records_found
-        # WOS imposes a limit on number of searches per session -- check after each query
-        # and restart session if necessary.
-        self.check_session()
 
-    def find_exact_match(self):
+    def find_exact_match(self, batch_size=1):
         """Search for known item.
 
         If more than one result returned, sift through results to find most appropriate match.
         If one record can't be isolated store all best guesses as matches for further manual editing.
+        Results are ranked by sift.score_candidates, and each match keeps its score as wos_match_score.
+
+        With a batch_size above 1, the queries of up to batch_size rows are OR'd into one
+        search and the records found are assigned to rows locally by checking them against
+        each row's AU=, PY= and SO= clauses. A row is only settled from the batch if an
+        assigned record is an exact match (volume and page agree), and only then are its
+        records stored in search_results and counted in total_results. Batches finding more
+        than one page of records are split, and rows with other query syntax, or without
+        an exact match among their records, are searched on their own.
+
+        Keyword arguments:
+        batch_size (int) -- rows to look up per search.
         """
         self.total_results = 0
         self.article_data = {}
         count = 0
         errors = 0
+        batch = []
         for search_data in self.search_term_sets:
             count += 1
             print count,
-            all_results = []
             self.search_data_update = search_data.copy()
-            try:
-                self.__run_search(search_data["query"])
-
-                # Return 1 result, assume with reasonable confidence this is the
-                # 'correct' hit.
-                if self.wos.records_found == 1:
-                    metalite = MetaWosLite(dict(self.wos.search_results.records[0]))
-                    wos_metadata = metalite.get_metadata()
-                    self.search_data_update.update(wos_metadata)
-                    # TODO Fix result count. It always comes out 1.
-                    self.search_data_update["wos_result_count"] = 1
-                    all_results = [self.search_data_update]
-
-                # With more than 1 results, attempt to sift to find 1 correct, or several
-                # plausible results to store.
-                elif self.wos.records_found > 1:
-                    result_count = 0
-                    for search_record in self.wos.search_results.records:
-
-                        metalite = MetaWosLite(dict(search_record))
-                        wos_metadata = metalite.get_metadata()
-                        sifter = SiftSearchResults(self.search_data_update, wos_metadata)
-                        sift_result = sifter.assess_match()
-                        print "----{0}".format(sift_result)
-                        if sift_result == "exact_match":
-                            self.search_data_update.update(wos_metadata)
-                            result_count = 1
-                            all_results = [self.search_data_update]
-                            break
-
-                        elif sift_result == "probable_match":
-                            result_count += 1
-                            pmatch = self.search_data_update.copy()
-                            pmatch.update(wos_metadata)
-
-                            all_results.append(pmatch)
-
-                    print "----Storing {0} record(s)".format(len(all_results))
-                else:
-                    all_results = [self.search_data_update]
-
-                self.article_data[search_data["id"]] = all_results
-            
-            except Exception as e:
-                print e
-                if "Throttle" in e or "throttle" in e:
-                    time.sleep(60)
-                errors += 1
+            if self._finished("exact_match", search_data["id"]):
+                self.checkpoint.replay("search_results", search_data["query"], self.wos.store_records)
+                self.article_data[search_data["id"]] = self.checkpoint.result("exact_match", search_data["id"])
+                continue
+            if batch_size > 1 and query_clauses(search_data["query"]) is not None:
+                batch.append(search_data)
+                if len(batch) == batch_size:
+                    errors += self._match_batch(batch)
+                    batch = []
+            else:
+                errors += self._match_row(search_data)
+        if batch:
+            errors += self._match_batch(batch)
 
         #print self.article_data
         print "Processed {0} records, Encountered {1} errors.".format(count, errors)
 
+    def _match_row(self, search_data):
+        """
+        Look up one known item with its own query.
+
+        returns:
+            (int): errors encountered, 0 or 1.
+        """
+        try:
+            self.__run_search(search_data["query"])
+            wos_records = [MetaWosLite(dict(record)).get_metadata()
+                           for record in getattr(self.wos.search_results, "records", None) or []]
+            all_results = assess_matches(search_data, wos_records, self.wos.records_found)
+            self.article_data[search_data["id"]] = all_results
+            self._finish("exact_match", search_data["id"], all_results)
+
+        except Exception as e:
+            print e
+            if "Throttle" in e or "throttle" in e:
+                time.sleep(60)
+            return 1
+        return 0
+
+    def _match_batch(self, rows):
+        """
+        Look up several known items with one OR'd query.
+
+        returns:
+            (int): errors encountered.
+        """
+        query = u" OR ".join(u"({0})".format(row["query"]) for row in rows)
+        if len(rows) == 1 or len(query) > MAX_QUERY_LENGTH:
+            return self._split_batch(rows)
+        try:
+            self.wos.query_parameters(query, database_id=self.database_id)
+            self.wos.search(self.wos.qp, self.wos.retrieve_parameters(), get_metadata=False, all_pages=False)
+        except Exception as e:
+            print e
+            return self._split_batch(rows)
+        if self.wos.records_found > self.wos.count:
+            return self._split_batch(rows)
+
+        records = [dict(record) for record in getattr(self.wos.search_results, "records", None) or []]
+        candidates = CandidateFeatures([MetaWosLite(record).get_metadata() for record in records])
+        errors = 0
+        for row in rows:
+            clauses = query_clauses(row["query"])
+            hits = [i for i, wos_metadata in enumerate(candidates.records)
+                    if SiftSearchResults(row, wos_metadata).matches_query(clauses)]
+            row_candidates = candidates.subset(hits)
+            if not any(match_label(features) == "exact_match"
+                       for score, features in score_candidates(row, row_candidates)):
+                # WOS may match more loosely than the local check, e.g. by stemming or phrase
+                # handling, so rows without a verified match are left to their own query.
+                errors += self._match_row(row)
+                continue
+            # A settled row keeps the records assigned to it, as its own search would.
+            row_records = [dict(records[i]) for i in hits]
+            self.wos._process_page("search_results", row["query"], 1,
+                                   lambda: self.wos.store_records("search_results", row_records))
+            self.total_results += len(hits)
+            all_results = assess_matches(row, row_candidates, len(hits))
+            self.article_data[row["id"]] = all_results
+            self._finish("exact_match", row["id"], all_results)
+        return errors
+
+    def _split_batch(self, rows):
+        """Look up the halves of a batch separately, and a single row with its own query."""
+        if len(rows) == 1:
+            return self._match_row(rows[0])
+        middle = len(rows) // 2
+        return self._match_batch(rows[:middle]) + self._match_batch(rows[middle:])
+
 
     def run_phylo_process(self):
         """
@@ -131,10 +342,37 @@ class WosCalls():
             query = self.wos.advanced_search(search_term_set, fields=["author", "source", ""])
 
 
+    def _finished(self, task, key):
+        """
+        Restore completed work for a query or UID from the checkpoint journal.
+
+        args:
+            task (str): kind of work, e.g. "search_results" or "forward_citations".
+            key (str): query string or UID.
+
+        returns:
+            (bool): whether the work was already complete.
+        """
+        if self.checkpoint is None or not self.checkpoint.is_complete(task, key):
+            return False
+        self.checkpoint.replay(task, key, self.wos.store_records)
+        return True
+
+    def _finish(self, task, key, result=None):
+        """Record completed work for a query or UID in the checkpoint journal."""
+        if self.checkpoint is not None:
+            self.checkpoint.complete(task, key, result)
+
     def check_session(self):
-        """If session has lasted too long, break and restart session."""
-        if self.wos.total_calls > 2000:
+        """
+        If session has lasted too long, break and restart session.
 
+        The workflows do not need this: calls reaching max_session_calls renew the session
+        themselves, including those of parallel workers, and a session pool renews its sessions
+        in the background. Nothing is renewed when max_session_calls is None.
+        """
+        if self.wos.session_pool is None and self.wos.max_session_calls is not None and \
+                self.wos.total_calls > self.wos.max_session_calls:
             self.wos.close_session()
 
 
@@ -142,13 +380,35 @@ class WosCalls():
 
         for record in self.wos.metadata_collection["search_results"]:
             uid = record["accession_number"]
+            if self._finished("forward_citations", uid):
+                continue
             self.wos.citing_articles(uid, self.wos.retrieve_parameters())
-            self.check_session()
+            self._finish("forward_citations", uid)
 
         print "Process complete."
         print "Searched {0} UIDs".format(len(self.wos.metadata_collection["search_results"]))
 
 
+    def snowball(self, direction="forward", depth=2, max_calls=None, workers=1, score=times_cited):
+        """
+        Crawl citations of the search results over several hops, most cited first.
+
+        Keyword arguments:
+        direction (str) -- "forward" for citing articles, "backward" for cited references, or "both".
+        depth (int) -- citation hops to expand from the search results.
+        max_calls (int) -- hard limit on API calls for the crawl; unlimited if None.
+        workers (int) -- records expanded at once.
+        score (callable) -- priority of a record, higher first; times cited if not given.
+
+        returns:
+            (SnowballCrawler): the finished crawl, e.g. to inspect crawler.depths.
+        """
+        crawler = SnowballCrawler(self.wos, direction=direction, depth=depth, max_calls=max_calls,
+                                  workers=workers, score=score)
+        crawler.add_seeds(self.wos.metadata_collection["search_results"])
+        crawler.crawl()
+        return crawler
+
     def get_cited_references(self, get_full_records=True, json_file=None):
         """
         Get all citations mentioned in a given article.
@@ -166,10 +426,12 @@ class WosCalls():
         for index, record in enumerate(search_returns):
             print "Record", index
             uid = record["accession_number"]
+            if self._finished("backward_citations", uid):
+                continue
             self.wos.cited_references(uid, self.wos.retrieve_parameters(option={"key": "Hot", "value": "On"}),
                                       database_id="WOS",
                                       get_full_records=get_full_records)
-            self.check_session()
+            self._finish("backward_citations", uid)
 
         print "Process complete."
         print "Searched {0} UIDs".format(len(self.wos.metadata_collection["search_results"]))
@@ -180,19 +442,18 @@ class WosCalls():
             output_file = os.path.join(".", "{0}_results_{1}.tsv".format(search_type, datetime.now()
                                        .strftime("%Y-%m-%d-%H%M")))
 
-        if not self.wos.metadata_collection[search_type]:
+        records = self.wos.metadata_collection[search_type]
+        if not records:
             print "No search results to process."
 
         else:
-            with open(output_file, "w") as fh:
-                fh.write("\t".join(self.wos.metadata_collection[search_type][0].keys()) + "\n")
-                for record in self.wos.metadata_collection[search_type]:
-                    fh.write("\t".join([record[i] for i in record]).encode("utf8"))
-                    """
-                    for item in record:
-                        fh.write((record[item] + "\t").encode("utf8"))
-                    """
-                    fh.write("\n")
+            # Columns are every field seen, in order of first appearance, and each
+            # row is written in that order.
+            fields = []
+            for record in records:
+                fields.extend(field for field in record if field not in fields)
+            with TsvSink(output_file, fields) as sink:
+                sink.write(records)
 
     def make_cited_records_tsv(self, output_file=None):
         pass